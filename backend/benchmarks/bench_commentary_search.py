@@ -0,0 +1,103 @@
+"""
+Commentary search benchmark: inverted index vs LIKE scan.
+
+Builds a commentary corpus of --docs entries in memory with a Zipf-shaped
+vocabulary (real ball-by-ball commentary is a few hundred thousand entries
+of 15-40 words), indexes it with the commentary_postings builder from
+scripts/build_derived_tables.py, and times commentary_phrase() and
+commentary_search() against the equivalent LIKE / ILIKE scans for phrases of
+different frequency. Reports p50 latency and matches per query, so the
+schema prompt's advice on when to use the index can be checked.
+
+Usage (from backend/):
+    python benchmarks/bench_commentary_search.py
+    python benchmarks/bench_commentary_search.py --docs 1000000 --repeat 9
+"""
+import argparse
+import os
+import sys
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+from build_derived_tables import build_commentary_index  # noqa: E402
+
+VOCABULARY = 20000
+WORDS_PER_ENTRY = (15, 40)
+# Phrase -> share of entries it is planted in
+PHRASES = {
+    "slower ball": 0.08,
+    "knuckle ball": 0.005,
+    "carrom ball outside off": 0.0005,
+    "dropped at long on": 0.00005,
+}
+
+
+def build_corpus(con, docs: int, seed: int = 7):
+    """Creates commentary (plus the matches/balls tables the builder joins) with `docs` entries."""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"w{i}" for i in range(VOCABULARY)], dtype=object)
+    lengths = rng.integers(*WORDS_PER_ENTRY, docs)
+    words = vocabulary[np.minimum(rng.zipf(1.3, lengths.sum()), VOCABULARY) - 1]
+    texts = [" ".join(chunk) for chunk in np.split(words, np.cumsum(lengths)[:-1])]
+    for phrase, share in PHRASES.items():
+        for i in np.flatnonzero(rng.random(docs) < share):
+            texts[i] = f"{texts[i]}, {phrase}"
+
+    con.execute("CREATE TABLE matches (match_id VARCHAR, date DATE)")
+    con.execute("""CREATE TABLE balls (match_id VARCHAR, innings INTEGER, "over" INTEGER, ball INTEGER,
+                   batter VARCHAR, bowler VARCHAR, runs_off_bat INTEGER, wicket_type VARCHAR)""")
+    corpus = pd.DataFrame({
+        "commentary_id": [f"c{i}" for i in range(docs)],
+        "cricsheet_match_id": [f"m{i // 240}" for i in range(docs)],
+        "innings": 1,
+        "over": (np.arange(docs) % 240) // 6,
+        "ball": np.arange(docs) % 6 + 1,
+        "text": texts,
+    })
+    con.execute("CREATE TABLE commentary AS SELECT * FROM corpus")
+
+
+def timed(con, sql: str, repeat: int) -> tuple:
+    rows = con.execute(sql).fetchone()[0]
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        con.execute(sql).fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times)), rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=300000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    con = duckdb.connect()
+    start = time.perf_counter()
+    build_corpus(con, args.docs)
+    print(f"Corpus: {args.docs:,} entries in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    build_commentary_index(con)
+    postings = con.execute("SELECT COUNT(*) FROM commentary_postings").fetchone()[0]
+    print(f"Index: {postings:,} postings in {time.perf_counter() - start:.1f}s\n")
+
+    print(f"{'phrase':<26}{'share':>8}{'matches':>9}{'phrase ms':>11}{'LIKE ms':>9}{'ILIKE ms':>10}"
+          f"{'search ms':>11}{'top-10 ms':>11}")
+    for phrase, share in PHRASES.items():
+        phrase_ms, matches = timed(con, f"SELECT COUNT(*) FROM commentary_phrase('{phrase}')", args.repeat)
+        like_ms, _ = timed(con, f"SELECT COUNT(*) FROM commentary WHERE text LIKE '%{phrase}%'", args.repeat)
+        ilike_ms, _ = timed(con, f"SELECT COUNT(*) FROM commentary WHERE text ILIKE '%{phrase}%'", args.repeat)
+        search_ms, _ = timed(con, f"SELECT COUNT(*) FROM commentary_search('{phrase}')", args.repeat)
+        top_ms, _ = timed(con, f"SELECT COUNT(*) FROM (SELECT * FROM commentary_phrase('{phrase}') "
+                               f"ORDER BY score DESC LIMIT 10)", args.repeat)
+        print(f"{phrase:<26}{share:>8.3%}{matches:>9,}{phrase_ms:>11.1f}{like_ms:>9.1f}{ilike_ms:>10.1f}"
+              f"{search_ms:>11.1f}{top_ms:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+JSON encoding benchmark for /analyze-style responses.
+
+Compares the old response path (pydantic validation + FastAPI's
+jsonable_encoder + stdlib json) with the fast path in main.py (orjson,
+no re-validation of trusted rows) on a 100k-row result, in both the
+records and columnar formats. Also reports gzip/brotli payload sizes.
+
+Usage (from backend/):
+    python benchmarks/bench_json_encoding.py
+    python benchmarks/bench_json_encoding.py --rows 250000 --repeat 5
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+import brotli
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (  # noqa: E402
+    AnalysisResponse, BROTLI_QUALITY, GZIP_LEVEL, dataframe_to_payload, dumps_json
+)
+
+
+def build_result(rows: int) -> pd.DataFrame:
+    """A result set shaped like a typical career-stats query."""
+    rng = np.random.default_rng(42)
+    players = np.array([f"Player {i:04d}" for i in range(2000)])
+    runs = rng.integers(0, 15000, rows)
+    balls = rng.integers(1, 20000, rows)
+    return pd.DataFrame({
+        "batter": players[rng.integers(0, len(players), rows)],
+        "season": rng.integers(1990, 2026, rows),
+        "first_match": pd.to_datetime("1990-01-01") + pd.to_timedelta(rng.integers(0, 12000, rows), unit="D"),
+        "runs": runs,
+        "balls": balls,
+        "strike_rate": np.round(runs * 100.0 / balls, 2),
+        "average": np.where(rng.random(rows) < 0.05, np.nan, np.round(rng.random(rows) * 60, 2)),
+    })
+
+
+def encode_before(df: pd.DataFrame) -> bytes:
+    """Old path: validate every row, jsonable_encoder, stdlib json."""
+    rows = df.to_dict(orient="records")
+    response = AnalysisResponse(markdown="", sql_used="", data=rows)
+    content = jsonable_encoder(response)
+    # Starlette's JSONResponse rejects NaN, so the old path could not encode
+    # results with missing averages at all; allow it here to get a timing.
+    return json.dumps(content, ensure_ascii=False, allow_nan=True, separators=(",", ":")).encode("utf-8")
+
+
+def encode_after(df: pd.DataFrame, result_format: str) -> bytes:
+    """New path: trusted rows, model_construct, orjson."""
+    payload = dataframe_to_payload(df, result_format)
+    return dumps_json(AnalysisResponse.model_construct(markdown="", sql_used="", data=payload))
+
+
+def best_time(fn, repeat: int):
+    """Runs fn repeat times; returns (best seconds, last result)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = build_result(args.rows)
+    cases = [
+        ("before: pydantic + stdlib json", lambda: encode_before(df)),
+        ("after: orjson records", lambda: encode_after(df, "records")),
+        ("after: orjson columns", lambda: encode_after(df, "columns")),
+    ]
+
+    print(f"Encoding {args.rows:,} rows (best of {args.repeat})\n")
+    print(f"{'path':<34}{'encode ms':>11}{'raw KB':>10}{'gzip KB':>10}{'br KB':>10}")
+    baseline = None
+    for name, fn in cases:
+        seconds, body = best_time(fn, args.repeat)
+        baseline = baseline or seconds
+        gzip_size = len(gzip.compress(body, compresslevel=GZIP_LEVEL))
+        br_size = len(brotli.compress(body, quality=BROTLI_QUALITY))
+        print(f"{name:<34}{seconds * 1000:>11.1f}{len(body) / 1024:>10.0f}"
+              f"{gzip_size / 1024:>10.0f}{br_size / 1024:>10.0f}"
+              f"   ({baseline / seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+SQL workload benchmark.
+
+Runs a corpus of representative analysis queries (career stats, phase
+splits, commentary joins, head-to-head, milestone windows, match-level
+aggregates) against a DuckDB file and reports p50/p95 latency, rows
+returned and peak RSS per query. Use it with a database built by
+synthetic_db.py to catch regressions offline; pass --baseline with an
+earlier --json report to fail when a query's p95 gets slower.
+
+Usage (from backend/):
+    python benchmarks/synthetic_db.py --balls 1000000 --out synthetic.duckdb
+    python benchmarks/bench_sql_workload.py --db synthetic.duckdb --json before.json
+    python benchmarks/bench_sql_workload.py --db synthetic.duckdb --baseline before.json
+"""
+import argparse
+import json
+import sys
+import time
+
+import duckdb
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# {batter} and {bowler} are filled with the busiest batter/bowler pair in the database
+WORKLOAD = {
+    "career_stats": """
+        SELECT batter, SUM(runs_off_bat) AS runs, COUNT(*) AS balls,
+               COUNT(dismissed_batter) AS dismissals,
+               ROUND(SUM(runs_off_bat) * 100.0 / COUNT(*), 2) AS strike_rate
+        FROM balls
+        GROUP BY batter
+        ORDER BY runs DESC
+        LIMIT 50
+    """,
+    "career_stats_keyed": """
+        SELECT p.name AS batter, k.runs, k.balls, k.dismissals,
+               ROUND(k.runs * 100.0 / k.balls, 2) AS strike_rate
+        FROM (
+            SELECT batter_id, SUM(runs_off_bat) AS runs, COUNT(*) AS balls,
+                   COUNT(dismissed_batter_id) AS dismissals
+            FROM balls_keyed
+            GROUP BY batter_id
+        ) k
+        JOIN players p ON p.player_id = k.batter_id
+        ORDER BY runs DESC
+        LIMIT 50
+    """,
+    "bowling_economy_by_format": """
+        SELECT b.bowler, m.format, COUNT(*) AS balls,
+               ROUND(SUM(b.total_runs) * 6.0 / COUNT(*), 2) AS economy,
+               COUNT(b.wicket_type) AS wickets
+        FROM balls b JOIN matches m ON b.match_id = m.match_id
+        GROUP BY b.bowler, m.format
+        HAVING COUNT(*) >= 120
+        ORDER BY wickets DESC
+        LIMIT 50
+    """,
+    "phase_splits": """
+        SELECT b.batter, b.phase, SUM(b.runs_off_bat) AS runs, COUNT(*) AS balls,
+               ROUND(SUM(b.runs_off_bat) * 100.0 / COUNT(*), 2) AS strike_rate
+        FROM balls b JOIN matches m ON b.match_id = m.match_id
+        WHERE m.format = 'T20' AND b.phase IS NOT NULL
+        GROUP BY b.batter, b.phase
+        HAVING COUNT(*) >= 60
+        ORDER BY strike_rate DESC
+        LIMIT 50
+    """,
+    "phase_splits_sample": """
+        SELECT b.batter, b.phase, SUM(b.runs_off_bat) AS runs, COUNT(*) AS balls,
+               ROUND(SUM(b.runs_off_bat) * 100.0 / COUNT(*), 2) AS strike_rate
+        FROM balls_sample b JOIN matches m ON b.match_id = m.match_id
+        WHERE m.format = 'T20' AND b.phase IS NOT NULL
+        GROUP BY b.batter, b.phase
+        HAVING COUNT(*) >= 3
+        ORDER BY strike_rate DESC
+        LIMIT 50
+    """,
+    "commentary_yorker_join": """
+        SELECT b.bowler, COUNT(*) AS yorkers_bowled,
+               SUM(CASE WHEN b.wicket_type IS NOT NULL THEN 1 ELSE 0 END) AS wickets,
+               ROUND(AVG(b.runs_off_bat), 2) AS avg_runs
+        FROM commentary c
+        JOIN balls b ON c.cricsheet_match_id = b.match_id
+                    AND c.innings = b.innings AND c.over = b.over AND c.ball = b.ball
+        WHERE c.mention_yorker = TRUE AND c.cricsheet_match_id IS NOT NULL
+        GROUP BY b.bowler
+        HAVING COUNT(*) >= 5
+        ORDER BY wickets DESC
+    """,
+    "commentary_yorker_enriched": """
+        SELECT bowler, COUNT(*) AS yorkers_bowled,
+               COUNT(wicket_type) AS wickets,
+               ROUND(AVG(runs_off_bat), 2) AS avg_runs
+        FROM balls_enriched
+        WHERE mention_yorker
+        GROUP BY bowler
+        HAVING COUNT(*) >= 5
+        ORDER BY wickets DESC
+    """,
+    "commentary_text_search": """
+        SELECT COUNT(*) AS deliveries, ROUND(AVG(sentiment_score), 3) AS sentiment
+        FROM commentary
+        WHERE text LIKE '%slower ball%'
+    """,
+    "commentary_phrase_index": """
+        SELECT COUNT(*) AS deliveries, ROUND(AVG(c.sentiment_score), 3) AS sentiment
+        FROM commentary_phrase('slower ball') s
+        JOIN commentary c ON c.commentary_id = s.commentary_id
+    """,
+    "head_to_head": """
+        SELECT m.format, COUNT(*) AS balls, SUM(b.runs_off_bat) AS runs,
+               COUNT(CASE WHEN b.dismissed_batter = b.batter THEN 1 END) AS dismissals,
+               SUM(CASE WHEN b.total_runs = 0 THEN 1 ELSE 0 END) AS dots,
+               SUM(CASE WHEN b.runs_off_bat IN (4, 6) THEN 1 ELSE 0 END) AS boundaries
+        FROM balls b JOIN matches m ON b.match_id = m.match_id
+        WHERE b.batter = '{batter}' AND b.bowler = '{bowler}'
+        GROUP BY m.format
+    """,
+    "head_to_head_matchups": """
+        SELECT format, balls_faced AS balls, runs, dismissals, dots, fours + sixes AS boundaries
+        FROM matchups
+        WHERE batter = '{batter}' AND bowler = '{bowler}'
+    """,
+    "milestone_nervous_nineties": """
+        WITH progression AS (
+            SELECT match_id, innings, batter, runs_off_bat,
+                   SUM(runs_off_bat) OVER (
+                       PARTITION BY match_id, innings, batter
+                       ORDER BY over, ball
+                       ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                   ) AS score
+            FROM balls
+        )
+        SELECT batter, COUNT(*) AS balls_in_nineties,
+               ROUND(SUM(runs_off_bat) * 100.0 / COUNT(*), 2) AS strike_rate_in_nineties
+        FROM progression
+        WHERE score - runs_off_bat BETWEEN 90 AND 99
+        GROUP BY batter
+        HAVING COUNT(*) >= 5
+        ORDER BY strike_rate_in_nineties
+        LIMIT 50
+    """,
+    "milestone_nineties_derived": """
+        SELECT batter,
+               COUNT(*) FILTER (WHERE ball_at_90 IS NOT NULL) AS reached_90,
+               COUNT(*) FILTER (WHERE ball_at_100 IS NOT NULL) AS reached_100,
+               ROUND(AVG(ball_at_100 - ball_at_90), 1) AS balls_90_to_100
+        FROM batter_innings
+        GROUP BY batter
+        HAVING COUNT(*) FILTER (WHERE ball_at_90 IS NOT NULL) >= 2
+        ORDER BY reached_100 DESC
+        LIMIT 50
+    """,
+    "toss_impact_by_venue": """
+        SELECT venue, toss_decision, COUNT(*) AS matches,
+               ROUND(AVG(CASE WHEN toss_winner = winner THEN 1.0 ELSE 0.0 END) * 100, 1) AS toss_winner_win_pct
+        FROM matches
+        WHERE winner IS NOT NULL
+        GROUP BY venue, toss_decision
+        HAVING COUNT(*) >= 5
+        ORDER BY toss_winner_win_pct DESC
+    """,
+    "first_innings_totals_by_season": """
+        SELECT YEAR(m.date) AS season, m.format, ROUND(AVG(t.total), 1) AS avg_first_innings
+        FROM (
+            SELECT match_id, MAX(cumulative_runs) AS total
+            FROM balls WHERE innings = 1 GROUP BY match_id
+        ) t JOIN matches m ON t.match_id = m.match_id
+        GROUP BY season, m.format
+        ORDER BY season, m.format
+    """,
+    "first_innings_totals_by_season_cube": """
+        SELECT season, format, avg_first_innings
+        FROM match_cube
+        WHERE grouped_by = 'format,season' AND avg_first_innings IS NOT NULL
+        ORDER BY season, format
+    """,
+}
+
+# Queries over derived tables (scripts/build_derived_tables.py) and keyed
+# storage (scripts/build_compact_storage.py); skipped if absent
+REQUIRES_TABLE = {
+    "career_stats_keyed": "balls_keyed",
+    "milestone_nineties_derived": "batter_innings",
+    "commentary_yorker_enriched": "balls_enriched",
+    "commentary_phrase_index": "commentary_postings",
+    "phase_splits_sample": "balls_sample",
+    "head_to_head_matchups": "matchups",
+    "first_innings_totals_by_season_cube": "match_cube",
+}
+
+
+def busiest_pair(con) -> dict:
+    """The batter/bowler pair with the most deliveries, for head-to-head queries."""
+    row = con.execute("""
+        SELECT batter, bowler FROM balls
+        GROUP BY batter, bowler ORDER BY COUNT(*) DESC LIMIT 1
+    """).fetchone()
+    batter, bowler = row if row else ("", "")
+    return {"batter": batter.replace("'", "''"), "bowler": bowler.replace("'", "''")}
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB (None on Windows)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def run_workload(db_path: str, repeat: int, threads: int = None, only: list = None) -> dict:
+    """Runs every query `repeat` times (after one warm-up). Returns the report."""
+    con = duckdb.connect(db_path, read_only=True)
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    params = busiest_pair(con)
+    tables = {r[0] for r in con.execute("SELECT table_name FROM information_schema.tables").fetchall()}
+
+    report = {"db": db_path, "repeat": repeat, "queries": {}}
+    for name, sql in WORKLOAD.items():
+        if only and name not in only:
+            continue
+        if name in REQUIRES_TABLE and REQUIRES_TABLE[name] not in tables:
+            print(f"  skipping {name}: table {REQUIRES_TABLE[name]} not built")
+            continue
+        sql = sql.format(**params)
+        rows = len(con.execute(sql).fetchall())  # warm-up
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            con.execute(sql).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        report["queries"][name] = {
+            "p50_ms": round(float(np.percentile(timings, 50)), 2),
+            "p95_ms": round(float(np.percentile(timings, 95)), 2),
+            "rows": rows,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    con.close()
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Names of queries whose p95 grew by more than `tolerance` (0.2 = 20%)."""
+    regressions = []
+    for name, result in report["queries"].items():
+        before = baseline.get("queries", {}).get(name)
+        if before and result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="synthetic_cricket.duckdb")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=None, help="DuckDB threads (default: all cores)")
+    parser.add_argument("--only", nargs="*", help="run only these queries")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="earlier --json report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown vs baseline")
+    args = parser.parse_args()
+
+    report = run_workload(args.db, args.repeat, args.threads, args.only)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"{'query':<34}{'p50 ms':>10}{'p95 ms':>10}{'rows':>8}{'peak RSS MB':>13}{'vs base':>9}")
+    for name, r in report["queries"].items():
+        rss = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "n/a"
+        delta = ""
+        if baseline and name in baseline.get("queries", {}):
+            delta = f"{r['p95_ms'] / max(baseline['queries'][name]['p95_ms'], 0.01):.2f}x"
+        print(f"{name:<34}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['rows']:>8}{rss:>13}{delta:>9}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nREGRESSION (p95 > {args.tolerance:.0%} slower): {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+End-to-end load test with a local LLM stand-in.
+
+Starts uvicorn with LLM_BACKEND=fake at each requested worker count, drives
+/analyze, /analyze-batch, /analyze-deep, /finalize and /validate with
+concurrent clients, and reports throughput, latency percentiles, error rates
+and threadpool saturation (sampled from /debug/runtime). Runs fully offline.
+
+Usage (from backend/):
+    python benchmarks/synthetic_db.py --balls 1000000 --out synthetic.duckdb
+    python benchmarks/load_test.py --db synthetic.duckdb --workers 1 2 4 --concurrency 32 --duration 30
+    python benchmarks/load_test.py --db synthetic.duckdb --llm-latency-ms 1500 --llm-429-rate 0.05
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONVERSATION = [
+    {"role": "user", "content": "Who are the top run scorers?", "sql_query": None, "data": None},
+    {"role": "assistant", "content": "Top scorers", "sql_query": "SELECT batter, SUM(runs_off_bat) AS runs FROM balls GROUP BY batter",
+     "data": [{"batter": f"Player {i}", "runs": 5000 - i * 97, "strike_rate": 120.0 + i} for i in range(30)]},
+]
+
+# (endpoint, weight, payload builder)
+SCENARIO = [
+    ("/analyze", 5, lambda: {"prompt": f"Top run scorers #{random.randint(0, 10 ** 6)}"}),
+    ("/analyze-batch", 1, lambda: {"prompts": [f"Top run scorers #{random.randint(0, 10 ** 6)}",
+                                                "Runs by phase", "Run rate by season"]}),
+    ("/analyze-deep", 2, lambda: {"prompt": "How has scoring evolved across phases?", "max_steps": 3}),
+    ("/finalize", 1, lambda: {"project_title": "Load test project", "conversation": CONVERSATION}),
+    ("/validate", 1, lambda: {"article_markdown": "The overall strike rate is 120.5.", "data_tables": [], "key_stats": []}),
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, workers: int, args) -> subprocess.Popen:
+    """Starts uvicorn against the fake LLM backend and waits until it answers."""
+    env = dict(os.environ)
+    env.update({
+        "LLM_BACKEND": "fake",
+        "DEBUG_ENDPOINTS": "true",  # /debug/runtime
+        "CRICKET_DB_PATH": os.path.abspath(args.db),
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_LLM_JITTER_MS": str(args.llm_latency_ms / 4),
+        "FAKE_LLM_429_RATE": str(args.llm_429_rate),
+        "MIN_CALL_INTERVAL": str(args.min_call_interval),
+        "RATE_LIMIT_BACKOFF": str(args.backoff),
+        "DAILY_LIMIT": str(10 ** 9),
+    })
+    if args.llm_responses:
+        env["FAKE_LLM_RESPONSES"] = os.path.abspath(args.llm_responses)
+
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    proc.terminate()
+    raise RuntimeError("uvicorn did not start within 60s")
+
+
+async def client_loop(client: httpx.AsyncClient, stop_at: float, results: list):
+    """One simulated user: picks weighted endpoints back to back until stop_at."""
+    endpoints = [s for s in SCENARIO for _ in range(s[1])]
+    while time.perf_counter() < stop_at:
+        path, _, payload = random.choice(endpoints)
+        start = time.perf_counter()
+        try:
+            response = await client.post(path, json=payload())
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        results.append((path, status, (time.perf_counter() - start) * 1000))
+
+
+async def sample_runtime(client: httpx.AsyncClient, stop_at: float, samples: list):
+    """Polls /debug/runtime to track threadpool occupancy per worker process."""
+    while time.perf_counter() < stop_at:
+        try:
+            data = (await client.get("/debug/runtime")).json()
+            samples.append((data["pid"], data["threadpool"]["busy"], data["threadpool"]["size"],
+                            data["threadpool"]["waiting"]))
+        except (httpx.HTTPError, ValueError, KeyError):
+            pass
+        await asyncio.sleep(0.2)
+
+
+async def drive(port: int, concurrency: int, duration: float):
+    limits = httpx.Limits(max_connections=concurrency + 2)
+    timeout = httpx.Timeout(300.0)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=timeout) as client:
+        stop_at = time.perf_counter() + duration
+        results, samples = [], []
+        await asyncio.gather(
+            sample_runtime(client, stop_at, samples),
+            *(client_loop(client, stop_at, results) for _ in range(concurrency))
+        )
+    return results, samples
+
+
+def report(workers: int, duration: float, results: list, samples: list):
+    print(f"\n=== {workers} worker(s): {len(results)} requests in {duration:.0f}s "
+          f"({len(results) / duration:.1f} req/s) ===")
+    print(f"{'endpoint':<16}{'reqs':>7}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}  statuses")
+    by_path = defaultdict(list)
+    for path, status, ms in results:
+        by_path[path].append((status, ms))
+    for path, _, _ in SCENARIO:
+        rows = by_path.get(path, [])
+        if not rows:
+            continue
+        latencies = np.array([ms for _, ms in rows])
+        statuses = defaultdict(int)
+        for status, _ in rows:
+            statuses[status] += 1
+        errors = sum(n for s, n in statuses.items() if s != 200)
+        print(f"{path:<16}{len(rows):>7}{len(rows) / duration:>8.2f}"
+              f"{np.percentile(latencies, 50):>10.0f}{np.percentile(latencies, 95):>10.0f}"
+              f"{np.percentile(latencies, 99):>10.0f}{errors / len(rows):>8.1%}  {dict(statuses)}")
+
+    if samples:
+        busy = np.array([s[1] / s[2] for s in samples])
+        waiting = np.array([s[3] for s in samples])
+        print(f"threadpool: mean {busy.mean():.0%} busy, peak {busy.max():.0%}, "
+              f"saturated {np.mean(busy >= 1.0):.0%} of samples, max {waiting.max()} tasks queued "
+              f"({len({s[0] for s in samples})} worker pid(s) sampled)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="synthetic_cricket.duckdb")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="seconds per worker count")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-429-rate", type=float, default=0.0)
+    parser.add_argument("--llm-responses", help="JSONL of recorded {match, response} pairs")
+    parser.add_argument("--min-call-interval", type=float, default=0.0,
+                        help="server-side throttle between LLM calls (production uses 5)")
+    parser.add_argument("--backoff", type=float, default=1.0, help="first retry delay after a 429")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        sys.exit(f"Database not found: {args.db} (build one with benchmarks/synthetic_db.py)")
+
+    for workers in args.workers:
+        port = free_port()
+        proc = start_server(port, workers, args)
+        try:
+            results, samples = asyncio.run(drive(port, args.concurrency, args.duration))
+            report(workers, args.duration, results, samples)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
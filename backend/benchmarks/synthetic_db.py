@@ -0,0 +1,340 @@
+"""
+Synthetic Cricsheet-shaped database generator.
+
+Builds `balls`, `matches` and `commentary` tables with the columns documented
+in get_database_schema() so backend changes can be benchmarked without the
+private cricket_analytics.duckdb. Data is random but shaped like the real
+thing: format mix skewed to T20, a long tail of rarely-selected players,
+phase-dependent scoring, and IPL-only commentary with NLP flags derived from
+the generated text.
+
+Usage (from backend/):
+    python benchmarks/synthetic_db.py --balls 1000000 --out synthetic.duckdb
+    python benchmarks/synthetic_db.py --balls 10000 --out tiny.duckdb --seed 7
+"""
+import argparse
+import os
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+# Legal balls per innings and innings per match
+FORMATS = {
+    "T20": {"weight": 0.55, "innings": 2, "max_balls": 120, "wicket_rate": 0.050},
+    "ODI": {"weight": 0.30, "innings": 2, "max_balls": 300, "wicket_rate": 0.030},
+    "Test": {"weight": 0.15, "innings": 4, "max_balls": 540, "wicket_rate": 0.018},
+}
+# (powerplay end, middle end) in overs; Test has no phases
+PHASE_OVERS = {"T20": (6, 15), "ODI": (10, 40)}
+
+TEAMS = {
+    "India": ["Wankhede Stadium", "Eden Gardens", "M Chinnaswamy Stadium", "MA Chidambaram Stadium"],
+    "Australia": ["Melbourne Cricket Ground", "Sydney Cricket Ground", "Adelaide Oval"],
+    "England": ["Lord's", "The Oval", "Edgbaston", "Old Trafford"],
+    "South Africa": ["Newlands", "Wanderers Stadium", "Kingsmead"],
+    "New Zealand": ["Eden Park", "Basin Reserve", "Hagley Oval"],
+    "Pakistan": ["Gaddafi Stadium", "National Stadium"],
+    "Sri Lanka": ["R Premadasa Stadium", "Galle International Stadium"],
+    "West Indies": ["Kensington Oval", "Sabina Park"],
+    "Bangladesh": ["Shere Bangla National Stadium"],
+    "Afghanistan": ["Sharjah Cricket Stadium"],
+}
+IPL_TEAMS = [
+    "Chennai Super Kings", "Mumbai Indians", "Royal Challengers Bangalore", "Kolkata Knight Riders",
+    "Delhi Capitals", "Rajasthan Royals", "Sunrisers Hyderabad", "Punjab Kings",
+]
+IPL_SHARE_OF_T20 = 0.25
+SQUAD_SIZE = 22
+
+SURNAMES = [
+    "Sharma", "Kohli", "Smith", "Root", "Williamson", "Khan", "Ali", "Patel", "Jones", "Taylor",
+    "Brown", "Singh", "Perera", "Silva", "Rahman", "Hossain", "Stokes", "Warner", "Starc", "Bumrah",
+    "Yadav", "de Villiers", "du Plessis", "Rabada", "Boult", "Southee", "Shaheen", "Babar", "Hasaranga",
+    "Holder", "Pooran", "Russell", "Narine", "Rashid", "Nabi", "Gill", "Pant", "Iyer", "Jadeja", "Ashwin",
+]
+INITIALS = ["A", "B", "C", "D", "J", "K", "M", "R", "S", "V", "AB", "MS", "RG", "JJ", "SPD", "BA", "JE", "KL"]
+
+RUNS = np.array([0, 1, 2, 3, 4, 6])
+RUN_PROBS = {
+    "powerplay": [0.45, 0.30, 0.06, 0.01, 0.13, 0.05],
+    "middle": [0.38, 0.40, 0.08, 0.01, 0.09, 0.04],
+    "death": [0.30, 0.32, 0.09, 0.01, 0.16, 0.12],
+    None: [0.55, 0.28, 0.06, 0.01, 0.08, 0.02],
+}
+EXTRA_TYPES = np.array(["wides", "noballs", "legbyes", "byes"])
+WICKET_TYPES = np.array(["caught", "bowled", "lbw", "run out", "stumped", "caught and bowled"])
+WICKET_PROBS = [0.58, 0.17, 0.12, 0.07, 0.03, 0.03]
+
+# Commentary phrases and the NLP flag each one implies
+COMMENTARY_PHRASES = [
+    ("short ball, pulled away", ["length_short"]),
+    ("bouncer, ducks under it", ["length_short", "mention_bouncer"]),
+    ("full and straight, driven", ["length_full", "line_middle"]),
+    ("yorker on the toes", ["length_full", "mention_yorker"]),
+    ("good length outside off, left alone", ["length_good", "line_off"]),
+    ("outside off, beaten", ["line_off", "mention_beaten"]),
+    ("edged, falls short of slip", ["mention_edge", "line_off"]),
+    ("swings back in late", ["mention_swing"]),
+    ("turns sharply past the bat", ["mention_spin", "mention_beaten"]),
+    ("mistimed towards mid-on", ["mention_mistimed"]),
+    ("down the leg side, flicked fine", ["line_leg"]),
+    ("slower ball, chipped over cover", ["length_good"]),
+    ("tucked away for a single", []),
+]
+COMMENTARY_FLAGS = [
+    "length_short", "length_full", "length_good", "line_off", "line_middle", "line_leg",
+    "mention_yorker", "mention_bouncer", "mention_swing", "mention_spin", "mention_beaten",
+    "mention_edge", "mention_mistimed",
+]
+COMMENTARY_COVERAGE = 0.6  # share of IPL balls that have commentary
+
+SCHEMA_SQL = """
+CREATE TABLE matches (
+    match_id VARCHAR, date DATE, venue VARCHAR, city VARCHAR, country VARCHAR,
+    format VARCHAR, gender VARCHAR, team1 VARCHAR, team2 VARCHAR, winner VARCHAR,
+    toss_winner VARCHAR, toss_decision VARCHAR, player_of_match VARCHAR
+);
+CREATE TABLE balls (
+    match_id VARCHAR, innings INTEGER, over INTEGER, ball INTEGER,
+    batter VARCHAR, non_striker VARCHAR, bowler VARCHAR,
+    batting_team VARCHAR, bowling_team VARCHAR,
+    runs_off_bat INTEGER, extras INTEGER, total_runs INTEGER,
+    extra_type VARCHAR, wicket_type VARCHAR, dismissed_batter VARCHAR,
+    phase VARCHAR, cumulative_runs INTEGER, wickets_fallen INTEGER
+);
+CREATE TABLE commentary (
+    commentary_id TEXT, cricsheet_match_id TEXT, match_id TEXT,
+    innings INT, over INT, ball INT, text TEXT,
+    length_short BOOLEAN, length_full BOOLEAN, length_good BOOLEAN,
+    line_off BOOLEAN, line_middle BOOLEAN, line_leg BOOLEAN,
+    mention_yorker BOOLEAN, mention_bouncer BOOLEAN, mention_swing BOOLEAN,
+    mention_spin BOOLEAN, mention_beaten BOOLEAN, mention_edge BOOLEAN,
+    mention_mistimed BOOLEAN, sentiment_score FLOAT
+);
+"""
+
+
+def build_squads(rng: np.random.Generator, teams: list) -> dict:
+    """A squad of Cricsheet-style names ("V Kohli") per team."""
+    squads = {}
+    for team in teams:
+        names = set()
+        while len(names) < SQUAD_SIZE:
+            names.add(f"{rng.choice(INITIALS)} {rng.choice(SURNAMES)}")
+        squads[team] = np.array(sorted(names))
+    return squads
+
+
+def build_matches(rng: np.random.Generator, target_balls: int, squads: dict) -> pd.DataFrame:
+    """Match table sized so the innings add up to roughly target_balls."""
+    names = list(FORMATS)
+    weights = np.array([FORMATS[f]["weight"] for f in names])
+    avg_balls = sum(FORMATS[f]["weight"] * FORMATS[f]["innings"] * FORMATS[f]["max_balls"] * 0.85 for f in names)
+    n = max(1, int(round(target_balls / avg_balls)))
+
+    formats = rng.choice(names, size=n, p=weights)
+    countries = list(TEAMS)
+    ipl = (formats == "T20") & (rng.random(n) < IPL_SHARE_OF_T20)
+
+    # Dates skew towards recent seasons; T20 starts in 2005, IPL in 2008
+    start_year = np.where(formats == "T20", np.where(ipl, 2008, 2005), 1990)
+    years = start_year + ((2025 - start_year) * np.sqrt(rng.random(n))).astype(int)
+    dates = pd.to_datetime(years.astype(str) + "-01-01") + pd.to_timedelta(rng.integers(0, 365, n), unit="D")
+
+    rows = []
+    for i in range(n):
+        if ipl[i]:
+            team1, team2 = rng.choice(IPL_TEAMS, size=2, replace=False)
+            country = "India"
+        else:
+            team1, team2 = rng.choice(countries, size=2, replace=False)
+            country = team1 if rng.random() < 0.5 else team2
+        venue = rng.choice(TEAMS[country])
+        toss_winner = team1 if rng.random() < 0.5 else team2
+        roll = rng.random()
+        winner = None if roll < 0.03 else (team1 if roll < 0.515 else team2)
+        motm_team = winner or team1
+        rows.append((
+            f"{1000000 + i}", dates[i].date(), venue, venue.split()[0], country,
+            formats[i], "female" if rng.random() < 0.15 else "male", team1, team2, winner,
+            toss_winner, "field" if rng.random() < 0.6 else "bat",
+            rng.choice(squads[motm_team][:11]),
+        ))
+
+    columns = ["match_id", "date", "venue", "city", "country", "format", "gender", "team1", "team2",
+               "winner", "toss_winner", "toss_decision", "player_of_match"]
+    matches = pd.DataFrame(rows, columns=columns)
+    matches["ipl"] = ipl
+    return matches
+
+
+def playing_xi(rng: np.random.Generator, squad: np.ndarray) -> np.ndarray:
+    """Picks an XI with Zipf-like weights so regulars play far more often."""
+    weights = 1.0 / np.arange(1, len(squad) + 1) ** 1.2
+    return rng.choice(squad, size=11, replace=False, p=weights / weights.sum())
+
+
+def build_balls(rng: np.random.Generator, matches: pd.DataFrame, squads: dict) -> pd.DataFrame:
+    """Ball-by-ball rows for a batch of matches, built with vectorized NumPy."""
+    innings_rows = []
+    for m in matches.itertuples(index=False):
+        spec = FORMATS[m.format]
+        xi = {m.team1: playing_xi(rng, squads[m.team1]), m.team2: playing_xi(rng, squads[m.team2])}
+        bat_first = m.toss_winner if m.toss_decision == "bat" else (m.team2 if m.toss_winner == m.team1 else m.team1)
+        bowl_first = m.team2 if bat_first == m.team1 else m.team1
+        for inn in range(1, spec["innings"] + 1):
+            batting, bowling = (bat_first, bowl_first) if inn % 2 == 1 else (bowl_first, bat_first)
+            length = int(spec["max_balls"] * rng.uniform(0.55, 1.0))
+            innings_rows.append((m.match_id, inn, m.format, batting, bowling, xi[batting], xi[bowling], length))
+
+    lengths = np.array([r[7] for r in innings_rows])
+    total = int(lengths.sum())
+    inn_idx = np.repeat(np.arange(len(innings_rows)), lengths)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    pos = np.arange(total) - starts[inn_idx]
+    over = pos // 6
+    ball = pos % 6 + 1
+
+    fmt = np.array([r[2] for r in innings_rows])[inn_idx]
+    phase = np.full(total, None, dtype=object)
+    for name, (pp_end, mid_end) in PHASE_OVERS.items():
+        mask = fmt == name
+        phase[mask & (over < pp_end)] = "powerplay"
+        phase[mask & (over >= pp_end) & (over < mid_end)] = "middle"
+        phase[mask & (over >= mid_end)] = "death"
+
+    runs_off_bat = np.zeros(total, dtype=np.int64)
+    for key, probs in RUN_PROBS.items():
+        mask = (phase == key) if key is not None else pd.isna(phase)
+        runs_off_bat[mask] = rng.choice(RUNS, size=int(mask.sum()), p=probs)
+
+    extra_mask = rng.random(total) < 0.05
+    extras = extra_mask.astype(np.int64)
+    extra_type = np.where(extra_mask, rng.choice(EXTRA_TYPES, size=total), None)
+    runs_off_bat[extra_mask & np.isin(extra_type, ["wides", "legbyes", "byes"])] = 0
+    total_runs = runs_off_bat + extras
+
+    wicket_rate = np.array([FORMATS[r[2]]["wicket_rate"] for r in innings_rows])[inn_idx]
+    is_wicket = (rng.random(total) < wicket_rate) & (runs_off_bat == 0)
+    # Cap at 10 wickets per innings
+    wickets_fallen = np.cumsum(is_wicket) - np.concatenate([[0], np.cumsum(is_wicket)])[starts][inn_idx]
+    is_wicket &= wickets_fallen <= 10
+    wickets_fallen = np.cumsum(is_wicket) - np.concatenate([[0], np.cumsum(is_wicket)])[starts][inn_idx]
+    wicket_type = np.where(is_wicket, rng.choice(WICKET_TYPES, size=total, p=WICKET_PROBS), None)
+
+    cumulative_runs = np.cumsum(total_runs) - np.concatenate([[0], np.cumsum(total_runs)])[starts][inn_idx]
+
+    # Batting order: the striker is the next batter in, rotating on odd runs
+    wickets_before = np.minimum(wickets_fallen - is_wicket, 9)
+    rotate = (np.cumsum(runs_off_bat % 2) + over) % 2
+    bat_xi = np.stack([r[5] for r in innings_rows])
+    bowl_xi = np.stack([r[6] for r in innings_rows])
+    striker_slot = wickets_before + rotate
+    batter = bat_xi[inn_idx, striker_slot]
+    non_striker = bat_xi[inn_idx, wickets_before + 1 - rotate]
+    bowler = bowl_xi[inn_idx, 6 + over % 5]
+    run_out_other = is_wicket & (wicket_type == "run out") & (rng.random(total) < 0.3)
+    dismissed_batter = np.where(is_wicket, np.where(run_out_other, non_striker, batter), None)
+
+    return pd.DataFrame({
+        "match_id": np.array([r[0] for r in innings_rows])[inn_idx],
+        "innings": np.array([r[1] for r in innings_rows])[inn_idx],
+        "over": over,
+        "ball": ball,
+        "batter": batter,
+        "non_striker": non_striker,
+        "bowler": bowler,
+        "batting_team": np.array([r[3] for r in innings_rows])[inn_idx],
+        "bowling_team": np.array([r[4] for r in innings_rows])[inn_idx],
+        "runs_off_bat": runs_off_bat,
+        "extras": extras,
+        "total_runs": total_runs,
+        "extra_type": extra_type,
+        "wicket_type": wicket_type,
+        "dismissed_batter": dismissed_batter,
+        "phase": phase,
+        "cumulative_runs": cumulative_runs,
+        "wickets_fallen": wickets_fallen,
+    })
+
+
+def build_commentary(rng: np.random.Generator, balls: pd.DataFrame, ipl_ids: set, offset: int) -> pd.DataFrame:
+    """Commentary for a share of IPL deliveries, with flags matching the text."""
+    ipl_balls = balls[balls["match_id"].isin(ipl_ids)]
+    ipl_balls = ipl_balls[rng.random(len(ipl_balls)) < COMMENTARY_COVERAGE]
+    n = len(ipl_balls)
+    if n == 0:
+        return pd.DataFrame()
+
+    phrase_idx = rng.integers(0, len(COMMENTARY_PHRASES), n)
+    phrases = np.array([p for p, _ in COMMENTARY_PHRASES], dtype=object)
+    text = (ipl_balls["bowler"].to_numpy() + " to " + ipl_balls["batter"].to_numpy()
+            + ", " + phrases[phrase_idx])
+
+    data = {
+        "commentary_id": [f"c{offset + i}" for i in range(n)],
+        "cricsheet_match_id": ipl_balls["match_id"].to_numpy(),
+        "match_id": [f"espn{int(m) % 100000}" for m in ipl_balls["match_id"]],
+        "innings": ipl_balls["innings"].to_numpy(),
+        "over": ipl_balls["over"].to_numpy(),
+        "ball": ipl_balls["ball"].to_numpy(),
+        "text": text,
+    }
+    for flag in COMMENTARY_FLAGS:
+        has_flag = np.array([flag in flags for _, flags in COMMENTARY_PHRASES])
+        data[flag] = has_flag[phrase_idx]
+    boundary = ipl_balls["runs_off_bat"].to_numpy() >= 4
+    wicket = ipl_balls["wicket_type"].notna().to_numpy()
+    data["sentiment_score"] = np.tanh(rng.normal(0.1, 0.35, n) + 0.5 * boundary - 0.5 * wicket).astype(np.float32)
+    return pd.DataFrame(data)
+
+
+def generate(out_path: str, target_balls: int, seed: int = 42, batch_matches: int = 2000) -> dict:
+    """Writes a synthetic database to out_path. Returns row counts."""
+    rng = np.random.default_rng(seed)
+    if os.path.exists(out_path):
+        os.remove(out_path)
+
+    teams = list(TEAMS) + IPL_TEAMS
+    squads = build_squads(rng, teams)
+    matches = build_matches(rng, target_balls, squads)
+    ipl_ids = set(matches.loc[matches["ipl"], "match_id"])
+
+    con = duckdb.connect(out_path)
+    con.execute(SCHEMA_SQL)
+    match_rows = matches.drop(columns=["ipl"])
+    con.execute("INSERT INTO matches SELECT * FROM match_rows")
+
+    ball_count = 0
+    commentary_count = 0
+    for start in range(0, len(matches), batch_matches):
+        batch = build_balls(rng, matches.iloc[start:start + batch_matches], squads)
+        con.execute("INSERT INTO balls SELECT * FROM batch")
+        comments = build_commentary(rng, batch, ipl_ids, commentary_count)
+        if not comments.empty:
+            con.execute("INSERT INTO commentary SELECT * FROM comments")
+        ball_count += len(batch)
+        commentary_count += len(comments)
+        print(f"  {min(start + batch_matches, len(matches)):,}/{len(matches):,} matches, {ball_count:,} balls")
+
+    con.close()
+    return {"matches": len(matches), "balls": ball_count, "commentary": commentary_count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--balls", type=int, default=1_000_000, help="approximate number of balls (10k to 10M)")
+    parser.add_argument("--out", default="synthetic_cricket.duckdb")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate(args.out, args.balls, args.seed)
+    print(f"Wrote {args.out} in {time.perf_counter() - start:.1f}s: "
+          f"{counts['matches']:,} matches, {counts['balls']:,} balls, {counts['commentary']:,} commentary rows")
+
+
+if __name__ == "__main__":
+    main()
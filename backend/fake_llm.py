@@ -0,0 +1,99 @@
+"""
+Fake LLM backend for offline testing (LLM_BACKEND=fake).
+
+Stands in for genai.Client so every endpoint can run without the Gemini API.
+Responses come from FAKE_LLM_RESPONSES (a JSONL file of {"match", "response"}
+records, checked first) or the canned responses below, picked by a marker
+phrase from each prompt. Latency and 429 errors are injected on request.
+main.py only imports this module when LLM_BACKEND=fake.
+"""
+import json
+import random
+import time
+from typing import Optional
+
+FAKE_LLM_CANNED_RESPONSES = [
+    ("Break it into exactly", json.dumps([
+        {"step_number": 1, "title": "Career aggregates", "research_question": "Who scores the most runs?",
+         "sql_query": "SELECT batter, SUM(runs_off_bat) AS runs, COUNT(*) AS balls, "
+                      "ROUND(SUM(runs_off_bat) * 100.0 / COUNT(*), 2) AS strike_rate "
+                      "FROM balls GROUP BY batter ORDER BY runs DESC LIMIT 50"},
+        {"step_number": 2, "title": "Phase splits", "research_question": "How does scoring change by phase?",
+         "sql_query": "SELECT phase, SUM(runs_off_bat) AS runs, COUNT(*) AS balls "
+                      "FROM balls WHERE phase IS NOT NULL GROUP BY phase ORDER BY runs DESC"},
+        {"step_number": 3, "title": "Evolution by season", "research_question": "Has scoring changed over time?",
+         "sql_query": "SELECT YEAR(m.date) AS season, ROUND(AVG(b.total_runs) * 6, 2) AS run_rate "
+                      "FROM balls b JOIN matches m ON b.match_id = m.match_id GROUP BY season ORDER BY season"},
+    ])),
+    ("Write one valid DuckDB SQL query for EACH", json.dumps([
+        {"index": 1, "sql_query": "SELECT batter, SUM(runs_off_bat) AS runs, COUNT(*) AS balls "
+                                  "FROM balls GROUP BY batter ORDER BY runs DESC LIMIT 20"},
+        {"index": 2, "sql_query": "SELECT phase, SUM(runs_off_bat) AS runs, COUNT(*) AS balls "
+                                  "FROM balls WHERE phase IS NOT NULL GROUP BY phase ORDER BY runs DESC"},
+        {"index": 3, "sql_query": "SELECT YEAR(m.date) AS season, ROUND(AVG(b.total_runs) * 6, 2) AS run_rate "
+                                  "FROM balls b JOIN matches m ON b.match_id = m.match_id GROUP BY season ORDER BY season"},
+    ])),
+    ("Convert the following user question", "SELECT batter, SUM(runs_off_bat) AS runs, COUNT(*) AS balls "
+                                            "FROM balls GROUP BY batter ORDER BY runs DESC LIMIT 20"),
+    ("verifying a statistical claim", "SELECT ROUND(SUM(runs_off_bat) * 100.0 / COUNT(*), 2) AS strike_rate FROM balls"),
+    ("cricket fact-checker verifying a claim", json.dumps({
+        "search_query": "fake search", "is_accurate": True, "actual_value": "50",
+        "source_hint": "ESPNcricinfo", "explanation": "Canned verification."
+    })),
+    ("fact-checker for cricket analytics articles", json.dumps([
+        {"claim_id": 1, "claim_text": "The overall strike rate is 120.5", "claim_type": "statistical",
+         "expected_value": "120.5", "verification_method": "database_query", "sql_hint": "Overall strike rate"},
+        {"claim_id": 2, "claim_text": "Dhoni scored 50 in the semi-final", "claim_type": "match_detail",
+         "expected_value": "50", "verification_method": "web_search", "search_hint": "Dhoni semi-final"},
+    ])),
+    ("publication-ready article", json.dumps({
+        "executive_summary": "Canned summary.", "article": "# Canned article\n\nBody.",
+        "tweet": "Canned tweet [link]", "key_stats": [{"label": "Runs", "value": "100", "context": "Canned"}],
+        "methodology": "Canned.", "limitations": "Canned.", "verification_notes": "Canned."
+    })),
+    ("Utsav Mamoria narrative style", json.dumps({
+        "title": "Canned analysis", "executive_summary": "Canned summary.", "article": "# Canned\n\nBody.",
+        "tweet": "Canned tweet [link]", "methodology": "Canned.", "limitations": "Canned."
+    })),
+]
+
+
+class FakeLLMResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeLLMModels:
+    def __init__(self, client: "FakeGenAIClient"):
+        self._client = client
+
+    def generate_content(self, model: str, contents: str) -> FakeLLMResponse:
+        return self._client.respond(contents)
+
+
+class FakeGenAIClient:
+    """Drop-in for genai.Client with canned/recorded responses, latency and 429 injection."""
+
+    def __init__(self, responses_path: Optional[str] = None, latency_ms: float = 800,
+                 jitter_ms: float = 200, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.models = FakeLLMModels(self)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.responses = []
+        if responses_path:
+            with open(responses_path, encoding="utf-8") as f:
+                self.responses = [json.loads(line) for line in f if line.strip()]
+                self.responses = [(r["match"], r["response"]) for r in self.responses]
+        self.responses += FAKE_LLM_CANNED_RESPONSES
+
+    def respond(self, prompt: str) -> FakeLLMResponse:
+        delay = max(0.0, self._random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        time.sleep(delay)
+        if self._random.random() < self.error_rate:
+            raise RuntimeError("429 RESOURCE_EXHAUSTED: fake rate limit injected")
+        for marker, response in self.responses:
+            if marker in prompt:
+                return FakeLLMResponse(response)
+        return FakeLLMResponse("[]")
@@ -2,32 +2,502 @@ import os
 from dotenv import load_dotenv
 load_dotenv()  # Load .env file before anything else
 
+import re
 import json
+import glob
+import gzip
+import hashlib
 import time
+import shutil
+import tempfile
+import threading
+import contextvars
+import difflib
+import brotli
 import duckdb
+import numpy as np
+import orjson
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime, date
-from fastapi import FastAPI, HTTPException
+from decimal import Decimal
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Union
 from google import genai
 
 # --- Configuration ---
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
+# LLM backend: "gemini" (default) or "fake" for offline load tests (fake_llm.py).
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "gemini").lower()
+
+# Path to the DuckDB database (override for benchmarks against a synthetic DB)
+db_path = os.environ.get("CRICKET_DB_PATH", "cricket_analytics.duckdb")
+
+# Operational endpoints (/debug/*, POST /cache/warm) expose prompts, SQL and
+# worker internals or spend LLM quota: they answer 404 unless
+# DEBUG_ENDPOINTS=true (load tests, local debugging).
+DEBUG_ENDPOINTS = os.environ.get("DEBUG_ENDPOINTS", "false").lower() == "true"
+
+
 # Initialize the new Google GenAI client
 genai_client = None
-if GEMINI_API_KEY:
+if LLM_BACKEND == "fake":
+    from fake_llm import FakeGenAIClient
+    genai_client = FakeGenAIClient(
+        responses_path=os.environ.get("FAKE_LLM_RESPONSES"),
+        latency_ms=float(os.environ.get("FAKE_LLM_LATENCY_MS", "800")),
+        jitter_ms=float(os.environ.get("FAKE_LLM_JITTER_MS", "200")),
+        error_rate=float(os.environ.get("FAKE_LLM_429_RATE", "0")),
+    )
+elif GEMINI_API_KEY:
     genai_client = genai.Client(api_key=GEMINI_API_KEY)
 
 # Model: gemini-2.5-flash-lite has the best free tier (15 RPM, 1,000 RPD)
 # Note: gemini-2.0-flash is deprecated and shuts down March 31, 2026
 GEMINI_MODEL = 'gemini-2.5-flash-lite'
 
+# --- Metrics (Prometheus text format) ---
+# In-process counters and histograms exposed at GET /metrics. Every LLM call
+# and DuckDB query is recorded with the endpoint that triggered it and the
+# stage (generate_sql, decompose, synthesize, ...). With several uvicorn
+# workers each process keeps its own series, labelled by pid.
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("current_endpoint", default="none")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 1000, 10000, 100000, 1000000)
+
+
+class Metric:
+    """Base for labelled metrics; label values are kept as sorted tuples."""
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    @staticmethod
+    def label_key(labels: Dict[str, Any]) -> tuple:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    @staticmethod
+    def format_labels(key: tuple, extra: Optional[Dict[str, str]] = None) -> str:
+        pairs = list(key) + [("pid", str(os.getpid()))] + list((extra or {}).items())
+        escaped = (v.replace("\\", "\\\\").replace('"', '\\"') for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{self.format_labels(k)} {v}" for k, v in self.values.items()]
+
+
+class Gauge(Metric):
+    """Gauge whose value is read from a callback at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read):
+        super().__init__(name, help_text)
+        self.read = read
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self.format_labels(())} {self.read()}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = buckets
+        self.values: Dict[tuple, list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self.label_key(labels)
+        with self._lock:
+            entry = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall time of the with-block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, entry in self.values.items():
+                for bound, count in zip(self.buckets, entry):
+                    lines.append(f"{self.name}_bucket{self.format_labels(key, {'le': str(bound)})} {count}")
+                lines.append(f"{self.name}_bucket{self.format_labels(key, {'le': '+Inf'})} {entry[-1]}")
+                lines.append(f"{self.name}_sum{self.format_labels(key)} {entry[-2]}")
+                lines.append(f"{self.name}_count{self.format_labels(key)} {entry[-1]}")
+        return lines
+
+
+METRICS: List[Metric] = []
+
+HTTP_REQUEST_SECONDS = Histogram("cricket_http_request_duration_seconds", "End-to-end request latency")
+LLM_REQUEST_SECONDS = Histogram("cricket_llm_request_duration_seconds", "Gemini generate_content latency")
+LLM_THROTTLE_SECONDS = Histogram("cricket_llm_throttle_wait_seconds", "Time slept to respect MIN_CALL_INTERVAL")
+LLM_BACKOFF_SECONDS = Histogram("cricket_llm_backoff_wait_seconds", "Time slept backing off after 429s")
+LLM_RETRIES = Counter("cricket_llm_retries_total", "Gemini calls retried after a rate-limit error")
+LLM_ERRORS = Counter("cricket_llm_errors_total", "Gemini calls that failed for good")
+LLM_PROMPT_TOKENS = Histogram("cricket_llm_prompt_tokens", "Prompt size in tokens", TOKEN_BUCKETS)
+LLM_RESPONSE_TOKENS = Histogram("cricket_llm_response_tokens", "Response size in tokens", TOKEN_BUCKETS)
+SQL_EXECUTION_SECONDS = Histogram("cricket_sql_execution_seconds", "DuckDB statement execution time")
+SQL_FETCH_SECONDS = Histogram("cricket_sql_fetch_seconds", "Result to DataFrame conversion time")
+SQL_ROWS_RETURNED = Histogram("cricket_sql_rows_returned", "Rows returned per query", ROW_BUCKETS)
+SQL_ERRORS = Counter("cricket_sql_errors_total", "DuckDB statements that raised")
+JSON_ENCODE_SECONDS = Histogram("cricket_json_encode_seconds", "Response JSON encoding time")
+CACHE_REQUESTS = Counter("cricket_cache_requests_total", "Cache lookups by cache and result (hit/miss)")
+SQL_REPAIRS = Counter("cricket_sql_repairs_total", "Failed queries sent to SQL repair, by method and outcome")
+QUERY_QUEUE_SECONDS = Histogram("cricket_query_queue_wait_seconds", "Time a query waited for an admission slot")
+QUERIES_REJECTED = Counter("cricket_queries_rejected_total", "Queries refused (503) after waiting for admission")
+RESULTS_TRUNCATED = Counter("cricket_results_truncated_total", "Endpoint results cut to the row/byte budget")
+FINALIZE_CONTEXT_TOKENS_USED = Histogram("cricket_finalize_context_tokens",
+                                         "Conversation context tokens in /finalize prompts", buckets=TOKEN_BUCKETS)
+INTENT_MATCHES = Counter("cricket_intent_matches_total", "/analyze prompts answered by a local intent template (none = Gemini)")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def execute_query(con, sql: str, stage: str = "query", params: Optional[Dict[str, Any]] = None,
+                  max_rows: Optional[int] = None) -> pd.DataFrame:
+    """
+    Runs a query (with optional $name parameters) in an admission slot and
+    fetches it as a DataFrame, recording execution/fetch time and rows.
+    With max_rows the result is held to the row/byte budget (see
+    enforce_result_budget). Queries over SLOW_QUERY_MS are sent to the
+    slow-query log.
+    """
+    endpoint = current_endpoint.get()
+    start = time.perf_counter()
+    try:
+        with query_slot(stage):
+            with SQL_EXECUTION_SECONDS.time(endpoint=endpoint, stage=stage):
+                result = con.execute(limit_sql(sql, max_rows) if max_rows is not None else sql, params)
+            with SQL_FETCH_SECONDS.time(endpoint=endpoint, stage=stage):
+                df = result.fetchdf()
+    except HTTPException:
+        raise
+    except Exception:
+        SQL_ERRORS.inc(endpoint=endpoint, stage=stage)
+        raise
+    if max_rows is not None:
+        df = enforce_result_budget(df, max_rows)
+    SQL_ROWS_RETURNED.observe(len(df), endpoint=endpoint, stage=stage)
+    record_slow_query(sql, stage, (time.perf_counter() - start) * 1000, len(df), params, max_rows)
+    return df
+
+
+# --- Slow Query Log ---
+# Queries slower than SLOW_QUERY_MS are re-run once in the background with
+# DuckDB's JSON profiler. The normalized SQL, originating prompt, endpoint,
+# operator tree and timings are kept in a bounded on-disk ring buffer
+# (SLOW_QUERY_LOG_SIZE files under SLOW_QUERY_DIR), browsable at
+# GET /debug/slow-queries (with DEBUG_ENDPOINTS=true).
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "1000"))  # <= 0 disables
+SLOW_QUERY_DIR = os.environ.get("SLOW_QUERY_DIR", "slow_queries")
+SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE", "200"))
+PROFILE_BATCH_ROWS = 8192  # rows per Arrow batch while draining a profiled re-run
+
+current_prompt: contextvars.ContextVar[str] = contextvars.ContextVar("current_prompt", default="")
+
+_slow_query_lock = threading.Lock()
+_slow_query_seq = None
+_slow_query_profiler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-profiler")
+
+
+def normalize_sql(sql: str) -> str:
+    """SQL with literals replaced by ? and whitespace collapsed, for grouping repeats."""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def flatten_profile(node: Dict[str, Any], depth: int = 0) -> List[Dict[str, Any]]:
+    """Operator list (depth-first) from a DuckDB JSON profile tree."""
+    operators = []
+    if "operator_type" in node:
+        operators.append({
+            "depth": depth,
+            "operator": node["operator_type"],
+            "timing_ms": round(node.get("operator_timing", 0) * 1000, 3),
+            "rows": node.get("operator_cardinality"),
+            "rows_scanned": node.get("operator_rows_scanned"),
+            "details": node.get("extra_info", {})
+        })
+        depth += 1
+    for child in node.get("children", []):
+        operators.extend(flatten_profile(child, depth))
+    return operators
+
+
+def next_slow_query_id() -> int:
+    """Next sequence number, continuing from whatever is already on disk."""
+    global _slow_query_seq
+    with _slow_query_lock:
+        if _slow_query_seq is None:
+            _slow_query_seq = 0
+            for entry in read_slow_queries():
+                _slow_query_seq = max(_slow_query_seq, entry["id"] + 1)
+        entry_id = _slow_query_seq
+        _slow_query_seq += 1
+        return entry_id
+
+
+def read_slow_queries() -> List[Dict[str, Any]]:
+    """All entries currently in the ring buffer, newest first."""
+    if not os.path.isdir(SLOW_QUERY_DIR):
+        return []
+    entries = []
+    for name in os.listdir(SLOW_QUERY_DIR):
+        if name.startswith("slot_") and name.endswith(".json"):
+            try:
+                with open(os.path.join(SLOW_QUERY_DIR, name), encoding="utf-8") as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return sorted(entries, key=lambda e: e["id"], reverse=True)
+
+
+def profile_slow_query(entry: Dict[str, Any]):
+    """
+    Re-runs the query with JSON profiling and writes the entry into its ring
+    slot. The re-run takes a query slot like any other query, and is skipped
+    while the process is under memory pressure (the entry is kept unprofiled).
+    It runs under the same row cap as the original (limit_sql) and its rows
+    are drained in Arrow batches and dropped, never collected in Python.
+    """
+    fd, profile_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        if under_memory_pressure():
+            raise RuntimeError("skipped: the process is over its memory high-water mark")
+        with query_slot("profile"):
+            con = get_db_connection()
+            try:
+                con.execute("SET enable_profiling = 'json'")
+                con.execute(f"SET profiling_output = '{profile_path}'")
+                sql = entry["sql"]
+                if entry.get("max_rows") is not None:
+                    sql = limit_sql(sql, entry["max_rows"])
+                for _ in con.execute(sql, entry.get("params")).fetch_record_batch(PROFILE_BATCH_ROWS):
+                    pass
+            finally:
+                con.close()
+        with open(profile_path, encoding="utf-8") as f:
+            profile = json.load(f)
+        entry["profiled_ms"] = round(profile.get("latency", 0) * 1000, 2)
+        entry["operators"] = flatten_profile(profile)
+        entry["plan"] = profile
+    except Exception as e:
+        entry["profile_error"] = str(e)
+    finally:
+        if os.path.exists(profile_path):
+            os.remove(profile_path)
+
+    os.makedirs(SLOW_QUERY_DIR, exist_ok=True)
+    slot_path = os.path.join(SLOW_QUERY_DIR, f"slot_{entry['id'] % SLOW_QUERY_LOG_SIZE:04d}.json")
+    tmp_path = slot_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entry, f, default=str)
+    os.replace(tmp_path, slot_path)
+
+
+def record_slow_query(sql: str, stage: str, duration_ms: float, rows: int,
+                      params: Optional[Dict[str, Any]] = None, max_rows: Optional[int] = None):
+    """Queues a slow query for profiling if it crossed the threshold."""
+    if SLOW_QUERY_MS <= 0 or duration_ms < SLOW_QUERY_MS:
+        return
+    normalized = normalize_sql(sql)
+    entry = {
+        "id": next_slow_query_id(),
+        "recorded_at": datetime.now().isoformat(),
+        "endpoint": current_endpoint.get(),
+        "stage": stage,
+        "prompt": current_prompt.get(),
+        "sql": sql,
+        "params": params,
+        "max_rows": max_rows,
+        "normalized_sql": normalized,
+        "fingerprint": hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12],
+        "duration_ms": round(duration_ms, 2),
+        "rows": rows
+    }
+    _slow_query_profiler.submit(profile_slow_query, entry)
+
+
+# --- Resource Governor ---
+# Budgets that stop one heavy query from taking down a small instance:
+# - DuckDB gets a memory limit, a thread count and a spill directory.
+# - At most MAX_CONCURRENT_QUERIES statements run at once. While the process
+#   is above MEMORY_HIGH_WATER of MEMORY_BUDGET_MB, only one runs. A query
+#   not admitted within QUERY_QUEUE_TIMEOUT gets a 503.
+# - Endpoint results are capped at MAX_RESULT_ROWS rows and MAX_RESULT_BYTES
+#   bytes (requests may ask for fewer with max_rows) and flagged as truncated.
+# For a 2GB instance: DUCKDB_MEMORY_LIMIT=1GB DUCKDB_THREADS=2 MEMORY_BUDGET_MB=1800
+DUCKDB_MEMORY_LIMIT = os.environ.get("DUCKDB_MEMORY_LIMIT")  # e.g. "1GB"; unset = DuckDB default (80% of RAM)
+DUCKDB_THREADS = int(os.environ.get("DUCKDB_THREADS", "0"))  # 0 = all cores
+DUCKDB_TEMP_DIR = os.environ.get("DUCKDB_TEMP_DIR")  # spill directory; unset = <database>.tmp
+DUCKDB_MAX_TEMP_SIZE = os.environ.get("DUCKDB_MAX_TEMP_SIZE")  # e.g. "10GB"
+MAX_CONCURRENT_QUERIES = int(os.environ.get("MAX_CONCURRENT_QUERIES", "4"))
+QUERY_QUEUE_TIMEOUT = float(os.environ.get("QUERY_QUEUE_TIMEOUT", "30"))
+MEMORY_BUDGET_MB = float(os.environ.get("MEMORY_BUDGET_MB", "0"))  # 0 disables memory-based admission
+MEMORY_HIGH_WATER = float(os.environ.get("MEMORY_HIGH_WATER", "0.8"))
+MAX_RESULT_ROWS = int(os.environ.get("MAX_RESULT_ROWS", "100000"))
+MAX_RESULT_BYTES = int(os.environ.get("MAX_RESULT_BYTES", str(64 * 1024 * 1024)))
+
+SINGLE_SELECT = re.compile(r"\s*(?:SELECT|WITH|FROM)\b", re.IGNORECASE)
+
+_admission = threading.Condition()
+_queries_running = 0
+
+
+def duckdb_config() -> Dict[str, Any]:
+    """Connection settings for the configured DuckDB budgets."""
+    config: Dict[str, Any] = {}
+    if DUCKDB_MEMORY_LIMIT:
+        config["memory_limit"] = DUCKDB_MEMORY_LIMIT
+    if DUCKDB_THREADS > 0:
+        config["threads"] = DUCKDB_THREADS
+    if DUCKDB_TEMP_DIR:
+        config["temp_directory"] = DUCKDB_TEMP_DIR
+    if DUCKDB_MAX_TEMP_SIZE:
+        config["max_temp_directory_size"] = DUCKDB_MAX_TEMP_SIZE
+    return config
+
+
+def process_rss_bytes() -> int:
+    """Current resident set size of this process (0 where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def under_memory_pressure() -> bool:
+    """True while the process is above MEMORY_HIGH_WATER of MEMORY_BUDGET_MB."""
+    return MEMORY_BUDGET_MB > 0 and process_rss_bytes() > MEMORY_BUDGET_MB * 1024 * 1024 * MEMORY_HIGH_WATER
+
+
+@contextmanager
+def query_slot(stage: str):
+    """
+    Admits one query: waits for a free slot (a single slot under memory
+    pressure), or raises 503 after QUERY_QUEUE_TIMEOUT.
+    """
+    global _queries_running
+    endpoint = current_endpoint.get()
+    start = time.perf_counter()
+    deadline = time.monotonic() + QUERY_QUEUE_TIMEOUT
+    with _admission:
+        while _queries_running >= (1 if under_memory_pressure() else MAX_CONCURRENT_QUERIES):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                QUERIES_REJECTED.inc(endpoint=endpoint, stage=stage)
+                raise HTTPException(
+                    status_code=503,
+                    detail="The database is busy (query limit or memory budget reached). Please retry shortly."
+                )
+            # Re-check periodically: memory pressure can ease without a release
+            _admission.wait(min(remaining, 0.25))
+        _queries_running += 1
+    QUERY_QUEUE_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, stage=stage)
+    try:
+        yield
+    finally:
+        with _admission:
+            _queries_running -= 1
+            _admission.notify()
+
+
+def result_row_limit(requested: Optional[int] = None) -> int:
+    """Row cap for an endpoint result: the request's max_rows, at most MAX_RESULT_ROWS."""
+    if requested and requested > 0:
+        return min(requested, MAX_RESULT_ROWS)
+    return MAX_RESULT_ROWS
+
+
+def limit_sql(sql: str, max_rows: int) -> str:
+    """Wraps a single SELECT so DuckDB produces at most max_rows + 1 rows (the +1 detects truncation)."""
+    body = sql.strip().rstrip(";")
+    if not SINGLE_SELECT.match(body) or ";" in body:
+        return sql
+    return f"SELECT * FROM (\n{body}\n) AS limited_result LIMIT {max_rows + 1}"
+
+
+def enforce_result_budget(df: pd.DataFrame, max_rows: int) -> pd.DataFrame:
+    """
+    Cuts a result to max_rows rows and MAX_RESULT_BYTES bytes. A cut result
+    carries df.attrs["truncated"] = {"reason", "limit", "rows_returned"}.
+    """
+    truncated = None
+    if len(df) > max_rows:
+        df = df.iloc[:max_rows]
+        truncated = {"reason": "rows", "limit": max_rows}
+    size = int(df.memory_usage(index=False, deep=True).sum()) if len(df) else 0
+    if size > MAX_RESULT_BYTES:
+        df = df.iloc[:int(len(df) * MAX_RESULT_BYTES / size)]
+        truncated = {"reason": "bytes", "limit": MAX_RESULT_BYTES}
+    if truncated:
+        df = df.copy()
+        truncated["rows_returned"] = len(df)
+        df.attrs["truncated"] = truncated
+        RESULTS_TRUNCATED.inc(endpoint=current_endpoint.get(), reason=truncated["reason"])
+    return df
+
+
+Gauge("cricket_queries_running", "DuckDB statements currently admitted", lambda: _queries_running)
+Gauge("cricket_process_rss_bytes", "Resident set size of this worker process", process_rss_bytes)
+Gauge("cricket_memory_pressure", "1 while admission is reduced to one query by memory pressure",
+      lambda: int(under_memory_pressure()))
+
+
 # --- Rate Limiting (Free Tier Protection) ---
 # gemini-2.5-flash-lite Free Tier: 15 RPM, 1,000 RPD
-# We limit to 950 to have buffer
-DAILY_LIMIT = 950
+# We limit to 950 to have buffer (override with DAILY_LIMIT for load tests)
+DAILY_LIMIT = int(os.environ.get("DAILY_LIMIT", "950"))
 rate_limit_state = {
     "date": str(date.today()),
     "count": 0
@@ -53,25 +523,32 @@ def check_rate_limit():
     return rate_limit_state["count"]
 
 
+Gauge("cricket_llm_quota_used", "Gemini requests counted against today's limit", lambda: rate_limit_state["count"])
+Gauge("cricket_llm_quota_limit", "Daily Gemini request limit", lambda: DAILY_LIMIT)
+
+
 # --- Throttling & Retry (Free Tier Protection) ---
 # gemini-2.5-flash-lite Free Tier: 15 RPM, 1,000 RPD
 # We space calls 5s apart = max 12/min (safely under 15 RPM)
 _last_gemini_call_time = 0.0
-MIN_CALL_INTERVAL = 5  # seconds between calls
+MIN_CALL_INTERVAL = float(os.environ.get("MIN_CALL_INTERVAL", "5"))  # seconds between calls
+RATE_LIMIT_BACKOFF = float(os.environ.get("RATE_LIMIT_BACKOFF", "60"))  # first retry delay on 429
 
 
-def call_gemini(prompt: str, max_retries: int = 3) -> str:
+def call_gemini(prompt: str, max_retries: int = 3, stage: str = "llm") -> str:
     """
     Central Gemini API caller with:
     - API key validation
     - Per-minute throttling (5s between calls)
     - Exponential backoff retry on 429 errors
     - Daily rate limit check
+    - Metrics per endpoint and stage (latency, waits, retries, tokens)
     Returns the raw response text (stripped).
     """
     global _last_gemini_call_time
+    endpoint = current_endpoint.get()
 
-    if not GEMINI_API_KEY or not genai_client:
+    if not genai_client:
         raise HTTPException(
             status_code=500,
             detail="Gemini API Key not configured. Set GEMINI_API_KEY environment variable."
@@ -86,12 +563,24 @@ def call_gemini(prompt: str, max_retries: int = 3) -> str:
             elapsed = now - _last_gemini_call_time
             if elapsed < MIN_CALL_INTERVAL:
                 time.sleep(MIN_CALL_INTERVAL - elapsed)
+                LLM_THROTTLE_SECONDS.observe(MIN_CALL_INTERVAL - elapsed, endpoint=endpoint, stage=stage)
 
-            response = genai_client.models.generate_content(
-                model=GEMINI_MODEL,
-                contents=prompt
-            )
+            with LLM_REQUEST_SECONDS.time(endpoint=endpoint, stage=stage):
+                response = genai_client.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=prompt
+                )
             _last_gemini_call_time = time.time()
+
+            usage = getattr(response, "usage_metadata", None)
+            LLM_PROMPT_TOKENS.observe(
+                getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt),
+                endpoint=endpoint, stage=stage
+            )
+            LLM_RESPONSE_TOKENS.observe(
+                getattr(usage, "candidates_token_count", None) or estimate_tokens(response.text or ""),
+                endpoint=endpoint, stage=stage
+            )
             return response.text.strip()
 
         except HTTPException:
@@ -105,11 +594,14 @@ def call_gemini(prompt: str, max_retries: int = 3) -> str:
 
             if is_rate_limit and attempt < max_retries - 1:
                 # Exponential backoff: 60s, 120s, 240s
-                delay = 60 * (2 ** attempt)
+                delay = RATE_LIMIT_BACKOFF * (2 ** attempt)
                 print(f"[Rate Limit] Attempt {attempt + 1}/{max_retries} failed. Retrying in {delay}s...")
+                LLM_RETRIES.inc(endpoint=endpoint, stage=stage)
                 time.sleep(delay)
+                LLM_BACKOFF_SECONDS.observe(delay, endpoint=endpoint, stage=stage)
                 continue
 
+            LLM_ERRORS.inc(endpoint=endpoint, stage=stage, kind="rate_limit" if is_rate_limit else "error")
             if is_rate_limit:
                 raise HTTPException(
                     status_code=429,
@@ -127,10 +619,77 @@ def clean_json_response(text: str) -> str:
     return text.strip()
 
 
+# --- Fast JSON Responses ---
+# Result rows come straight from DuckDB, so endpoints that return them skip
+# pydantic re-validation (model_construct) and FastAPI's jsonable_encoder,
+# and are encoded once with orjson.
+def json_default(obj: Any) -> Any:
+    """Encodes values orjson does not handle natively (pydantic models, pandas/Decimal scalars)."""
+    if isinstance(obj, BaseModel):
+        return dict(obj)
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps_json(content: Any) -> bytes:
+    """Serializes content to JSON bytes with orjson (NaN/Inf become null)."""
+    return orjson.dumps(
+        content,
+        default=json_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    )
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson."""
+
+    def render(self, content: Any) -> bytes:
+        with JSON_ENCODE_SECONDS.time(endpoint=current_endpoint.get()):
+            return dumps_json(content)
+
+
+# Response body formats for result rows:
+#   records -> [{"col": value, ...}, ...] (default)
+#   columns -> {"columns": [...], "rows": [[...], ...]}
+RESULT_FORMATS = ("records", "columns")
+
+
+def records_to_columnar(records: List[dict]) -> Dict[str, Any]:
+    """Converts a list of row dicts to the compact columnar payload."""
+    columns = list(records[0].keys()) if records else []
+    return {"columns": columns, "rows": [list(row.values()) for row in records]}
+
+
+def dataframe_to_payload(df: pd.DataFrame, result_format: str) -> Union[List[dict], Dict[str, Any]]:
+    """Converts a query result DataFrame to the requested result format."""
+    if result_format == "columns":
+        return {"columns": [str(c) for c in df.columns], "rows": df.values.tolist()}
+    return df.to_dict(orient='records')
+
+
+def check_result_format(result_format: Optional[str]) -> str:
+    """Validates the requested result format. Raises 400 if unknown."""
+    result_format = result_format or "records"
+    if result_format not in RESULT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format: {result_format}. Use one of: {', '.join(RESULT_FORMATS)}."
+        )
+    return result_format
+
+
 app = FastAPI(
     title="Cricket Analytics API",
     description="Natural language to SQL analysis engine for cricket data",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # --- CORS Configuration ---
@@ -142,17 +701,124 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-db_path = "cricket_analytics.duckdb"
+
+
+# --- Request Metrics ---
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    endpoint = request.url.path
+    token = current_endpoint.set(endpoint)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so unknown paths cannot blow up cardinality
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            endpoint=route.path if route else "unmatched", status=status
+        )
+        current_endpoint.reset(token)
+
+
+# --- Response Compression ---
+# Brotli is preferred when the client accepts it, gzip otherwise.
+# Small bodies are sent as-is since compression would not pay off.
+# Streamed responses (no Content-Length) are passed through untouched.
+MIN_COMPRESS_BYTES = 1024
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 5
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """br or gzip by the client's q-values (brotli wins ties); None if neither is acceptable."""
+    q_values = {}
+    for part in accept_encoding.lower().split(","):
+        coding, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if coding:
+            q_values[coding] = q
+    best, best_q = None, 0.0
+    for coding in ("br", "gzip"):
+        q = q_values.get(coding, q_values.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+@app.middleware("http")
+async def compress_response(request: Request, call_next):
+    response = await call_next(request)
+    if "content-encoding" in response.headers or "content-length" not in response.headers:
+        return response
+
+    # The body's encoding depends on Accept-Encoding from here on, compressed or not
+    response.headers.add_vary_header("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    if encoding is None or int(response.headers["content-length"]) < MIN_COMPRESS_BYTES:
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    if encoding == "br":
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+    # Raw headers keep repeated ones (Set-Cookie); Response sets the new Content-Length
+    compressed = Response(content=body, status_code=response.status_code)
+    compressed.raw_headers.extend(h for h in response.raw_headers if h[0] != b"content-length")
+    compressed.headers["content-encoding"] = encoding
+    return compressed
+
 
 # --- Models ---
 class QueryRequest(BaseModel):
     prompt: str
     project_id: Optional[str] = None
+    format: Optional[str] = "records"  # records or columns
+    approximate: bool = False  # estimate aggregates from balls_sample
+    refine: bool = False  # with approximate: also compute the exact answer in the background
+    max_rows: Optional[int] = None  # row cap for the result (at most MAX_RESULT_ROWS)
 
 class AnalysisResponse(BaseModel):
     markdown: str
     sql_used: str
-    data: List[dict]
+    data: Union[List[dict], Dict[str, Any]]  # records, or {"columns", "rows"}
+    approximate: bool = False
+    approximation: Optional[Dict[str, Any]] = None  # sample, confidence intervals, refine_id
+    intent: Optional[Dict[str, Any]] = None  # set when a local template answered without Gemini
+    truncated: bool = False
+    truncation: Optional[Dict[str, Any]] = None  # reason (rows/bytes), limit, rows_returned
+
+class BatchQueryRequest(BaseModel):
+    prompts: List[str]
+    project_id: Optional[str] = None
+    format: Optional[str] = "records"  # records or columns
+    max_rows: Optional[int] = None  # row cap per result (at most MAX_RESULT_ROWS)
+
+class BatchItemResult(BaseModel):
+    prompt: str
+    markdown: str
+    sql_used: Optional[str] = None
+    data: Optional[Union[List[dict], Dict[str, Any]]] = None
+    intent: Optional[Dict[str, Any]] = None
+    truncated: bool = False
+    truncation: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+class BatchAnalysisResponse(BaseModel):
+    results: List[BatchItemResult]  # one per prompt, in request order
+    llm_calls: int
+    total_records: int
 
 
 # --- Deep Analysis Models ---
@@ -162,8 +828,9 @@ class AnalyticalStep(BaseModel):
     title: str
     research_question: str
     sql_query: Optional[str] = None
-    results: Optional[List[dict]] = None
+    results: Optional[Union[List[dict], Dict[str, Any]]] = None
     insight: Optional[str] = None
+    truncation: Optional[Dict[str, Any]] = None  # set when results were cut to the row/byte budget
     error: Optional[str] = None
 
 
@@ -173,14 +840,17 @@ class ChartRecommendation(BaseModel):
     title: str
     data_key: str  # which step's data to use
     x_axis: Optional[str] = None
-    y_axis: Optional[str] = None
+    y_axis: Optional[str] = None  # one column, or several comma-separated
     description: str
+    series: Optional[Dict[str, Any]] = None  # chart-ready points, built server-side
 
 
 class DeepAnalysisRequest(BaseModel):
     """Request for comprehensive multi-step analysis"""
     prompt: str
     max_steps: Optional[int] = 4
+    format: Optional[str] = "records"  # records or columns
+    max_rows: Optional[int] = None  # row cap per step result (at most MAX_RESULT_ROWS)
 
 
 class DeepAnalysisResponse(BaseModel):
@@ -196,14 +866,268 @@ class DeepAnalysisResponse(BaseModel):
     total_records_analyzed: int
 
 # --- Helper Functions ---
+# scripts/ingest_cricsheet.py publishes a new database by atomically pointing
+# db_path (a symlink) at a new snapshot file. Connections already open keep
+# reading the old snapshot; the next connection opens the new one. DuckDB
+# shares one instance per path within a process, so connections are opened
+# on the resolved snapshot path, and caches built from the old snapshot are
+# dropped when it changes.
+db_snapshot = None
+db_snapshot_lock = threading.Lock()
+
+
+def current_db_file() -> str:
+    """Resolves db_path to the current snapshot, clearing caches if it changed."""
+    global db_snapshot
+    path = os.path.realpath(db_path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return db_path
+    current = (path, stat.st_ino, stat.st_mtime_ns)
+    with db_snapshot_lock:
+        if current == db_snapshot:
+            return path
+        changed = db_snapshot is not None
+        db_snapshot = current
+    if changed:
+        print(f"Database snapshot changed ({db_path} -> {path}); clearing caches")
+        available_tables.cache_clear()
+        sample_info.cache_clear()
+        intent_entities.cache_clear()
+        catalog_columns.cache_clear()
+        matchup_store.cache_clear()
+    return path
+
+
 def get_db_connection():
     # Connect in Read-Only mode for safety
-    con = duckdb.connect(db_path, read_only=True)
+    con = duckdb.connect(current_db_file(), read_only=True, config=duckdb_config())
+    return con
+
+
+def get_sandboxed_connection():
+    """
+    Connection for SQL supplied by clients. The database is attached
+    read-only to a private in-memory instance, then external access (file
+    reads and writes, ATTACH, extensions) is switched off for good, so a
+    statement like COPY ... TO or read_csv() fails instead of touching disk.
+    """
+    con = duckdb.connect(config=duckdb_config())
+    try:
+        path = current_db_file().replace("'", "''")
+        con.execute(f"ATTACH '{path}' AS cricket (READ_ONLY)")
+        con.execute("USE cricket")
+        con.execute("SET enable_external_access = false")
+    except Exception:
+        con.close()
+        raise
     return con
 
+
+def single_select(con, sql: str) -> Optional[str]:
+    """The statement if `sql` is exactly one SELECT, else None."""
+    try:
+        statements = con.extract_statements(sql)
+    except duckdb.Error:
+        return None
+    if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+        return None
+    return statements[0].query
+
+# --- Derived Tables ---
+# Optional tables built offline by scripts/build_derived_tables.py. Each one
+# is described in the schema prompt only if it exists in the database.
+DERIVED_TABLE_DOCS = {
+    "batter_innings": """
+    ===========================================
+    DERIVED TABLE: batter_innings - One row per batter per innings (PRECOMPUTED FROM balls)
+    ===========================================
+    Use for: Milestones (50s, 100s), nervous nineties, conversion rates, innings-level
+    scoring, "how fast did X reach 100". PREFER this over window functions on balls.
+
+    Columns:
+       - match_id (VARCHAR), innings (INTEGER), batter (VARCHAR)
+       - batting_team (VARCHAR), bowling_team (VARCHAR)
+       - format (VARCHAR), date (DATE): Copied from matches (no JOIN needed)
+       - runs (INTEGER), balls (INTEGER): Final score and balls faced (wides excluded)
+       - fours, sixes, dots (INTEGER)
+       - strike_rate (DOUBLE)
+       - is_out (BOOLEAN), wicket_type (VARCHAR), dismissed_by (VARCHAR): bowler on the dismissal ball
+       - ball_at_50, ball_at_90, ball_at_100 (INTEGER): Ball faced on which the batter
+         reached 50 / 90 / 100 (NULL if never reached)
+       - progression (SMALLINT[]): Batter's score after each ball faced (1-based list)
+
+    Examples:
+       -- Conversion of 90s into 100s
+       SELECT batter, COUNT(*) FILTER (WHERE ball_at_90 IS NOT NULL) AS reached_90,
+              COUNT(*) FILTER (WHERE ball_at_100 IS NOT NULL) AS reached_100
+       FROM batter_innings WHERE format = 'ODI' GROUP BY batter
+       -- Balls taken from 90 to 100
+       SELECT batter, AVG(ball_at_100 - ball_at_90) AS balls_90_to_100
+       FROM batter_innings WHERE ball_at_100 IS NOT NULL GROUP BY batter
+       -- Score after 30 balls
+       SELECT batter, progression[30] AS score_after_30 FROM batter_innings WHERE balls >= 30
+    """,
+    "balls_enriched": """
+    ===========================================
+    DERIVED TABLE: balls_enriched - IPL balls with commentary PRE-JOINED (PRECOMPUTED)
+    ===========================================
+    Use for: ANY commentary question (yorkers, bouncers, line/length, edges, sentiment).
+    PREFER this over the RULE 3 commentary JOIN: it is one table, no JOIN needed, and
+    RULES 4-5 still apply (IPL-only, caveat the sample size).
+
+    Columns:
+       - Every balls column (match_id, innings, over, ball, batter, bowler, runs_off_bat,
+         total_runs, wicket_type, dismissed_batter, phase, ...)
+       - date (DATE), season (INTEGER), venue, city, country, format, gender,
+         winner, toss_winner, toss_decision: Copied from matches
+       - has_commentary (BOOLEAN): TRUE if the ball has a commentary entry
+       - commentary_text (VARCHAR), sentiment_score (FLOAT)
+       - length_short, length_full, length_good, line_off, line_middle, line_leg,
+         mention_yorker, mention_bouncer, mention_swing, mention_spin, mention_beaten,
+         mention_edge, mention_mistimed (BOOLEAN): NULL when has_commentary is FALSE
+
+    Examples:
+       -- Yorker effectiveness (same as the RULE 3 query, without the JOIN)
+       SELECT bowler, COUNT(*) AS yorkers_bowled,
+              COUNT(wicket_type) AS wickets, ROUND(AVG(runs_off_bat), 2) AS avg_runs
+       FROM balls_enriched WHERE mention_yorker GROUP BY bowler HAVING COUNT(*) >= 20
+       -- Share of commentated deliveries that were short, by season
+       SELECT season, ROUND(AVG(length_short::INTEGER) * 100, 1) AS short_pct
+       FROM balls_enriched WHERE has_commentary GROUP BY season ORDER BY season
+    """,
+    "commentary_postings": """
+    ===========================================
+    FULL-TEXT SEARCH over commentary.text (INVERTED INDEX, BM25 RANKED)
+    ===========================================
+    Use for: Case-insensitive or ranked searches for words or phrases in commentary
+    text ("slower ball", "knuckle ball", "dropped"). Several times faster than
+    ILIKE, LOWER(text) LIKE or regexp on commentary.text; NEVER use those.
+    A phrase made only of common words ("slower ball") is no faster than a plain
+    case-sensitive text LIKE '%...%', which is fine when the exact casing is known.
+
+    Table functions (case-insensitive, punctuation ignored):
+       - commentary_search('words'): entries containing ANY of the words, ranked
+       - commentary_phrase('exact phrase'): entries containing the words in that order
+    Columns returned:
+       - doc_id (INTEGER), commentary_id (VARCHAR)
+       - match_id (VARCHAR), innings, over, ball (INTEGER): JOIN to balls / balls_enriched
+       - score (DOUBLE): BM25 relevance, matched_terms (INTEGER)
+       - phrase_tf (INTEGER, commentary_phrase only): times the phrase occurs
+
+    Examples:
+       -- Slower balls by bowler
+       SELECT b.bowler, COUNT(*) AS slower_balls, COUNT(b.wicket_type) AS wickets
+       FROM commentary_phrase('slower ball') s
+       JOIN balls b ON b.match_id = s.match_id AND b.innings = s.innings
+                   AND b.over = s.over AND b.ball = s.ball
+       GROUP BY b.bowler ORDER BY slower_balls DESC
+    """,
+    "matchups": """
+    ===========================================
+    DERIVED TABLE: matchups - Batter vs bowler totals per format (PRECOMPUTED FROM balls)
+    ===========================================
+    Use for: ANY head-to-head between a batter and a bowler ("Kohli vs Starc",
+    "who dismissed X most", "bowlers X struggles against") when no season, venue,
+    phase or team filter is needed. PREFER this over aggregating balls.
+
+    Columns:
+       - batter (VARCHAR), bowler (VARCHAR), format (VARCHAR)
+       - balls_faced (INTEGER): wides excluded
+       - runs (INTEGER): runs off the bat
+       - dismissals (INTEGER): batter out to this bowler (run outs excluded)
+       - dots, fours, sixes (INTEGER)
+
+    Examples:
+       -- Kohli against Starc
+       SELECT format, balls_faced, runs, dismissals,
+              ROUND(runs * 100.0 / NULLIF(balls_faced, 0), 2) AS strike_rate
+       FROM matchups WHERE batter = 'V Kohli' AND bowler = 'MA Starc'
+       -- Bowlers who dismissed a batter most often
+       SELECT bowler, SUM(dismissals) AS dismissals, SUM(balls_faced) AS balls
+       FROM matchups WHERE batter = 'V Kohli' GROUP BY bowler ORDER BY dismissals DESC LIMIT 10
+    """,
+    "match_cube": """
+    ===========================================
+    DERIVED TABLE: match_cube - Match results pre-aggregated by venue/country/era/toss (OLAP CUBE)
+    ===========================================
+    Use for: toss impact, batting first vs chasing, win % and average first/second-innings
+    totals by venue, country, format, gender, season or decade. PREFER this over
+    aggregating matches + balls: every answer is ONE row lookup per group.
+
+    Columns:
+       - venue, country, format, gender (VARCHAR), season, decade (INTEGER: 1990, 2000, ...),
+         toss_decision (VARCHAR: 'bat'/'field'): the dimensions; NULL when not grouped by
+       - grouped_by (VARCHAR): the dimensions of this row, comma-separated in the order
+         venue,country,format,gender,season,decade,toss_decision ('' = all matches).
+         ALWAYS filter on grouped_by: at most one of venue/country, one of season/decade
+       - matches, decided (INTEGER): all matches / matches with a winner
+       - bat_first_wins, chasing_wins (INTEGER): wins by the side batting first / second
+       - toss_winner_wins (INTEGER)
+       - avg_first_innings, avg_second_innings (DOUBLE): average innings totals
+
+    Examples:
+       -- Toss impact by venue in T20s
+       SELECT venue, toss_decision, decided, ROUND(toss_winner_wins * 100.0 / decided, 1) AS toss_win_pct
+       FROM match_cube WHERE grouped_by = 'venue,format,toss_decision' AND format = 'T20' AND decided >= 10
+       -- Chasing win % by country and decade in ODIs
+       SELECT country, decade, ROUND(chasing_wins * 100.0 / NULLIF(bat_first_wins + chasing_wins, 0), 1) AS chase_win_pct
+       FROM match_cube WHERE grouped_by = 'country,format,decade' AND format = 'ODI' ORDER BY country, decade
+    """,
+    "balls_keyed": """
+    ===========================================
+    STORAGE TABLE: balls_keyed - the rows behind balls, with integer player/team keys
+    ===========================================
+    Here balls is a VIEW over balls_keyed that looks the names up; it has the usual columns.
+    Use balls_keyed for: aggregations grouped by a player or team over many matches (career
+    totals, leaderboards, team splits): grouping integer keys is several times faster than
+    names. Keep using balls for everything else (windows, commentary joins).
+
+    Columns: the same as balls, except
+       - batter_id, non_striker_id, bowler_id, dismissed_batter_id (INTEGER) instead of the
+         names: JOIN players (player_id, name)
+       - batting_team_id, bowling_team_id (INTEGER) instead of the names: JOIN teams (team_id, name)
+       - innings, over, ball, runs_off_bat, extras, total_runs, wickets_fallen,
+         cumulative_runs: small unsigned integers (cast to INTEGER before subtracting)
+    GROUP BY the key, then JOIN the dimension for the name (after aggregating, not before).
+    For one player, compare keys: batter_id = (SELECT player_id FROM players WHERE name = 'V Kohli').
+
+    Examples:
+       -- Career run leaders
+       SELECT p.name AS batter, k.runs, k.balls
+       FROM (SELECT batter_id, SUM(runs_off_bat) AS runs, COUNT(*) AS balls
+             FROM balls_keyed GROUP BY batter_id) k
+       JOIN players p ON p.player_id = k.batter_id
+       ORDER BY k.runs DESC LIMIT 20
+    """,
+}
+
+
+@lru_cache(maxsize=1)
+def available_tables() -> frozenset:
+    """Names of the tables in the database (cached; empty if it cannot be opened)."""
+    try:
+        con = get_db_connection()
+        try:
+            rows = con.execute("SELECT table_name FROM information_schema.tables").fetchall()
+        finally:
+            con.close()
+    except Exception as e:
+        print(f"[Schema] Could not list tables: {e}")
+        return frozenset()
+    return frozenset(r[0] for r in rows)
+
+
+def derived_schema_docs() -> str:
+    """Schema prompt sections for the derived tables present in the database."""
+    tables = available_tables()
+    return "".join(doc for name, doc in DERIVED_TABLE_DOCS.items() if name in tables)
+
+
 def get_database_schema() -> str:
     """Get the database schema for context in prompts"""
-    return """
+    schema = """
     Database: DuckDB with Cricket Data (5M+ balls, 11,535 matches)
 
     ===========================================
@@ -367,6 +1291,7 @@ def get_database_schema() -> str:
 
     Note: Use DuckDB SQL syntax. Common functions: ROW_NUMBER(), SUM(), AVG(), COUNT(), CASE WHEN
     """
+    return schema + derived_schema_docs()
 
 
 def decompose_and_generate_sql(prompt: str, schema: str, max_steps: int = 4) -> List[Dict[str, Any]]:
@@ -424,7 +1349,7 @@ def decompose_and_generate_sql(prompt: str, schema: str, max_steps: int = 4) ->
     Return ONLY valid JSON, no explanations.
     """
 
-    response_text = call_gemini(combined_prompt)
+    response_text = call_gemini(combined_prompt, stage="decompose")
     response_text = clean_json_response(response_text)
 
     try:
@@ -440,6 +1365,126 @@ def decompose_and_generate_sql(prompt: str, schema: str, max_steps: int = 4) ->
         }]
 
 
+# --- Result Profiling (compact data context for prompts) ---
+# Instead of pasting raw row samples into prompts, each result set is reduced
+# to a small statistical profile computed with pandas/NumPy in one pass.
+PROFILE_TOP_CATEGORIES = 5
+PROFILE_HEAD_ROWS = 3
+PROFILE_EXTREME_ROWS = 2
+
+
+def is_year_column(name: str, series: pd.Series) -> bool:
+    """True for year/season-like columns that can serve as a trend axis."""
+    name = name.lower()
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    return name in ("year", "season") or name.endswith("_year") or name.endswith("_season")
+
+
+def year_values(series: pd.Series) -> pd.Series:
+    """Numeric year for a year-like column ("2007/08" -> 2007, dates -> their year)."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.year
+    return pd.to_numeric(series.astype(str).str[:4], errors="coerce")
+
+
+def round_value(value: Any) -> Any:
+    """Rounds floats for compact prompt output; leaves everything else alone."""
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else round(float(value), 3)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def profile_results(results: List[dict]) -> Dict[str, Any]:
+    """
+    Builds a compact statistical profile of a result set:
+    per-column dtype and null count, min/max/mean/quartiles for numeric
+    columns, top-k values for categorical columns, the trend slope of each
+    metric over a year/season column, and a few leading and extreme rows.
+    """
+    df = pd.DataFrame(results)
+    profile: Dict[str, Any] = {"row_count": len(df), "columns": {}}
+    if df.empty:
+        return profile
+
+    year_col = next((c for c in df.columns if is_year_column(str(c), df[c])), None)
+    metric_cols = [c for c in df.select_dtypes(include="number").columns if c != year_col]
+
+    numeric = df[metric_cols]
+    stats = numeric.describe(percentiles=[0.25, 0.5, 0.75]).T if metric_cols else pd.DataFrame()
+
+    for col in df.columns:
+        series = df[col]
+        info: Dict[str, Any] = {"dtype": str(series.dtype)}
+        nulls = int(series.isna().sum())
+        if nulls:
+            info["nulls"] = nulls
+
+        if col in metric_cols:
+            row = stats.loc[col]
+            info.update({
+                "min": round_value(row["min"]),
+                "p25": round_value(row["25%"]),
+                "median": round_value(row["50%"]),
+                "mean": round_value(row["mean"]),
+                "p75": round_value(row["75%"]),
+                "max": round_value(row["max"]),
+            })
+        elif col == year_col:
+            years = year_values(series)
+            info.update({"min": round_value(years.min()), "max": round_value(years.max())})
+        else:
+            counts = series.astype(str).value_counts()
+            info["distinct"] = int(len(counts))
+            info["top"] = {str(k): int(v) for k, v in counts.head(PROFILE_TOP_CATEGORIES).items()}
+
+        profile["columns"][str(col)] = info
+
+    # Trend: least-squares slope of each metric's yearly mean
+    if year_col is not None and metric_cols:
+        by_year = numeric.groupby(year_values(df[year_col])).mean()
+        if len(by_year) >= 3:
+            x = by_year.index.to_numpy(dtype=float)
+            trends = {}
+            for col in metric_cols:
+                y = by_year[col].to_numpy(dtype=float)
+                mask = ~np.isnan(y)
+                if mask.sum() >= 3:
+                    trends[str(col)] = round_value(np.polyfit(x[mask], y[mask], 1)[0])
+            if trends:
+                profile["trend_per_year"] = {"over": str(year_col), "slope": trends}
+
+    # Result sets are usually ordered, so the first rows matter most;
+    # add the extremes of the leading metric for context.
+    profile["first_rows"] = [
+        {k: round_value(v) for k, v in row.items()} for row in results[:PROFILE_HEAD_ROWS]
+    ]
+    if metric_cols and len(df) > PROFILE_HEAD_ROWS:
+        key = metric_cols[0]
+        extremes = pd.concat([
+            df.nlargest(PROFILE_EXTREME_ROWS, key),
+            df.nsmallest(PROFILE_EXTREME_ROWS, key),
+        ])
+        extremes = extremes[~extremes.index.isin(range(PROFILE_HEAD_ROWS))]
+        if not extremes.empty:
+            profile["extreme_rows"] = {
+                "by": str(key),
+                "rows": [
+                    {k: round_value(v) for k, v in row.items()}
+                    for row in extremes[~extremes.index.duplicated()].to_dict(orient="records")
+                ]
+            }
+
+    return profile
+
+
+def format_profile(results: List[dict]) -> str:
+    """Profile of a result set as compact JSON for prompts."""
+    return json.dumps(profile_results(results), separators=(",", ":"), default=str)
+
+
 def synthesize_article(
     original_prompt: str,
     steps: List[AnalyticalStep],
@@ -458,10 +1503,9 @@ def synthesize_article(
         Research Question: {step.research_question}
         """
         if step.results:
-            # Include sample of results (first 10 rows)
-            sample_results = step.results[:10] if len(step.results) > 10 else step.results
+            # Compact statistical profile instead of raw rows
             steps_context += f"""
-        Results (sample): {json.dumps(sample_results, indent=2)}
+        Results profile: {format_profile(step.results)}
         Total records: {len(step.results)}
             """
         if step.error:
@@ -508,7 +1552,7 @@ def synthesize_article(
     Return ONLY valid JSON.
     """
 
-    response_text = call_gemini(synthesis_prompt)
+    response_text = call_gemini(synthesis_prompt, stage="synthesize")
     response_text = clean_json_response(response_text)
 
     try:
@@ -527,92 +1571,1585 @@ def synthesize_article(
         }
 
 
+# --- Local Chart Recommender ---
+# Chart choice is mostly a function of column types, so it is decided locally
+# instead of spending a Gemini request (and a throttle slot) on it:
+#   temporal + metric            -> line
+#   category + metric (few)      -> bar
+#   category + metric (many)     -> horizontal-bar
+#   category + 3 or more metrics -> radar (multi-metric per entity)
+#   two metrics                  -> scatter
+# Titles state what the data shows. Set LLM_CHART_TITLES=true to have Gemini
+# polish them into insight form in one extra call.
+LLM_CHART_TITLES = os.environ.get("LLM_CHART_TITLES", "false").lower() == "true"
+MAX_BAR_CATEGORIES = 8
+MAX_RADAR_METRICS = 5
+MIN_SCATTER_ROWS = 5
+PROFILE_SAMPLE_ROWS = 50
+NON_METRIC_COLUMNS = ("rank", "rn", "row_number", "innings", "over", "ball")
+
+
+def format_number(value: Any) -> str:
+    """Human-readable number for chart titles."""
+    if isinstance(value, float):
+        return f"{value:,.1f}" if abs(value) >= 10 else f"{value:,.2f}"
+    if isinstance(value, int):
+        return f"{value:,}"
+    return str(value)
+
+
+def label(column: str) -> str:
+    """Column alias as a title fragment (strike_rate -> Strike Rate)."""
+    return column.replace("_", " ").title()
+
+
+def classify_columns(results: List[dict]) -> Dict[str, List[str]]:
+    """
+    Splits result columns into temporal, metric and category columns by
+    looking at the first non-null value of each column.
+    """
+    columns = list(results[0].keys())
+    sample = results[:PROFILE_SAMPLE_ROWS]
+    kinds: Dict[str, List[str]] = {"temporal": [], "metric": [], "category": []}
+
+    for col in columns:
+        value = next((row.get(col) for row in sample if row.get(col) is not None), None)
+        name = col.lower()
+        if isinstance(value, (datetime, date)) or name in ("year", "season") \
+                or name.endswith("_year") or name.endswith("_season") or name in ("date", "match_date"):
+            kinds["temporal"].append(col)
+        elif isinstance(value, bool) or value is None:
+            continue
+        elif isinstance(value, (int, float, np.number)):
+            if name.endswith("_id") or name in NON_METRIC_COLUMNS:
+                continue
+            kinds["metric"].append(col)
+        elif isinstance(value, str):
+            if name.endswith("_id"):
+                continue
+            kinds["category"].append(col)
+
+    return kinds
+
+
+def recommend_charts(results: List[dict], data_key: str, context: str = "") -> List[ChartRecommendation]:
+    """
+    Recommends up to two charts for one result set from its column types.
+    """
+    if not results:
+        return []
+
+    kinds = classify_columns(results)
+    metrics, categories, temporal = kinds["metric"], kinds["category"], kinds["temporal"]
+    if not metrics:
+        return []
+
+    charts: List[ChartRecommendation] = []
+    metric = metrics[0]
+    subject = f" ({context[:60]})" if context else ""
+
+    if temporal:
+        x = temporal[0]
+        points = sorted(
+            (row for row in results if row.get(x) is not None and row.get(metric) is not None),
+            key=lambda row: str(row[x])
+        )
+        if len(points) >= 2:
+            first, last = points[0], points[-1]
+            direction = "rose" if last[metric] > first[metric] else "fell" if last[metric] < first[metric] else "held"
+            title = (f"{label(metric)} {direction} from {format_number(first[metric])} to "
+                     f"{format_number(last[metric])} ({first[x]}–{last[x]})")
+        else:
+            title = f"{label(metric)} by {label(x)}"
+        charts.append(ChartRecommendation(
+            chart_type="line",
+            title=title,
+            data_key=data_key,
+            x_axis=x,
+            y_axis=metric,
+            description=f"Trend of {label(metric).lower()} over {label(x).lower()}{subject}."
+        ))
+
+    if categories:
+        x = categories[0]
+        distinct = len({row.get(x) for row in results})
+        ranked = [row for row in results if row.get(metric) is not None]
+        leader = max(ranked, key=lambda row: row[metric]) if ranked else None
+
+        if len(metrics) >= 3 and distinct <= MAX_BAR_CATEGORIES:
+            y_keys = metrics[:MAX_RADAR_METRICS]
+            charts.append(ChartRecommendation(
+                chart_type="radar",
+                title=f"How {distinct} {label(x).lower()}s compare across {len(y_keys)} metrics",
+                data_key=data_key,
+                x_axis=x,
+                y_axis=",".join(y_keys),
+                description=f"Multi-metric profile per {label(x).lower()}{subject}."
+            ))
+        else:
+            if leader is not None:
+                title = f"{leader[x]} leads on {label(metric).lower()} with {format_number(leader[metric])}"
+            else:
+                title = f"{label(metric)} by {label(x)}"
+            charts.append(ChartRecommendation(
+                chart_type="bar" if distinct <= MAX_BAR_CATEGORIES else "horizontal-bar",
+                title=title,
+                data_key=data_key,
+                x_axis=x,
+                y_axis=metric,
+                description=f"{label(metric)} compared across {distinct} {label(x).lower()} values{subject}."
+            ))
+
+    if len(metrics) >= 2 and len(results) >= MIN_SCATTER_ROWS and len(charts) < 2:
+        x_metric, y_metric = metrics[0], metrics[1]
+        pairs = np.array(
+            [(row[x_metric], row[y_metric]) for row in results
+             if row.get(x_metric) is not None and row.get(y_metric) is not None],
+            dtype=float
+        )
+        title = f"{label(y_metric)} vs {label(x_metric)}"
+        if len(pairs) >= MIN_SCATTER_ROWS and pairs[:, 0].std() > 0 and pairs[:, 1].std() > 0:
+            r = float(np.corrcoef(pairs[:, 0], pairs[:, 1])[0, 1])
+            strength = "strongly" if abs(r) >= 0.7 else "moderately" if abs(r) >= 0.4 else "weakly"
+            title = f"{label(y_metric)} is {strength} {'linked' if r >= 0 else 'inversely linked'} to {label(x_metric).lower()} (r = {r:.2f})"
+        charts.append(ChartRecommendation(
+            chart_type="scatter",
+            title=title,
+            data_key=data_key,
+            x_axis=x_metric,
+            y_axis=y_metric,
+            description=f"Relationship between {label(x_metric).lower()} and {label(y_metric).lower()}{subject}."
+        ))
+
+    return charts
+
+
+def rewrite_chart_titles(charts: List[ChartRecommendation]) -> List[ChartRecommendation]:
+    """
+    Optionally asks Gemini to rewrite locally generated titles into insight form.
+    Keeps the local titles if the call fails or returns something unusable.
+    """
+    if not charts or not LLM_CHART_TITLES or not genai_client:
+        return charts
+
+    title_prompt = f"""
+    You are editing chart titles for a cricket analytics publication.
+
+    Rewrite each title so it states the INSIGHT, not the data. Keep the numbers.
+    Good: "Accelerators Convert 35% More Often"
+    Bad: "Conversion Rate by Acceleration Category"
+
+    Charts:
+    {json.dumps([{"title": c.title, "description": c.description} for c in charts])}
+
+    Return a JSON array of {len(charts)} strings, in the same order. Return ONLY valid JSON.
+    """
+
+    try:
+        titles = json.loads(clean_json_response(call_gemini(title_prompt, stage="chart_titles")))
+        if isinstance(titles, list) and len(titles) == len(charts):
+            for chart, title in zip(charts, titles):
+                if isinstance(title, str) and title.strip():
+                    chart.title = title.strip()
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[Charts] Title rewrite failed, keeping local titles: {e}")
+
+    return charts
+
+
 def generate_chart_recommendations(
     steps: List[AnalyticalStep]
 ) -> List[ChartRecommendation]:
     """
     Generates chart recommendations based on the analytical steps and their results.
     """
-    # Build context from steps with results
-    steps_with_data = []
+    charts: List[ChartRecommendation] = []
     for step in steps:
         if step.results and len(step.results) > 0:
-            sample = step.results[0] if step.results else {}
-            columns = list(sample.keys()) if sample else []
-            steps_with_data.append({
-                "step_number": step.step_number,
-                "title": step.title,
-                "columns": columns,
-                "row_count": len(step.results),
-                "sample_row": sample
-            })
+            charts.extend(recommend_charts(step.results, f"step_{step.step_number}", step.title))
+
+    return rewrite_chart_titles(charts[:6])
+
+
+# --- Chart Series (server-side aggregation + downsampling) ---
+# Each recommendation gets a chart-ready series so the browser never has to
+# render a whole result set: charts over nominal categories are aggregated
+# and capped at top-N plus an "Other" bucket; line/area/scatter and any
+# chart over an ordinal x (seasons, overs) keep x order and are downsampled
+# with LTTB.
+CATEGORY_CHART_TYPES = ("bar", "horizontal-bar", "pie", "radar", "composed")
+MAX_CATEGORY_POINTS = {"pie": 6, "radar": 8}
+DEFAULT_MAX_CATEGORY_POINTS = 12
+MAX_SERIES_POINTS = 300
+OTHER_BUCKET_LABEL = "Other"
+# x columns whose order means something even when they hold strings
+ORDINAL_X_NAMES = {"season", "year", "decade", "date", "over", "overs", "ball", "innings", "month", "week"}
+# Row counts a rate or average can be weighted by when rows are merged,
+# so the merged value is the true rate rather than a mean of rates
+WEIGHT_COLUMNS = ("balls", "balls_faced", "deliveries", "innings", "matches", "overs", "count")
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Returns the indices of the points to keep (always the first and last),
+    choosing in each bucket the point that forms the largest triangle with
+    the previously kept point and the average of the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    bucket_size = (n - 2) / (threshold - 2)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0] = 0
+    a = 0
+
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_end <= end:
+            next_end = min(end + 1, n)
+
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
 
-    if not steps_with_data:
-        return []
+    keep[-1] = n - 1
+    return keep
+
+
+def is_ordinal_axis(series: pd.Series, name: str) -> bool:
+    """True for numbers, dates, and season/over-like columns (their order matters)."""
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    return name.lower() in ORDINAL_X_NAMES or any(part in ORDINAL_X_NAMES for part in name.lower().split("_"))
+
+
+def ordinal_sort_key(values: pd.Series) -> pd.Series:
+    """Sorts numeric-looking strings ("9", "10") as numbers."""
+    numbers = pd.to_numeric(values, errors="coerce")
+    return values if numbers.isna().any() else numbers
+
+
+def column_aggregations(df: pd.DataFrame, y_keys: List[str], weight: Optional[str]) -> Dict[str, str]:
+    """
+    How each y column is combined when rows share an x value: integer
+    metrics (counts, runs, and the weight column itself) are summed; float
+    metrics (rates, averages) are averaged, weighted by the row-count column
+    when the result has one.
+    """
+    return {
+        key: "sum" if key == weight or pd.api.types.is_integer_dtype(df[key])
+        else "weighted_mean" if weight else "mean"
+        for key in y_keys
+    }
+
+
+def aggregate_points(df: pd.DataFrame, aggregations: Dict[str, str],
+                     weight: Optional[str]) -> Dict[str, Any]:
+    """One point's values from several rows, combining each column by its aggregation."""
+    weights = df[weight].to_numpy(dtype=float) if weight else None
+    point = {}
+    for key, aggregation in aggregations.items():
+        if aggregation == "sum":
+            point[key] = df[key].sum()
+        elif aggregation == "weighted_mean" and weights.sum() > 0:
+            point[key] = (df[key] * weights).sum() / weights.sum()
+        else:
+            point[key] = df[key].mean()
+    return point
+
+
+def merge_duplicate_x(df: pd.DataFrame, x_key: str, aggregations: Dict[str, str],
+                      weight: Optional[str], sort: bool) -> pd.DataFrame:
+    """One row per x value. The weight column is kept (summed) so later merges can still use it."""
+    if weight and weight not in aggregations:
+        aggregations = {**aggregations, weight: "sum"}
+    rows = [{x_key: x, **aggregate_points(group, aggregations, weight)}
+            for x, group in df.groupby(x_key, sort=sort)]
+    return pd.DataFrame(rows, columns=[x_key] + list(aggregations))
+
+
+def build_chart_series(results: List[dict], chart: ChartRecommendation) -> Optional[Dict[str, Any]]:
+    """
+    Builds the chart-ready series for one recommendation.
+    Rows sharing an x value are merged column by column (see
+    column_aggregations), and "aggregation" reports the choice per column.
+    Ordinal x (numbers, dates, seasons, overs) keeps its order and is never
+    bucketed; only nominal categories are cut to top-N plus "Other".
+    Returns None if the axes are not in the data.
+    """
+    df = pd.DataFrame(results)
+    x_key = chart.x_axis
+    y_keys = [c.strip() for c in (chart.y_axis or "").split(",") if c.strip()]
+    if df.empty or x_key not in df.columns:
+        return None
+    y_keys = [c for c in y_keys if c in df.columns and pd.api.types.is_numeric_dtype(df[c])]
+    if not y_keys:
+        return None
 
-    chart_prompt = f"""
-    You are a data visualization expert for cricket analytics.
+    weight = next((c for c in WEIGHT_COLUMNS if c in df.columns and c != x_key
+                   and pd.api.types.is_integer_dtype(df[c])), None)
+    df = df[[x_key] + [c for c in dict.fromkeys(y_keys + [weight] if weight else y_keys) if c != x_key]]
+    df = df.dropna(subset=[y_keys[0]])
+    aggregations = column_aggregations(df, y_keys, weight)
+    source_rows = len(df)
+    downsampled = False
+    ordinal = is_ordinal_axis(df[x_key], x_key)
+
+    if chart.chart_type in CATEGORY_CHART_TYPES and not ordinal:
+        if df[x_key].duplicated().any():
+            df = merge_duplicate_x(df, x_key, aggregations, weight, sort=False)
+        df = df.sort_values(y_keys[0], ascending=False)
+
+        limit = MAX_CATEGORY_POINTS.get(chart.chart_type, DEFAULT_MAX_CATEGORY_POINTS)
+        if len(df) > limit:
+            downsampled = True
+            head, rest = df.iloc[:limit - 1], df.iloc[limit - 1:]
+            if chart.chart_type == "radar":
+                df = df.iloc[:limit]
+            else:
+                other = aggregate_points(rest, aggregations, weight)
+                other[x_key] = OTHER_BUCKET_LABEL
+                df = pd.concat([head, pd.DataFrame([other])], ignore_index=True)
+    else:
+        if chart.chart_type != "scatter" and df[x_key].duplicated().any():
+            df = merge_duplicate_x(df, x_key, aggregations, weight, sort=True)
+        df = df.sort_values(x_key, kind="stable", key=ordinal_sort_key).reset_index(drop=True)
+
+        if len(df) > MAX_SERIES_POINTS:
+            downsampled = True
+            if pd.api.types.is_numeric_dtype(df[x_key]):
+                x = df[x_key].to_numpy(dtype=float)
+            else:
+                x = np.arange(len(df), dtype=float)
+            y = df[y_keys[0]].to_numpy(dtype=float)
+            df = df.iloc[lttb_indices(x, y, MAX_SERIES_POINTS)]
+
+    return {
+        "x_key": x_key,
+        "y_keys": y_keys,
+        "points": df[[x_key] + [c for c in y_keys if c != x_key]].to_dict(orient="records"),
+        "aggregation": aggregations,
+        "source_rows": source_rows,
+        "downsampled": downsampled
+    }
+
+
+def attach_chart_series(charts: List[ChartRecommendation], data_by_key: Dict[str, List[dict]]):
+    """Fills in chart.series for every recommendation whose data_key resolves."""
+    for chart in charts:
+        results = data_by_key.get(chart.data_key)
+        if results:
+            try:
+                chart.series = build_chart_series(results, chart)
+            except Exception as e:
+                print(f"[Charts] Could not build series for '{chart.title}': {e}")
+
+
+def generate_sql_from_prompt(prompt: str) -> str:
+    """
+    Uses Gemini to convert natural language to DuckDB SQL.
+    """
+    schema = get_database_schema()
+
+    full_prompt = f"""
+    You are an expert Cricket Analyst.
+
+    {schema}
 
-    Given these analytical steps with their data structures:
-    {json.dumps(steps_with_data, indent=2)}
+    Convert the following user question into a valid DuckDB SQL query.
+    Return ONLY the SQL. No markdown formatting.
 
-    Recommend appropriate charts for visualization.
+    User Question: {prompt}
+    """
 
-    Available chart types:
-    - bar: For comparing categories
-    - horizontal-bar: For comparing many categories or long labels
-    - line: For trends over time
-    - area: For cumulative trends
-    - pie: For part-to-whole (use sparingly, max 6 slices)
-    - scatter: For correlation between two numeric variables
-    - radar: For multi-dimensional comparison
-    - composed: For combining bar and line
+    response_text = call_gemini(full_prompt, stage="generate_sql")
+    sql = response_text.replace('```sql', '').replace('```', '').strip().rstrip(";")
+    return sql
 
-    Return a JSON array with recommendations (no markdown, just raw JSON):
+
+# /analyze-batch: prompts per request, and how many of their queries run at once
+MAX_BATCH_PROMPTS = int(os.environ.get("MAX_BATCH_PROMPTS", "20"))
+BATCH_QUERY_WORKERS = int(os.environ.get("BATCH_QUERY_WORKERS", "4"))
+
+
+def generate_sql_batch(prompts: List[str]) -> List[Optional[str]]:
+    """
+    Converts several questions to DuckDB SQL in a single Gemini call (the
+    multi-query pattern of decompose_and_generate_sql). Returns one query per
+    prompt, in order; None where the model returned nothing usable.
+    """
+    schema = get_database_schema()
+    questions = "\n".join(f"{i}. {prompt}" for i, prompt in enumerate(prompts, start=1))
+
+    combined_prompt = f"""
+    You are an expert Cricket Analyst.
+
+    {schema}
+
+    Write one valid DuckDB SQL query for EACH of the following user questions.
+    Each query must answer its own question on its own.
+
+    User Questions:
+    {questions}
+
+    Return a JSON array (no markdown, raw JSON only), one object per question:
     [
-        {{
-            "chart_type": "bar",
-            "title": "Insight-revealing title (what it shows, not just what it is)",
-            "data_key": "step_1",
-            "x_axis": "column_name",
-            "y_axis": "column_name",
-            "description": "What insight this chart reveals"
-        }}
+        {{"index": 1, "sql_query": "SELECT ... FROM ... -- valid DuckDB SQL"}},
+        ...
     ]
 
-    Generate 3-6 chart recommendations. Return ONLY valid JSON.
-    """
+    Return ONLY valid JSON, no explanations.
+    """
+
+    response_text = call_gemini(combined_prompt, stage="generate_sql_batch")
+    response_text = clean_json_response(response_text)
+
+    queries: List[Optional[str]] = [None] * len(prompts)
+    try:
+        items = json.loads(response_text)
+    except json.JSONDecodeError:
+        return queries
+    if not isinstance(items, list):
+        return queries
+    for position, item in enumerate(items):
+        index, sql = position + 1, item
+        if isinstance(item, dict):
+            index, sql = item.get("index", index), item.get("sql_query")
+        if isinstance(index, int) and 1 <= index <= len(prompts) and isinstance(sql, str) and sql.strip():
+            queries[index - 1] = sql.replace('```sql', '').replace('```', '').strip()
+    return queries
+
+
+# --- Intent Templates (common questions without an LLM call) ---
+# Most /analyze prompts are one of a few shapes: a player's career or phase
+# splits, batter vs bowler, team vs team, leaderboards, venue and toss
+# records. classify_intent() recognises those locally, using the player, team
+# and venue names in the database, and answers them with vetted parameterized
+# queries instead of a Gemini round trip. A prompt only matches when every
+# word is accounted for (an entity, a filter or a keyword of that intent);
+# anything else still goes to Gemini.
+INTENT_TEMPLATES_ENABLED = os.environ.get("INTENT_TEMPLATES", "true").lower() == "true"
+INTENT_DEFAULT_LIMIT = 10
+INTENT_MAX_LIMIT = 100
+INTENT_MIN_BALLS = 300  # qualification for rate leaderboards (strike rate, economy, average)
+INTENT_MIN_MATCHES = 5  # qualification for venue tables when no venue is named
+
+BOWLER_WICKET = ("b.wicket_type IS NOT NULL AND b.wicket_type NOT IN "
+                 "('run out', 'retired hurt', 'retired out', 'retired not out', 'obstructing the field')")
+LEGAL_BALL_FACED = "COALESCE(b.extra_type, '') NOT IN ('wides', 'wide')"
+LEGAL_BALL_BOWLED = "COALESCE(b.extra_type, '') NOT IN ('wides', 'wide', 'noballs', 'noball')"
+RUNS_CONCEDED = "b.runs_off_bat + CASE WHEN b.extra_type IN ('wides', 'wide', 'noballs', 'noball') THEN b.extras ELSE 0 END"
+MATCH_FILTERS = """($format IS NULL OR m.format = $format)
+      AND ($gender IS NULL OR m.gender = $gender)
+      AND ($from_year IS NULL OR YEAR(m.date) >= $from_year)
+      AND ($to_year IS NULL OR YEAR(m.date) <= $to_year)
+      AND ($venue IS NULL OR m.venue = $venue)"""
+BALL_FILTERS = MATCH_FILTERS + """
+      AND ($phase IS NULL OR b.phase = $phase)
+      AND ($batting_team IS NULL OR b.batting_team = $batting_team)
+      AND ($bowling_team IS NULL OR b.bowling_team = $bowling_team)"""
+# The same filters over match_cube (a single season at most)
+CUBE_FILTERS = """($format IS NULL OR c.format = $format)
+      AND ($gender IS NULL OR c.gender = $gender)
+      AND ($season IS NULL OR c.season = $season)
+      AND ($venue IS NULL OR c.venue = $venue)"""
+PHASE_ORDER = "CASE b.phase WHEN 'powerplay' THEN 1 WHEN 'middle' THEN 2 ELSE 3 END"
+
+BATTING_LEADERBOARD = f"""
+WITH batting AS (
+    SELECT b.batter, COUNT(DISTINCT b.match_id) AS matches, SUM(b.runs_off_bat) AS runs,
+           COUNT(*) FILTER (WHERE {LEGAL_BALL_FACED}) AS balls_faced,
+           COUNT(*) FILTER (WHERE b.runs_off_bat = 4) AS fours,
+           COUNT(*) FILTER (WHERE b.runs_off_bat = 6) AS sixes
+    FROM balls b JOIN matches m ON m.match_id = b.match_id
+    WHERE {BALL_FILTERS}
+    GROUP BY b.batter
+), dismissals AS (
+    SELECT b.dismissed_batter AS batter, COUNT(*) AS dismissals
+    FROM balls b JOIN matches m ON m.match_id = b.match_id
+    WHERE b.dismissed_batter IS NOT NULL AND {BALL_FILTERS}
+    GROUP BY b.dismissed_batter
+)
+SELECT batter, matches, runs, balls_faced, COALESCE(d.dismissals, 0) AS dismissals,
+       ROUND(runs / NULLIF(COALESCE(d.dismissals, 0), 0), 2) AS average,
+       ROUND(runs * 100.0 / NULLIF(balls_faced, 0), 2) AS strike_rate,
+       fours, sixes, fours + sixes AS boundaries
+FROM batting LEFT JOIN dismissals d USING (batter)
+WHERE balls_faced >= $min_balls
+ORDER BY {{order}} NULLS LAST, runs DESC
+LIMIT $limit"""
+
+BOWLING_LEADERBOARD = f"""
+SELECT b.bowler, COUNT(DISTINCT b.match_id) AS matches,
+       COUNT(*) FILTER (WHERE {LEGAL_BALL_BOWLED}) AS balls_bowled,
+       SUM({RUNS_CONCEDED}) AS runs_conceded,
+       COUNT(*) FILTER (WHERE {BOWLER_WICKET}) AS wickets,
+       ROUND(runs_conceded * 6.0 / NULLIF(balls_bowled, 0), 2) AS economy,
+       ROUND(runs_conceded / NULLIF(wickets, 0), 2) AS average,
+       ROUND(balls_bowled / NULLIF(wickets, 0), 1) AS strike_rate
+FROM balls b JOIN matches m ON m.match_id = b.match_id
+WHERE {BALL_FILTERS}
+GROUP BY b.bowler
+HAVING balls_bowled >= $min_balls
+ORDER BY {{order}} NULLS LAST, wickets DESC
+LIMIT $limit"""
+
+# The leaderboards over balls_keyed (keyed storage, scripts/build_compact_storage.py):
+# grouped by integer player keys, names joined onto the aggregated rows
+KEYED_BALL_FILTERS = MATCH_FILTERS + """
+      AND ($phase IS NULL OR b.phase = $phase)
+      AND ($batting_team IS NULL OR b.batting_team_id = (SELECT team_id FROM teams WHERE name = $batting_team))
+      AND ($bowling_team IS NULL OR b.bowling_team_id = (SELECT team_id FROM teams WHERE name = $bowling_team))"""
+
+BATTING_LEADERBOARD_KEYED = f"""
+WITH batting AS (
+    SELECT b.batter_id, COUNT(DISTINCT b.match_id) AS matches, SUM(b.runs_off_bat) AS runs,
+           COUNT(*) FILTER (WHERE {LEGAL_BALL_FACED}) AS balls_faced,
+           COUNT(*) FILTER (WHERE b.runs_off_bat = 4) AS fours,
+           COUNT(*) FILTER (WHERE b.runs_off_bat = 6) AS sixes
+    FROM balls_keyed b JOIN matches m ON m.match_id = b.match_id
+    WHERE {KEYED_BALL_FILTERS}
+    GROUP BY b.batter_id
+), dismissals AS (
+    SELECT b.dismissed_batter_id AS batter_id, COUNT(*) AS dismissals
+    FROM balls_keyed b JOIN matches m ON m.match_id = b.match_id
+    WHERE b.dismissed_batter_id IS NOT NULL AND {KEYED_BALL_FILTERS}
+    GROUP BY b.dismissed_batter_id
+)
+SELECT p.name AS batter, matches, runs, balls_faced, COALESCE(d.dismissals, 0) AS dismissals,
+       ROUND(runs / NULLIF(COALESCE(d.dismissals, 0), 0), 2) AS average,
+       ROUND(runs * 100.0 / NULLIF(balls_faced, 0), 2) AS strike_rate,
+       fours, sixes, fours + sixes AS boundaries
+FROM batting LEFT JOIN dismissals d USING (batter_id)
+LEFT JOIN players p ON p.player_id = batting.batter_id
+WHERE balls_faced >= $min_balls
+ORDER BY {{order}} NULLS LAST, runs DESC
+LIMIT $limit"""
+
+BOWLING_LEADERBOARD_KEYED = f"""
+SELECT p.name AS bowler, s.* EXCLUDE (bowler_id)
+FROM (
+    SELECT b.bowler_id, COUNT(DISTINCT b.match_id) AS matches,
+           COUNT(*) FILTER (WHERE {LEGAL_BALL_BOWLED}) AS balls_bowled,
+           SUM({RUNS_CONCEDED}) AS runs_conceded,
+           COUNT(*) FILTER (WHERE {BOWLER_WICKET}) AS wickets,
+           ROUND(runs_conceded * 6.0 / NULLIF(balls_bowled, 0), 2) AS economy,
+           ROUND(runs_conceded / NULLIF(wickets, 0), 2) AS average,
+           ROUND(balls_bowled / NULLIF(wickets, 0), 1) AS strike_rate
+    FROM balls_keyed b JOIN matches m ON m.match_id = b.match_id
+    WHERE {KEYED_BALL_FILTERS}
+    GROUP BY b.bowler_id
+    HAVING balls_bowled >= $min_balls
+) s
+LEFT JOIN players p ON p.player_id = s.bowler_id
+ORDER BY {{order}} NULLS LAST, wickets DESC
+LIMIT $limit"""
+
+# Leaderboard metric -> ORDER BY (the only part of a template not passed as a parameter)
+BATTING_ORDER = {"runs": "runs DESC", "strike_rate": "strike_rate DESC", "average": "average DESC",
+                 "sixes": "sixes DESC", "fours": "fours DESC", "boundaries": "boundaries DESC"}
+BOWLING_ORDER = {"wickets": "wickets DESC", "economy": "economy ASC", "average": "average ASC",
+                 "strike_rate": "strike_rate ASC"}
+
+INTENT_TEMPLATES = {
+    "batting_career": f"""
+SELECT m.format,
+       COUNT(DISTINCT b.match_id || '/' || b.innings) FILTER (WHERE b.batter = $player) AS innings,
+       SUM(b.runs_off_bat) FILTER (WHERE b.batter = $player) AS runs,
+       COUNT(*) FILTER (WHERE b.batter = $player AND {LEGAL_BALL_FACED}) AS balls_faced,
+       COUNT(*) FILTER (WHERE b.dismissed_batter = $player) AS dismissals,
+       ROUND(runs / NULLIF(dismissals, 0), 2) AS average,
+       ROUND(runs * 100.0 / NULLIF(balls_faced, 0), 2) AS strike_rate,
+       COUNT(*) FILTER (WHERE b.batter = $player AND b.runs_off_bat = 4) AS fours,
+       COUNT(*) FILTER (WHERE b.batter = $player AND b.runs_off_bat = 6) AS sixes
+FROM balls b JOIN matches m ON m.match_id = b.match_id
+WHERE (b.batter = $player OR b.dismissed_batter = $player)
+      AND {BALL_FILTERS}
+GROUP BY m.format
+ORDER BY runs DESC""",
+    "bowling_career": f"""
+SELECT m.format, COUNT(DISTINCT b.match_id || '/' || b.innings) AS innings,
+       COUNT(*) FILTER (WHERE {LEGAL_BALL_BOWLED}) AS balls_bowled,
+       SUM({RUNS_CONCEDED}) AS runs_conceded,
+       COUNT(*) FILTER (WHERE {BOWLER_WICKET}) AS wickets,
+       ROUND(runs_conceded * 6.0 / NULLIF(balls_bowled, 0), 2) AS economy,
+       ROUND(runs_conceded / NULLIF(wickets, 0), 2) AS average,
+       ROUND(balls_bowled / NULLIF(wickets, 0), 1) AS strike_rate,
+       COUNT(*) FILTER (WHERE b.total_runs = 0 AND {LEGAL_BALL_BOWLED}) AS dots
+FROM balls b JOIN matches m ON m.match_id = b.match_id
+WHERE b.bowler = $player AND {BALL_FILTERS}
+GROUP BY m.format
+ORDER BY wickets DESC""",
+    "batting_phases": f"""
+SELECT b.phase,
+       SUM(b.runs_off_bat) FILTER (WHERE b.batter = $player) AS runs,
+       COUNT(*) FILTER (WHERE b.batter = $player AND {LEGAL_BALL_FACED}) AS balls_faced,
+       COUNT(*) FILTER (WHERE b.dismissed_batter = $player) AS dismissals,
+       ROUND(runs * 100.0 / NULLIF(balls_faced, 0), 2) AS strike_rate,
+       ROUND(COUNT(*) FILTER (WHERE b.batter = $player AND b.runs_off_bat = 0 AND {LEGAL_BALL_FACED})
+             * 100.0 / NULLIF(balls_faced, 0), 1) AS dot_pct,
+       ROUND(COUNT(*) FILTER (WHERE b.batter = $player AND b.runs_off_bat IN (4, 6))
+             * 100.0 / NULLIF(balls_faced, 0), 1) AS boundary_pct
+FROM balls b JOIN matches m ON m.match_id = b.match_id
+WHERE (b.batter = $player OR b.dismissed_batter = $player) AND b.phase IS NOT NULL
+      AND {BALL_FILTERS}
+GROUP BY b.phase
+ORDER BY ANY_VALUE({PHASE_ORDER})""",
+    "bowling_phases": f"""
+SELECT b.phase,
+       COUNT(*) FILTER (WHERE {LEGAL_BALL_BOWLED}) AS balls_bowled,
+       SUM({RUNS_CONCEDED}) AS runs_conceded,
+       COUNT(*) FILTER (WHERE {BOWLER_WICKET}) AS wickets,
+       ROUND(runs_conceded * 6.0 / NULLIF(balls_bowled, 0), 2) AS economy,
+       ROUND(COUNT(*) FILTER (WHERE b.total_runs = 0 AND {LEGAL_BALL_BOWLED})
+             * 100.0 / NULLIF(balls_bowled, 0), 1) AS dot_pct
+FROM balls b JOIN matches m ON m.match_id = b.match_id
+WHERE b.bowler = $player AND b.phase IS NOT NULL AND {BALL_FILTERS}
+GROUP BY b.phase
+ORDER BY ANY_VALUE({PHASE_ORDER})""",
+    "batter_vs_bowler_matchups": """
+SELECT mu.format, mu.balls_faced, mu.runs, mu.dismissals, mu.dots, mu.fours, mu.sixes,
+       ROUND(mu.runs * 100.0 / NULLIF(mu.balls_faced, 0), 2) AS strike_rate
+FROM matchups mu
+WHERE mu.batter = $batter AND mu.bowler = $bowler AND ($format IS NULL OR mu.format = $format)
+ORDER BY mu.balls_faced DESC""",
+    "batter_vs_bowler": f"""
+SELECT m.format,
+       COUNT(*) FILTER (WHERE {LEGAL_BALL_FACED}) AS balls_faced,
+       SUM(b.runs_off_bat) AS runs,
+       COUNT(*) FILTER (WHERE b.dismissed_batter = b.batter AND {BOWLER_WICKET}) AS dismissals,
+       COUNT(*) FILTER (WHERE b.total_runs = 0) AS dots,
+       COUNT(*) FILTER (WHERE b.runs_off_bat = 4) AS fours,
+       COUNT(*) FILTER (WHERE b.runs_off_bat = 6) AS sixes,
+       ROUND(runs * 100.0 / NULLIF(balls_faced, 0), 2) AS strike_rate
+FROM balls b JOIN matches m ON m.match_id = b.match_id
+WHERE b.batter = $batter AND b.bowler = $bowler AND {BALL_FILTERS}
+GROUP BY m.format
+ORDER BY balls_faced DESC""",
+    "team_head_to_head": f"""
+SELECT m.format, COUNT(*) AS matches,
+       COUNT(*) FILTER (WHERE m.winner = $team_a) AS team_a_wins,
+       COUNT(*) FILTER (WHERE m.winner = $team_b) AS team_b_wins,
+       COUNT(*) FILTER (WHERE m.winner IS NULL OR m.winner NOT IN ($team_a, $team_b)) AS no_result,
+       MAX(m.date) AS last_meeting
+FROM matches m
+WHERE ((m.team1 = $team_a AND m.team2 = $team_b) OR (m.team1 = $team_b AND m.team2 = $team_a))
+      AND {MATCH_FILTERS}
+GROUP BY m.format
+ORDER BY matches DESC""",
+    "venue_toss": f"""
+SELECT m.venue, m.toss_decision, COUNT(*) AS matches,
+       COUNT(*) FILTER (WHERE m.toss_winner = m.winner) AS toss_winner_won,
+       ROUND(toss_winner_won * 100.0 / matches, 1) AS toss_winner_win_pct
+FROM matches m
+WHERE m.winner IS NOT NULL AND m.toss_decision IS NOT NULL AND {MATCH_FILTERS}
+GROUP BY m.venue, m.toss_decision
+HAVING COUNT(*) >= $min_matches
+ORDER BY matches DESC
+LIMIT $limit""",
+    "venue_toss_cube": f"""
+SELECT c.venue, c.toss_decision, c.decided AS matches, c.toss_winner_wins AS toss_winner_won,
+       ROUND(c.toss_winner_wins * 100.0 / NULLIF(c.decided, 0), 1) AS toss_winner_win_pct
+FROM match_cube c
+WHERE c.grouped_by = $grouped_by AND c.toss_decision IS NOT NULL AND c.decided >= $min_matches AND {CUBE_FILTERS}
+ORDER BY matches DESC
+LIMIT $limit""",
+    "venue_results_cube": f"""
+SELECT c.venue, c.matches, c.bat_first_wins, c.chasing_wins,
+       ROUND(c.bat_first_wins * 100.0 / NULLIF(c.bat_first_wins + c.chasing_wins, 0), 1) AS bat_first_win_pct,
+       c.avg_first_innings
+FROM match_cube c
+WHERE c.grouped_by = $grouped_by AND c.matches >= $min_matches AND {CUBE_FILTERS}
+ORDER BY matches DESC
+LIMIT $limit""",
+    "venue_results": f"""
+WITH first_innings AS (
+    SELECT b.match_id, ANY_VALUE(b.batting_team) AS batting_first, MAX(b.cumulative_runs) AS total
+    FROM balls b
+    WHERE b.innings = 1 AND b.match_id IN (SELECT m.match_id FROM matches m WHERE {MATCH_FILTERS})
+    GROUP BY b.match_id
+)
+SELECT m.venue, COUNT(*) AS matches,
+       COUNT(*) FILTER (WHERE m.winner = f.batting_first) AS bat_first_wins,
+       COUNT(*) FILTER (WHERE m.winner IS NOT NULL AND m.winner <> f.batting_first) AS chasing_wins,
+       ROUND(bat_first_wins * 100.0 / NULLIF(bat_first_wins + chasing_wins, 0), 1) AS bat_first_win_pct,
+       ROUND(AVG(f.total), 1) AS avg_first_innings
+FROM matches m JOIN first_innings f ON f.match_id = m.match_id
+GROUP BY m.venue
+HAVING COUNT(*) >= $min_matches
+ORDER BY matches DESC
+LIMIT $limit""",
+}
+
+
+def keyed_template(sql: str) -> str:
+    """
+    A player template rewritten onto balls_keyed: $player/$batter/$bowler are
+    passed as integer keys ($player_id, ...), so the filters compare integers.
+    """
+    sql = sql.replace("FROM balls b ", "FROM balls_keyed b ").replace(BALL_FILTERS, KEYED_BALL_FILTERS)
+    sql = sql.replace("b.dismissed_batter = b.batter", "b.dismissed_batter_id = b.batter_id")
+    return re.sub(r"b\.(batter|bowler|dismissed_batter) = \$(player|batter|bowler)\b", r"b.\1_id = $\2_id", sql)
+
+
+PLAYER_PARAMS = ("player", "batter", "bowler")  # passed as keys to the *_keyed templates
+for _name in ("batting_career", "bowling_career", "batting_phases", "bowling_phases", "batter_vs_bowler"):
+    INTENT_TEMPLATES[f"{_name}_keyed"] = keyed_template(INTENT_TEMPLATES[_name])
+for _metric, _order in BATTING_ORDER.items():
+    INTENT_TEMPLATES[f"batting_leaderboard_{_metric}"] = BATTING_LEADERBOARD.format(order=_order)
+    INTENT_TEMPLATES[f"batting_leaderboard_{_metric}_keyed"] = BATTING_LEADERBOARD_KEYED.format(order=_order)
+for _metric, _order in BOWLING_ORDER.items():
+    INTENT_TEMPLATES[f"bowling_leaderboard_{_metric}"] = BOWLING_LEADERBOARD.format(order=_order)
+    INTENT_TEMPLATES[f"bowling_leaderboard_{_metric}_keyed"] = BOWLING_LEADERBOARD_KEYED.format(order=_order)
+
+# Words each intent may contain besides entities and filters (anything else -> Gemini)
+FILLER_WORDS = frozenset("""
+    a about all an and any are as at best by can career cricket data did do does ever far figures find for
+    from get give has have his how i in is list me much my number numbers of on overall please profile record
+    records show so stat stats statistics summary tell the their them time total what whats where which who with
+    would you
+""".split())
+VS_WORDS = frozenset({"vs", "v", "versus", "against", "h2h"})
+BATTING_WORDS = frozenset("""
+    bat batting batter batters batsman batsmen runs run scored scoring scores average averages strike rate sr
+    fours four sixes six boundaries boundary innings dismissals dismissed out faced balls ball
+""".split())
+BOWLING_WORDS = frozenset("""
+    bowl bowling bowler bowlers wickets wicket economy conceded taken took dots dot bowled
+""".split())
+PHASE_SPLIT_WORDS = frozenset({"phase", "phases", "split", "splits", "phasewise", "by", "each", "per"})
+PHASE_WORDS = {"powerplay": "powerplay", "death": "death", "middle": "middle"}
+LEADERBOARD_WORDS = frozenset("""
+    top most highest best leading leaders leaderboard lowest fastest scorers scorer takers taker hitters hitter
+    players player rank ranking ranked ever
+""".split()) | BATTING_WORDS | BOWLING_WORDS
+# Leaderboards and careers are totals and rates: these ask for a single innings
+# ("best bowling figures", "Root highest score")
+SINGLE_INNINGS_WORDS = frozenset({"figures", "innings", "score", "scores"})
+TEAM_H2H_WORDS = frozenset({"head", "to", "wins", "won", "win", "results", "result", "matches", "games", "between"})
+TOSS_WORDS = frozenset("""
+    toss tosses winning win wins won decision decisions impact effect advantage venue venues ground grounds
+    stadium stadiums bat field bowl choosing choose chose elect elected matter matters
+""".split())
+VENUE_WORDS = frozenset("""
+    venue venues ground grounds stadium stadiums chasing chase chases defending batting bowling first second
+    bat wins win won results result scores score totals average innings par
+""".split())
+OVERS_WORDS = frozenset({"overs", "over", "power", "play"})
+GENDER_WORDS = {"women": "female", "womens": "female", "female": "female", "ladies": "female",
+                "men": "male", "mens": "male", "male": "male"}
+YEAR_PATTERN = re.compile(r"^(19|20)\d{2}$")
+RESERVED_ALIAS_WORDS = (FILLER_WORDS | VS_WORDS | BATTING_WORDS | BOWLING_WORDS | PHASE_SPLIT_WORDS
+                        | LEADERBOARD_WORDS | TEAM_H2H_WORDS | TOSS_WORDS | VENUE_WORDS | OVERS_WORDS
+                        | set(PHASE_WORDS) | set(GENDER_WORDS) | {"test", "tests", "odi", "odis", "t20", "t20s"})
+
+
+def normalize_words(text: str) -> List[str]:
+    """Lower-case words with possessives and punctuation removed."""
+    text = re.sub(r"['’]s\b", "", text.lower())
+    return re.sub(r"[^a-z0-9]+", " ", text).split()
+
+
+@lru_cache(maxsize=1)
+def intent_entities() -> Dict[str, Any]:
+    """
+    Name lookups for intent matching, built from the database (cached): alias
+    -> (kind, name) for players, teams and venues, each player's balls faced
+    and bowled, and the formats present. Players are indexed by full name and
+    surname ("V Kohli", "kohli"), teams also by initials ("csk"), venues also
+    by the name before the comma and its first word. Where aliases collide the
+    more frequent name wins, except that a short player alias (a surname)
+    shared by several players resolves to none of them: it goes to
+    "ambiguous" (alias -> names, most balls first) instead. In keyed storage
+    "player_ids" maps names to their balls_keyed keys.
+    """
+    entities = {"aliases": {}, "ambiguous": {}, "roles": {}, "formats": {}, "player_ids": {}}
+    try:
+        con = get_db_connection()
+        try:
+            players = con.execute("""
+                SELECT name, SUM(faced) AS balls_faced, SUM(bowled) AS balls_bowled FROM (
+                    SELECT batter AS name, COUNT(*) AS faced, 0 AS bowled FROM balls GROUP BY batter
+                    UNION ALL
+                    SELECT bowler, 0, COUNT(*) FROM balls GROUP BY bowler
+                ) WHERE name IS NOT NULL GROUP BY name ORDER BY balls_faced + balls_bowled DESC
+            """).fetchall()
+            teams = con.execute("""
+                SELECT team FROM (SELECT team1 AS team FROM matches UNION ALL SELECT team2 FROM matches)
+                WHERE team IS NOT NULL GROUP BY team ORDER BY COUNT(*) DESC
+            """).fetchall()
+            venues = con.execute(
+                "SELECT venue FROM matches WHERE venue IS NOT NULL GROUP BY venue ORDER BY COUNT(*) DESC"
+            ).fetchall()
+            formats = con.execute("SELECT DISTINCT format FROM matches WHERE format IS NOT NULL").fetchall()
+            if "balls_keyed" in available_tables():
+                entities["player_ids"] = dict(con.execute("SELECT name, player_id FROM players").fetchall())
+        finally:
+            con.close()
+    except Exception as e:
+        print(f"[Intent] Could not load entity lists: {e}")
+        return entities
+
+    aliases, ambiguous = entities["aliases"], entities["ambiguous"]
+    short_player_aliases = set()
+
+    def add(alias_words: List[str], kind: str, name: str, min_length: int = 3):
+        alias = " ".join(alias_words)
+        if len(alias) >= min_length and alias not in aliases and alias not in RESERVED_ALIAS_WORDS:
+            aliases[alias] = (kind, name)
+
+    def add_surname(alias_words: List[str], name: str):
+        alias = " ".join(alias_words)
+        if alias in ambiguous:
+            if name not in ambiguous[alias]:
+                ambiguous[alias].append(name)
+        elif alias in short_player_aliases and aliases[alias][1] != name:
+            ambiguous[alias] = [aliases.pop(alias)[1], name]
+        elif alias not in aliases:
+            add(alias_words, "player", name)
+            if alias in aliases:
+                short_player_aliases.add(alias)
+
+    # Full names first so a surname never shadows someone's full name
+    for (team,) in teams:
+        add(normalize_words(team), "team", team, min_length=2)
+    for (venue,) in venues:
+        add(normalize_words(venue), "venue", venue)
+    for name, faced, bowled in players:
+        add(normalize_words(name), "player", name)
+        entities["roles"][name] = (faced, bowled)
+    for (team,) in teams:
+        words = normalize_words(team)
+        if len(words) > 1:
+            add(["".join(w[0] for w in words)], "team", team, min_length=2)
+    for (venue,) in venues:
+        words = normalize_words(venue.split(",")[0])
+        if words and words[0] == "the":
+            words = words[1:]
+        add(words, "venue", venue)
+        if words:
+            add(words[:1], "venue", venue, min_length=4)
+    for name, _, _ in players:
+        parts = name.split()
+        # Cricsheet names lead with initials ("V Kohli", "AB de Villiers")
+        if len(parts) > 1 and parts[0].isupper() and len(parts[0]) <= 3:
+            add_surname(normalize_words(" ".join(parts[1:])), name)
+        if len(parts) > 1:
+            add_surname(normalize_words(parts[-1]), name)
+
+    for (fmt,) in formats:
+        entities["formats"][fmt.lower()] = fmt
+        entities["formats"][fmt.lower() + "s"] = fmt
+    return entities
+
+
+def render_sql(sql: str, params: Dict[str, Any]) -> str:
+    """Template SQL with its $parameters written out as literals (for display and logs)."""
+    def literal(match):
+        value = params.get(match.group(1))
+        if value is None:
+            return "NULL"
+        if isinstance(value, str):
+            return "'" + value.replace("'", "''") + "'"
+        return str(value)
+    return re.sub(r"\$(\w+)", literal, sql)
+
+
+def classify_intent(prompt: str) -> Optional[Dict[str, Any]]:
+    """
+    Matches a prompt to an intent template. Returns {"name", "sql", "params",
+    "entities"} with `sql` still parameterized, or None if the prompt is not
+    one of the known shapes.
+    """
+    entities = intent_entities()
+    aliases = entities["aliases"]
+    words = normalize_words(prompt)
+    if not words or not aliases:
+        return None
+
+    # Entities, longest alias first; a first name just before a surname
+    # ("virat kohli") is absorbed when its initial matches. A surname several
+    # players share only counts when that first name singles one of them out.
+    found, rest, i = [], [], 0
+    while i < len(words):
+        for n in range(min(5, len(words) - i), 0, -1):
+            alias = " ".join(words[i:i + n])
+            hit = aliases.get(alias)
+            if alias in entities["ambiguous"]:
+                initial = rest[-1][0] if rest and rest[-1] not in RESERVED_ALIAS_WORDS else None
+                candidates = [name for name in entities["ambiguous"][alias]
+                              if initial and name[0].lower() == initial and name.split()[0].isupper()]
+                if len(candidates) != 1:
+                    return None
+                hit = ("player", candidates[0])
+            if hit:
+                kind, name = hit
+                if kind == "player" and rest and rest[-1] not in RESERVED_ALIAS_WORDS \
+                        and rest[-1][0] == name[0].lower() and name.split()[0].isupper():
+                    rest.pop()
+                vs_at = len(rest) - 2 if rest[-1:] == ["the"] else len(rest) - 1
+                preceded_by_vs = vs_at >= 0 and rest[vs_at] in VS_WORDS
+                if kind == "team" and preceded_by_vs:
+                    del rest[vs_at:]  # "against the Australians" is an opponent filter
+                found.append((kind, name, preceded_by_vs))
+                i += n
+                break
+        else:
+            rest.append(words[i])
+            i += 1
+
+    # Filters: format, gender, phase, seasons and a top-N limit
+    params: Dict[str, Any] = {"format": None, "gender": None, "phase": None, "from_year": None,
+                              "to_year": None, "venue": None, "batting_team": None, "bowling_team": None}
+    limit, remaining = None, []
+    for j, word in enumerate(rest):
+        previous = rest[j - 1] if j else ""
+        if word in entities["formats"] and params["format"] is None:
+            params["format"] = entities["formats"][word]
+        elif word in GENDER_WORDS and params["gender"] is None:
+            params["gender"] = GENDER_WORDS[word]
+        elif word in PHASE_WORDS and params["phase"] is None:
+            params["phase"] = PHASE_WORDS[word]
+        elif word == "power" and rest[j + 1:j + 2] == ["play"] and params["phase"] is None:
+            params["phase"] = "powerplay"
+        elif YEAR_PATTERN.match(word):
+            year = int(word)
+            if previous in ("since", "from", "after"):
+                params["from_year"] = year + (previous == "after")
+            elif previous in ("before", "until", "till", "upto"):
+                params["to_year"] = year - (previous == "before")
+            elif previous in ("to", "and") and params["from_year"] is not None:
+                params["to_year"] = year
+            else:
+                params["from_year"] = params["to_year"] = year
+        elif word.isdigit() and previous == "top" and 0 < int(word) <= INTENT_MAX_LIMIT:
+            limit = int(word)
+        elif word in ("since", "after", "before", "until", "till", "upto", "between", "season", "seasons",
+                      "year", "years", "during"):
+            continue
+        elif word in ("to", "and") and YEAR_PATTERN.match(rest[j + 1] if j + 1 < len(rest) else ""):
+            continue
+        else:
+            remaining.append(word)
+
+    players = [name for kind, name, _ in found if kind == "player"]
+    teams = [(name, vs) for kind, name, vs in found if kind == "team"]
+    venues = [name for kind, name, _ in found if kind == "venue"]
+    if len(venues) > 1:
+        return None
+    params["venue"] = venues[0] if venues else None
+    present = set(remaining)
+
+    def only(*vocabularies) -> bool:
+        allowed = FILLER_WORDS | OVERS_WORDS | set().union(*vocabularies)
+        return present <= allowed
+
+    def team_filters(batting: bool) -> bool:
+        """Own team / opponent filters from the named teams; False if ambiguous."""
+        own = [name for name, vs in teams if not vs]
+        opponents = [name for name, vs in teams if vs]
+        if len(own) > 1 or len(opponents) > 1:
+            return False
+        own_key, opp_key = ("batting_team", "bowling_team") if batting else ("bowling_team", "batting_team")
+        params[own_key] = own[0] if own else None
+        params[opp_key] = opponents[0] if opponents else None
+        return True
+
+    name = None
+    if len(players) == 2 and not teams and only(VS_WORDS, {"head", "to"}, BATTING_WORDS, BOWLING_WORDS) \
+            and (present & VS_WORDS or "head" in present):
+        roles = entities["roles"]
+        a, b = players
+        forward = roles[a][0] + roles[b][1]
+        backward = roles[b][0] + roles[a][1]
+        params["batter"], params["bowler"] = (a, b) if forward >= backward else (b, a)
+        name = "batter_vs_bowler"
+    elif len(players) == 1 and only(BATTING_WORDS, BOWLING_WORDS, PHASE_SPLIT_WORDS) \
+            and not present & VS_WORDS:
+        if present & (SINGLE_INNINGS_WORDS | {"best", "highest"}):
+            return None
+        player = players[0]
+        faced, bowled = entities["roles"][player]
+        bowling = bool(present & BOWLING_WORDS) or (not present & BATTING_WORDS and bowled > faced)
+        if not team_filters(batting=not bowling):
+            return None
+        params["player"] = player
+        split = bool(present & (PHASE_SPLIT_WORDS - {"by", "each", "per"}))
+        name = f"{'bowling' if bowling else 'batting'}_{'phases' if split else 'career'}"
+    elif not players and len(teams) == 2 and only(VS_WORDS, TEAM_H2H_WORDS) \
+            and (present & VS_WORDS or "head" in present or teams[1][1]):
+        params["team_a"], params["team_b"] = teams[0][0], teams[1][0]
+        name = "team_head_to_head"
+    elif not players and present & (LEADERBOARD_WORDS - BATTING_WORDS - BOWLING_WORDS) \
+            and only(LEADERBOARD_WORDS):
+        bowling = bool(present & (BOWLING_WORDS | {"takers", "taker"}))
+        if not team_filters(batting=not bowling) or (bowling and "fastest" in present):
+            return None  # "fastest bowlers" is about pace, which the data does not have
+        if bowling:
+            metric = ("economy" if "economy" in present else
+                      "strike_rate" if "strike" in present or "sr" in present else
+                      "average" if "average" in present else "wickets")
+        else:
+            metric = ("strike_rate" if present & {"strike", "sr", "fastest"} else
+                      "average" if "average" in present else
+                      "sixes" if present & {"six", "sixes"} else
+                      "fours" if present & {"four", "fours"} else
+                      "boundaries" if present & {"boundary", "boundaries"} else "runs")
+        # Templates only sort the "better" way: "lowest strike rate" or
+        # "highest economy" would otherwise get the opposite ranking
+        descending = (BOWLING_ORDER if bowling else BATTING_ORDER)[metric].endswith("DESC")
+        if present & SINGLE_INNINGS_WORDS or present & ({"highest", "most"} if not descending else {"lowest"}):
+            return None
+        counting = metric in ("runs", "wickets", "sixes", "fours", "boundaries")
+        params["min_balls"] = 1 if counting else INTENT_MIN_BALLS
+        params["limit"] = limit or INTENT_DEFAULT_LIMIT
+        limit = None
+        name = f"{'bowling' if bowling else 'batting'}_leaderboard_{metric}"
+    elif not players and not teams and "toss" in present and only(TOSS_WORDS, LEADERBOARD_WORDS - BATTING_WORDS):
+        name = "venue_toss"
+        params["min_matches"] = 1 if venues else INTENT_MIN_MATCHES
+        params["limit"] = limit or INTENT_MAX_LIMIT
+        limit = None
+    elif not players and not teams and (venues or present & {"venue", "venues", "ground", "grounds"}) \
+            and present & {"chasing", "chase", "chases", "defending", "first", "results", "result", "totals",
+                           "par", "scores", "score"} \
+            and only(VENUE_WORDS, LEADERBOARD_WORDS - BATTING_WORDS):
+        name = "venue_results"
+        params["min_matches"] = 1 if venues else INTENT_MIN_MATCHES
+        params["limit"] = limit or INTENT_MAX_LIMIT
+        limit = None
+    if name is None or limit is not None:
+        return None
+    if name == "batter_vs_bowler" and "matchups" in available_tables() \
+            and all(v is None for k, v in params.items() if k not in ("format", "batter", "bowler")):
+        name = "batter_vs_bowler_matchups"  # no filters the precomputed matrix lacks
+    if f"{name}_keyed" in INTENT_TEMPLATES and "balls_keyed" in available_tables():
+        # Keyed storage: group and filter on integer player keys
+        name = f"{name}_keyed"
+        for param in PLAYER_PARAMS:
+            if param in params:
+                params[f"{param}_id"] = entities["player_ids"].get(params.pop(param))
+    if name in ("venue_toss", "venue_results") and "match_cube" in available_tables() \
+            and params["from_year"] == params["to_year"]:
+        # Point lookup in the cube: the grouping set is fixed by the filters given
+        dims = ("venue", "format" if params["format"] else None, "gender" if params["gender"] else None,
+                "season" if params["from_year"] else None, "toss_decision" if name == "venue_toss" else None)
+        params["grouped_by"] = ",".join(d for d in dims if d)
+        params["season"] = params.pop("from_year")
+        params.pop("to_year")
+        name = f"{name}_cube"
+
+    sql = INTENT_TEMPLATES[name].strip()
+    used = set(re.findall(r"\$(\w+)", sql))
+    if any(v is not None for k, v in params.items() if k not in used):
+        return None  # a filter the template cannot apply ("... in the powerplay" on a head-to-head)
+    params = {k: v for k, v in params.items() if k in used}
+    return {"name": name, "sql": sql, "params": params, "entities": [n for _, n, _ in found]}
+
+
+# --- SQL Repair ---
+# Most failures of generated SQL are trivial: a misspelled or invented column
+# ("runs" for runs_off_bat), a table alias used without its join, an
+# ambiguous join key, a non-aggregated column missing from GROUP BY. DuckDB's
+# binder/catalog error names the problem (often with candidates), so
+# execute_with_repair() fixes it against the live catalog and retries; only
+# when no local fix applies does it ask Gemini for a corrected query.
+SQL_REPAIR_ATTEMPTS = int(os.environ.get("SQL_REPAIR_ATTEMPTS", "4"))
+SQL_REPAIR_CUTOFF = 0.8  # difflib similarity needed for a fuzzy column match
+
+# Names models use for real columns; {q} is the alias prefix ("m." or "")
+COLUMN_SYNONYMS = {
+    "runs": "{q}runs_off_bat", "runs_scored": "{q}runs_off_bat", "bat_runs": "{q}runs_off_bat",
+    "batsman": "{q}batter", "batter_name": "{q}batter", "striker": "{q}batter",
+    "bowler_name": "{q}bowler",
+    "dismissal_type": "{q}wicket_type", "dismissal_kind": "{q}wicket_type", "how_out": "{q}wicket_type",
+    "player_dismissed": "{q}dismissed_batter", "dismissed_player": "{q}dismissed_batter",
+    "match_date": "{q}date", "ground": "{q}venue", "stadium": "{q}venue",
+    "match_format": "{q}format", "match_type": "{q}format",
+    "season": "YEAR({q}date)", "year": "YEAR({q}date)",
+}
+# Tables a query can be joined to when it uses their columns without joining them
+REPAIR_JOINS = {"matches": ("m", "match_id")}
+
+TABLE_REFERENCE = re.compile(
+    r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ON|USING|GROUP|ORDER|HAVING|LIMIT|WINDOW|QUALIFY"
+    r"|UNION|EXCEPT|INTERSECT|LEFT|RIGHT|INNER|FULL|CROSS|NATURAL|POSITIONAL|ASOF|ANTI|SEMI)\b)(\w+))?",
+    re.IGNORECASE
+)
+STRING_OR_QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+
+
+@lru_cache(maxsize=1)
+def catalog_columns() -> Dict[str, List[str]]:
+    """Table/view name -> column names, from the live catalog (cached)."""
+    try:
+        con = get_db_connection()
+        try:
+            rows = con.execute(
+                "SELECT table_name, column_name FROM information_schema.columns ORDER BY table_name, ordinal_position"
+            ).fetchall()
+        finally:
+            con.close()
+    except Exception as e:
+        print(f"[Repair] Could not read the catalog: {e}")
+        return {}
+    columns: Dict[str, List[str]] = {}
+    for table, column in rows:
+        columns.setdefault(table, []).append(column)
+    return columns
+
+
+def table_aliases(sql: str) -> Dict[str, str]:
+    """Alias (or bare table name) -> table for every FROM/JOIN in the query."""
+    aliases = {}
+    for table, alias in TABLE_REFERENCE.findall(sql):
+        aliases[(alias or table).lower()] = table.lower()
+    return aliases
+
+
+def replace_identifier(sql: str, old: str, new: str) -> str:
+    """
+    Replaces an identifier (optionally alias-qualified, e.g. "b.runs") outside
+    string literals and quoted names. Output aliases (AS runs) and function
+    names are left alone; if the query also names an output column `old`,
+    only function arguments (SUM(runs)) are replaced, since ORDER BY runs
+    then refers to the output column.
+    """
+    pattern = re.compile(r"(?<![\w.\"])" + re.escape(old) + r"(?![\w\"(])", re.IGNORECASE)
+    is_output_alias = re.search(r"\bAS\s+" + re.escape(old) + r"\b", sql, re.IGNORECASE) is not None
+
+    def substitute(m):
+        before = m.string[:m.start()]
+        if re.search(r"\bAS\s+$", before, re.IGNORECASE):
+            return m.group(0)
+        if is_output_alias and not re.search(r"\(\s*(?:DISTINCT\s+)?$", before, re.IGNORECASE):
+            return m.group(0)
+        return new
+
+    parts, last = [], 0
+    for quoted in STRING_OR_QUOTED.finditer(sql):
+        parts.append((sql[last:quoted.start()], True))
+        parts.append((quoted.group(0), False))
+        last = quoted.end()
+    parts.append((sql[last:], True))
+
+    out = []
+    for text, code in parts:
+        if code:
+            text = pattern.sub(substitute, text)
+        out.append(text)
+    return "".join(out)
+
+
+def column_replacement(name: str, columns: List[str], prefix: str) -> Optional[str]:
+    """A real column (or expression) for a missing column name, or None."""
+    synonym = COLUMN_SYNONYMS.get(name.lower())
+    if synonym:
+        target = re.search(r"\{q\}(\w+)", synonym).group(1)
+        if target in columns:
+            return synonym.format(q=prefix)
+    match = difflib.get_close_matches(name.lower(), columns, n=1, cutoff=SQL_REPAIR_CUTOFF)
+    return prefix + match[0] if match else None
+
+
+def add_join(sql: str, table: str) -> Optional[Tuple[str, str]]:
+    """
+    Joins REPAIR_JOINS[table] onto the query's first table on the shared key.
+    Returns (sql, alias) or None if that is not possible.
+    """
+    alias, key = REPAIR_JOINS[table]
+    catalog = catalog_columns()
+    first = TABLE_REFERENCE.search(sql)
+    if not first or alias in table_aliases(sql):
+        return None
+    base_table, base_alias = first.group(1).lower(), first.group(2) or first.group(1)
+    if key not in catalog.get(base_table, []):
+        return None
+    join = f" JOIN {table} {alias} ON {alias}.{key} = {base_alias}.{key}"
+    return sql[:first.end()] + join + sql[first.end():], alias
+
+
+def repair_sql_locally(sql: str, error: str) -> Optional[Tuple[str, str]]:
+    """
+    One local fix for a failed query, from DuckDB's error message.
+    Returns (fixed sql, description of the fix), or None if nothing applies.
+    """
+    catalog = catalog_columns()
+    aliases = table_aliases(sql)
+
+    # Catalog Error: Table with name ball does not exist! Did you mean "balls"?
+    m = re.search(r'Table with name (\w+) does not exist!.*?Did you mean "(\w+)"', error, re.DOTALL)
+    if m:
+        fixed = re.sub(r"(\b(?:FROM|JOIN)\s+)" + re.escape(m.group(1)) + r"\b", r"\g<1>" + m.group(2),
+                       sql, flags=re.IGNORECASE)
+        return fixed, f"table {m.group(1)} -> {m.group(2)}"
+
+    # Binder Error: Ambiguous reference to column name "match_id" (use: "m.match_id" or "b.match_id")
+    m = re.search(r'Ambiguous reference to column name "(\w+)" \(use: "(\w+)\.\w+"', error)
+    if m:
+        fixed = replace_identifier(sql, m.group(1), f"{m.group(2)}.{m.group(1)}")
+        return fixed, f"{m.group(1)} -> {m.group(2)}.{m.group(1)}"
+
+    # Binder Error: Referenced table "m" not found! -> join the table its columns come from
+    m = re.search(r'Referenced table "(\w+)" not found', error)
+    if m:
+        used = set(re.findall(r"\b" + re.escape(m.group(1)) + r"\.(\w+)", sql))
+        for table, (alias, _) in REPAIR_JOINS.items():
+            if alias == m.group(1).lower() and used <= set(catalog.get(table, [])):
+                joined = add_join(sql, table)
+                if joined:
+                    return joined[0], f"joined {table} {alias}"
+        return None
+
+    # Binder Error: Table "b" does not have a column named "runs"
+    m = re.search(r'Table "(\w+)" does not have a column named "(\w+)"', error)
+    qualified = bool(m)
+    if not m:
+        # Binder Error: Referenced column "runs" not found in FROM clause!
+        m = re.search(r'Referenced column "(\w+)" not found', error)
+    if m:
+        if qualified:
+            alias, name = m.group(1), m.group(2)
+            table = aliases.get(alias.lower())
+            replacement = column_replacement(name, catalog.get(table, []), f"{alias}.")
+            old = f"{alias}.{name}"
+        else:
+            alias, name = None, m.group(1)
+            columns = [c for t in set(aliases.values()) for c in catalog.get(t, [])]
+            replacement = column_replacement(name, columns, "")
+            old = name
+        if replacement:
+            return replace_identifier(sql, old, replacement), f"{old} -> {replacement}"
+        # The column lives in a table the query forgot to join
+        for table in REPAIR_JOINS:
+            if table in aliases.values():
+                continue
+            target = column_replacement(name, catalog.get(table, []), "") or \
+                (name if name in catalog.get(table, []) else None)
+            if target:
+                joined = add_join(sql, table)
+                if joined:
+                    fixed, join_alias = joined
+                    expression = column_replacement(name, catalog.get(table, []), f"{join_alias}.") \
+                        or f"{join_alias}.{name}"
+                    return replace_identifier(fixed, old, expression), f"joined {table} for {old} -> {expression}"
+        return None
+
+    # Binder Error: column "bowler" must appear in the GROUP BY clause ...
+    if "must appear in the GROUP BY clause" in error and len(re.findall(r"\bGROUP\s+BY\b", sql, re.I)) == 1:
+        fixed = re.sub(
+            r"\bGROUP\s+BY\s+(?!ALL\b).+?(?=\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|\bQUALIFY\b|\bWINDOW\b|\)|;|$)",
+            "GROUP BY ALL ", sql, count=1, flags=re.IGNORECASE | re.DOTALL
+        )
+        if fixed != sql:
+            return fixed, "GROUP BY ALL"
+        return None
+
+    # Parser Error: syntax error at or near "order" -> quote a keyword used as a name
+    m = re.search(r'syntax error at or near "(\w+)"', error)
+    if m:
+        word = m.group(1)
+        fixed = re.sub(r"(\.|\bAS\s+)" + re.escape(word) + r"\b", lambda x: f'{x.group(1)}"{word}"',
+                       sql, flags=re.IGNORECASE)
+        if fixed != sql:
+            return fixed, f'quoted "{word}"'
+    return None
+
+
+def repair_sql_with_llm(sql: str, error: str) -> str:
+    """Asks Gemini for a corrected query (after local repair gave up)."""
+    repair_prompt = f"""
+    You are an expert Cricket Analyst fixing a DuckDB SQL query.
+
+    {get_database_schema()}
+
+    This query failed:
+    {sql}
+
+    DuckDB error:
+    {error}
+
+    Return ONLY the corrected SQL. No markdown formatting.
+    """
+    response_text = call_gemini(repair_prompt, stage="repair_sql")
+    return response_text.replace('```sql', '').replace('```', '').strip()
+
+
+def execute_with_repair(con, sql: str, stage: str = "query", allow_llm: bool = True,
+                        max_rows: Optional[int] = None) -> Tuple[pd.DataFrame, str, List[str]]:
+    """
+    execute_query() that repairs failing SQL: up to SQL_REPAIR_ATTEMPTS local
+    fixes, then (if allow_llm) one Gemini rewrite. Returns the result, the SQL
+    that produced it and the list of repairs applied; re-raises the last error
+    if the query could not be repaired.
+    """
+    repairs: List[str] = []
+    endpoint = current_endpoint.get()
+    used_llm = False
+    while True:
+        try:
+            df = execute_query(con, sql, stage=stage, max_rows=max_rows)
+            if repairs:
+                SQL_REPAIRS.inc(endpoint=endpoint, stage=stage, outcome="repaired", method="llm" if used_llm else "local")
+            return df, sql, repairs
+        except (duckdb.BinderException, duckdb.CatalogException, duckdb.ParserException) as e:
+            error = str(e)
+            fix = repair_sql_locally(sql, error) if len(repairs) < SQL_REPAIR_ATTEMPTS else None
+            if fix and fix[0] != sql:
+                sql = fix[0]
+                repairs.append(fix[1])
+                continue
+            if allow_llm and not used_llm:
+                used_llm = True
+                sql = repair_sql_with_llm(sql, error)
+                repairs.append("rewritten by LLM")
+                continue
+            SQL_REPAIRS.inc(endpoint=endpoint, stage=stage, outcome="failed", method="llm" if used_llm else "local")
+            raise
+
+
+# --- Approximate Answers ---
+# With `approximate: true`, /analyze answers aggregate queries over balls from
+# balls_sample (scripts/build_derived_tables.py), which keeps the same share of
+# every (format, season) stratum. Counts and sums are scaled up to the full
+# table; averages and ratios are used as they are. Confidence intervals use
+# the random-groups method: the query is re-run on each of the sample's
+# replicate groups and the spread of those estimates gives the standard error.
+# With `refine: true` the exact query also runs in the background, and its
+# result is kept for GET /analyze/refinements/{refine_id}.
+APPROX_CONFIDENCE = 0.95
+# Two-sided 95% Student t quantiles by degrees of freedom (1.96 beyond 30)
+T_QUANTILES_975 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365,
+                   8: 2.306, 9: 2.262, 10: 2.228, 15: 2.131, 20: 2.086, 30: 2.042}
+REFINEMENT_CACHE_SIZE = int(os.environ.get("REFINEMENT_CACHE_SIZE", "100"))
+
+AGGREGATE_PATTERN = re.compile(r"\b(?:COUNT|SUM|AVG|MEDIAN)\s*\(|\bGROUP\s+BY\b", re.IGNORECASE)
+UNSCALABLE_PATTERN = re.compile(r"\b(?:MIN|MAX|ARG_?MIN|ARG_?MAX)\s*\(|\bCOUNT\s*\(\s*DISTINCT\b", re.IGNORECASE)
+WINDOW_PATTERN = re.compile(r"\bOVER\s*\(", re.IGNORECASE)
+HAVING_PATTERN = re.compile(r"\bHAVING\b", re.IGNORECASE)
+LIMIT_PATTERN = re.compile(r"\bLIMIT\s+\d+", re.IGNORECASE)
+# FROM/JOIN balls with its optional alias (a following keyword is not an alias)
+BALLS_REFERENCE = re.compile(
+    r"\b(FROM|JOIN)\s+balls\b(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ON|USING|GROUP|ORDER|HAVING|LIMIT|WINDOW|QUALIFY"
+    r"|UNION|EXCEPT|INTERSECT|LEFT|RIGHT|INNER|FULL|CROSS|NATURAL|POSITIONAL|ASOF|ANTI|SEMI)\b)([A-Za-z_]\w*))?",
+    re.IGNORECASE
+)
+
+_refinements: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_refinements_lock = threading.Lock()
+_exact_refiner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="approx-refiner")
+
+
+@lru_cache(maxsize=1)
+def sample_info() -> Optional[Dict[str, Any]]:
+    """Rate and sizes of balls_sample (cached), or None if it has not been built."""
+    if "balls_sample_info" not in available_tables():
+        return None
+    con = get_db_connection()
+    try:
+        row = con.execute(
+            "SELECT sample_rate, replicates, sample_rows, population_rows FROM balls_sample_info"
+        ).fetchone()
+    finally:
+        con.close()
+    if not row or not row[2]:
+        return None
+    return {"sample_rate": row[0], "replicates": row[1], "sample_rows": row[2], "population_rows": row[3]}
+
+
+def approximation_blocker(sql: str) -> Optional[str]:
+    """Why a query cannot be estimated from balls_sample, or None if it can."""
+    if sample_info() is None:
+        return "balls_sample has not been built (scripts/build_derived_tables.py --tables balls_sample)"
+    if not BALLS_REFERENCE.search(sql):
+        return "the query does not read the balls table"
+    if UNSCALABLE_PATTERN.search(sql):
+        return "MIN, MAX and COUNT(DISTINCT) cannot be estimated from a sample"
+    if WINDOW_PATTERN.search(sql):
+        return "window functions need complete innings"
+    if not AGGREGATE_PATTERN.search(sql):
+        return "only aggregate queries can be estimated from a sample"
+    return None
+
+
+def rewrite_balls_source(sql: str, source: str) -> str:
+    """Points every FROM/JOIN balls at `source`, keeping the alias the query uses."""
+    return BALLS_REFERENCE.sub(lambda m: f"{m.group(1)} {source} AS {m.group(2) or 'balls'}", sql)
+
+
+def split_estimate_columns(df: pd.DataFrame) -> Tuple[List[str], List[str]]:
+    """
+    Group-key columns (text, years, ids, innings/over/ball) and metric columns
+    (every other number) of an aggregate result.
+    """
+    keys, metrics = [], []
+    for col in df.columns:
+        name, series = str(col).lower(), df[col]
+        if pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series) \
+                or is_year_column(name, series) or name.endswith("_id") or name in NON_METRIC_COLUMNS:
+            keys.append(col)
+        else:
+            metrics.append(col)
+    return keys, metrics
+
+
+def t_quantile(degrees: int) -> float:
+    """Two-sided 95% t quantile, using the nearest tabulated lower df."""
+    if degrees > max(T_QUANTILES_975):
+        return 1.96
+    return T_QUANTILES_975[max(d for d in T_QUANTILES_975 if d <= degrees)]
 
-    response_text = call_gemini(chart_prompt)
-    response_text = clean_json_response(response_text)
 
-    try:
-        recommendations = json.loads(response_text)
-        return [ChartRecommendation(**rec) for rec in recommendations]
-    except (json.JSONDecodeError, TypeError):
-        return []
+def interval_bound(value: float) -> Optional[float]:
+    """Rounded confidence bound (None when undefined)."""
+    return round(float(value), 4) if np.isfinite(value) else None
 
 
-def generate_sql_from_prompt(prompt: str) -> str:
+def estimate_from_sample(con, sql: str) -> Tuple[pd.DataFrame, Dict[str, Any]]:
     """
-    Uses Gemini to convert natural language to DuckDB SQL.
+    Runs `sql` over balls_sample and each of its replicate groups. Returns the
+    estimated result (additive columns scaled to the full table) and the
+    approximation details, including per-row confidence intervals.
     """
-    schema = get_database_schema()
-
-    full_prompt = f"""
-    You are an expert Cricket Analyst.
+    sql = sql.strip().rstrip(";")  # it is wrapped in a subquery per replicate
+    info = sample_info()
+    replicates = info["replicates"]
+    estimate = execute_query(con, rewrite_balls_source(sql, "balls_sample"), stage="approx_sample")
+    keys, metrics = split_estimate_columns(estimate)
+
+    # (rows x replicates) matrix of each metric, aligned to the estimate's rows
+    values = {col: np.full((len(estimate), replicates), np.nan) for col in metrics}
+    # All replicate runs go to DuckDB as one UNION ALL statement
+    replicate_sql = "\nUNION ALL\n".join(
+        f"SELECT {group} AS approx_group, * FROM ("
+        f"{rewrite_balls_source(sql, f'(SELECT * FROM balls_sample WHERE sample_replicate = {group})')})"
+        for group in range(replicates)
+    )
+    by_group = dict(tuple(execute_query(con, replicate_sql, stage="approx_replicate").groupby("approx_group")))
+    for group in range(replicates):
+        rep = by_group.get(group, estimate.iloc[:0]).reset_index(drop=True)
+        if keys:
+            rep = estimate[keys].merge(rep.drop_duplicates(keys), on=keys, how="left")
+        else:
+            rep = rep.reindex(range(len(estimate)))
+        for col in metrics:
+            if col in rep:
+                values[col][:, group] = pd.to_numeric(rep[col], errors="coerce").to_numpy(dtype=float)
+
+    truncated = bool(LIMIT_PATTERN.search(sql) or HAVING_PATTERN.search(sql))
+    scale = info["population_rows"] / info["sample_rows"]
+    scaled, intervals = [], {}
+    for col in metrics:
+        point = pd.to_numeric(estimate[col], errors="coerce").to_numpy(dtype=float)
+        reps = values[col]
+        # A replicate holds 1/replicates of the sample: counts and sums shrink
+        # with it, averages and ratios do not
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = np.nanmean(reps, axis=1) / point
+        ratios = ratios[np.isfinite(ratios)]
+        if ratios.size and np.median(ratios) < 1 / np.sqrt(replicates):
+            scaled.append(col)
+            if not truncated:
+                reps = np.nan_to_num(reps)  # a group missing from a replicate counted zero there
+            point = point * scale
+            reps = reps * scale * replicates
+            if pd.api.types.is_integer_dtype(estimate[col]):
+                estimate[col] = np.rint(point).astype(np.int64)
+            else:
+                estimate[col] = np.round(point, 2)
+
+        counts = np.sum(np.isfinite(reps), axis=1)
+        with np.errstate(invalid="ignore"):
+            spread = np.nanstd(reps, axis=1, ddof=1) if replicates > 1 else np.full(len(point), np.nan)
+        bounds = []
+        for value, sd, n in zip(point, spread, counts):
+            if n < 2 or not np.isfinite(sd):
+                bounds.append([None, None])
+                continue
+            margin = t_quantile(int(n) - 1) * sd / np.sqrt(n)
+            bounds.append([interval_bound(value - margin), interval_bound(value + margin)])
+        intervals[str(col)] = bounds
+
+    warnings = []
+    if HAVING_PATTERN.search(sql):
+        warnings.append(f"HAVING thresholds were applied to sample-sized groups (about {info['sample_rate']:.0%} "
+                        "of the full counts), so small groups may be missing.")
+    if LIMIT_PATTERN.search(sql):
+        warnings.append("Rows are ranked on estimates; entries near the LIMIT cut-off may differ from the exact answer.")
+    if not metrics:
+        warnings.append("No metric columns were recognised, so no values were scaled.")
+
+    return estimate, {
+        "eligible": True,
+        "method": "stratified sample (format, season), random-groups confidence intervals",
+        "sample_rate": info["sample_rate"],
+        "sample_rows": info["sample_rows"],
+        "population_rows": info["population_rows"],
+        "replicates": replicates,
+        "confidence": APPROX_CONFIDENCE,
+        "scaled_columns": [str(c) for c in scaled],
+        "intervals": intervals,
+        "warnings": warnings,
+    }
 
-    {schema}
 
-    Convert the following user question into a valid DuckDB SQL query.
-    Return ONLY the SQL. No markdown formatting.
+def approximate_answer(con, sql: str) -> Tuple[Optional[pd.DataFrame], Dict[str, Any]]:
+    """Estimated result and its details, or (None, reason) if the exact query must run."""
+    reason = approximation_blocker(sql)
+    if reason is None:
+        try:
+            return estimate_from_sample(con, sql)
+        except Exception as e:
+            reason = f"the query could not run on the sample: {e}"
+    return None, {"eligible": False, "reason": reason}
+
+
+def start_refinement(sql: str, result_format: str, max_rows: int) -> str:
+    """Queues the exact query in the background. Returns its refine_id."""
+    refine_id = os.urandom(8).hex()
+    with _refinements_lock:
+        _refinements[refine_id] = {
+            "refine_id": refine_id,
+            "status": "pending",
+            "approximate": False,
+            "sql_used": sql,
+            "submitted_at": datetime.now().isoformat()
+        }
+        while len(_refinements) > REFINEMENT_CACHE_SIZE:
+            _refinements.popitem(last=False)
+    # Keep the request's endpoint/prompt labels for metrics and the slow-query log
+    _exact_refiner.submit(contextvars.copy_context().run, run_refinement, refine_id, sql, result_format, max_rows)
+    return refine_id
 
-    User Question: {prompt}
-    """
 
-    response_text = call_gemini(full_prompt)
-    sql = response_text.replace('```sql', '').replace('```', '').strip()
-    return sql
+def run_refinement(refine_id: str, sql: str, result_format: str, max_rows: int):
+    """Runs the exact query for a refinement and stores its result."""
+    start = time.perf_counter()
+    try:
+        con = get_db_connection()
+        try:
+            df = execute_query(con, sql, stage="approx_refine", max_rows=max_rows)
+        finally:
+            con.close()
+        update = {"status": "done", "rows": len(df), "data": dataframe_to_payload(df, result_format),
+                  "truncation": df.attrs.get("truncated")}
+    except Exception as e:
+        update = {"status": "error", "error": str(e)}
+    update["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    with _refinements_lock:
+        if refine_id in _refinements:
+            _refinements[refine_id].update(update)
 
 # --- API Endpoints ---
 
@@ -620,38 +3157,285 @@ def generate_sql_from_prompt(prompt: str) -> str:
 def health_check():
     return {"status": "online", "database": "connected"}
 
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition of request, LLM, SQL and encoding metrics."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+def require_debug_endpoints():
+    """404 for operational endpoints unless DEBUG_ENDPOINTS is on."""
+    if not DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.get("/debug/slow-queries")
+def list_slow_queries(limit: int = 50, fingerprint: Optional[str] = None):
+    """Newest slow queries from the on-disk ring buffer (summaries; fetch one by id for the plan)."""
+    require_debug_endpoints()
+    entries = read_slow_queries()
+    if fingerprint:
+        entries = [e for e in entries if e.get("fingerprint") == fingerprint]
+    summaries = []
+    for e in entries[:limit]:
+        operators = e.get("operators") or []
+        slowest = max(operators, key=lambda op: op["timing_ms"]) if operators else None
+        summaries.append({
+            "id": e["id"],
+            "recorded_at": e["recorded_at"],
+            "endpoint": e["endpoint"],
+            "stage": e["stage"],
+            "duration_ms": e["duration_ms"],
+            "profiled_ms": e.get("profiled_ms"),
+            "rows": e["rows"],
+            "fingerprint": e["fingerprint"],
+            "normalized_sql": e["normalized_sql"][:300],
+            "prompt": e["prompt"][:200],
+            "slowest_operator": slowest and {k: slowest[k] for k in ("operator", "timing_ms", "rows")}
+        })
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "capacity": SLOW_QUERY_LOG_SIZE,
+        "stored": len(entries),
+        "queries": summaries
+    }
+
+
+@app.get("/debug/slow-queries/{entry_id}")
+def get_slow_query(entry_id: int):
+    """Full slow-query entry including the DuckDB profile and per-operator timings."""
+    require_debug_endpoints()
+    for entry in read_slow_queries():
+        if entry["id"] == entry_id:
+            return entry
+    raise HTTPException(status_code=404, detail=f"Slow query {entry_id} not in the log (it may have been overwritten).")
+
+
+@app.get("/debug/runtime")
+async def runtime_status():
+    """
+    Worker runtime snapshot for load tests: how many of the threadpool slots
+    that run the sync endpoints are busy. Async so it answers even when the
+    pool is saturated.
+    """
+    require_debug_endpoints()
+    import anyio.to_thread
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return {
+        "pid": os.getpid(),
+        "llm_backend": LLM_BACKEND,
+        "threadpool": {
+            "busy": limiter.borrowed_tokens,
+            "size": limiter.total_tokens,
+            "waiting": limiter.statistics().tasks_waiting
+        },
+        "queries": {
+            "running": _queries_running,
+            "limit": 1 if under_memory_pressure() else MAX_CONCURRENT_QUERIES,
+            "rss_mb": round(process_rss_bytes() / 1024 / 1024, 1),
+            "memory_budget_mb": MEMORY_BUDGET_MB or None
+        }
+    }
+
 @app.post("/analyze", response_model=AnalysisResponse)
 def analyze(request: QueryRequest):
     """
     The Core "Analyst" Endpoint.
-    1. Translates Prompt -> SQL (via Gemini)
+    1. Translates Prompt -> SQL (a local intent template, else Gemini)
     2. Runs SQL on DuckDB
     3. Returns Data + Summary
     """
+    result_format = check_result_format(request.format)
+    current_prompt.set(request.prompt)
+    max_rows = result_row_limit(request.max_rows)
+
     try:
-        # Step 1: Generate SQL
-        sql_query = generate_sql_from_prompt(request.prompt)
+        # Step 1: Generate SQL (common question shapes need no LLM call)
+        intent = classify_intent(request.prompt) if INTENT_TEMPLATES_ENABLED else None
+        INTENT_MATCHES.inc(intent=intent["name"] if intent else "none")
+        note_prompt(request.prompt)
+        sql_cached = False
+        if intent:
+            sql_query = render_sql(intent["sql"], intent["params"])
+        else:
+            sql_query, sql_cached = sql_for_prompt(request.prompt)
         
-        # Step 2: Execute SQL
+        # Step 2: Execute SQL (estimated from balls_sample when asked and possible)
         con = get_db_connection()
-        df = con.execute(sql_query).fetchdf()
-        data_json = df.to_dict(orient='records')
+        df, approximation = None, None
+        if intent:
+            df, _, _, _ = execute_cached(con, intent["sql"], "intent", params=intent["params"], max_rows=max_rows)
+            if request.approximate:
+                approximation = {"eligible": False, "reason": "answered exactly by a query template"}
+        elif request.approximate:
+            df, approximation = approximate_answer(con, sql_query)
+            if df is not None:
+                df = enforce_result_budget(df, max_rows)
+                approximation["intervals"] = {col: bounds[:len(df)]
+                                              for col, bounds in approximation["intervals"].items()}
+        is_approximate = df is not None and not intent
+        repairs = []
+        if df is None:
+            try:
+                df, sql_query, repairs, _ = execute_cached(con, sql_query, "analyze", max_rows=max_rows)
+            except Exception:
+                if sql_cached:
+                    forget_sql(request.prompt)  # stale (e.g. the schema changed): regenerate next time
+                raise
+        if not intent and (repairs or not sql_cached):
+            remember_sql(request.prompt, sql_query)  # the SQL that ran, after any repairs
+        truncation = df.attrs.get("truncated")
+        data_json = dataframe_to_payload(df, result_format)
         con.close()
         
         # Step 3: Generate Insights (Optional: Ask Gemini to summarize the data)
         # For now, we return the raw data and SQL.
-        summary_md = f"### Analysis Results\nFound {len(data_json)} records based on your query."
-
-        return AnalysisResponse(
+        if is_approximate:
+            summary_md = (
+                f"### Approximate Results\n**Approximate:** estimated from a {approximation['sample_rate']:.0%} "
+                f"stratified sample of deliveries ({approximation['sample_rows']:,} of "
+                f"{approximation['population_rows']:,}); {approximation['confidence']:.0%} confidence intervals "
+                f"are in `approximation.intervals`. Found {len(df)} records based on your query."
+            )
+            for warning in approximation["warnings"]:
+                summary_md += f"\n\n_Note: {warning}_"
+            if request.refine:
+                approximation["refine_id"] = start_refinement(sql_query, result_format, max_rows)
+                summary_md += (f"\n\nThe exact answer is being computed: "
+                               f"GET /analyze/refinements/{approximation['refine_id']}")
+        else:
+            summary_md = f"### Analysis Results\nFound {len(df)} records based on your query."
+            if intent:
+                summary_md += f"\n\nAnswered locally by the `{intent['name']}` query template (no LLM call)."
+            if repairs:
+                summary_md += f"\n\nThe generated SQL was repaired before running ({'; '.join(repairs)})."
+            if approximation:
+                summary_md += f"\n\nThis is the exact answer; approximate mode did not apply ({approximation['reason']})."
+        if truncation:
+            summary_md += (f"\n\n_Note: the result was truncated to the first {truncation['rows_returned']:,} rows "
+                           f"({truncation['reason']} limit); add filters or aggregation to see everything._")
+
+        # Rows come straight from DuckDB: skip re-validation
+        return FastJSONResponse(AnalysisResponse.model_construct(
             markdown=summary_md,
             sql_used=sql_query,
-            data=data_json
-        )
+            data=data_json,
+            approximate=is_approximate,
+            approximation=approximation,
+            intent=intent and {"name": intent["name"], "params": intent["params"]},
+            truncated=truncation is not None,
+            truncation=truncation
+        ))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.post("/analyze-batch", response_model=BatchAnalysisResponse)
+def analyze_batch(request: BatchQueryRequest):
+    """
+    Batch "Analyst" Endpoint: many /analyze prompts for the price of one.
+    1. Prompts matching an intent template get their SQL locally; all the
+       others share a single Gemini call (generate_sql_batch)
+    2. The queries run concurrently, each on its own connection
+    3. Returns one result per prompt, in order; a failed query is reported
+       in that prompt's `error` instead of failing the batch
+    """
+    result_format = check_result_format(request.format)
+    if not request.prompts:
+        raise HTTPException(status_code=400, detail="prompts must contain at least one prompt.")
+    if len(request.prompts) > MAX_BATCH_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_PROMPTS} prompts per batch.")
+    max_rows = result_row_limit(request.max_rows)
+
+    try:
+        # Step 1: Generate SQL (templates first, then one LLM call for the rest)
+        intents = [classify_intent(prompt) if INTENT_TEMPLATES_ENABLED else None for prompt in request.prompts]
+        for intent in intents:
+            INTENT_MATCHES.inc(intent=intent["name"] if intent else "none")
+        pending = list(dict.fromkeys(p for p, intent in zip(request.prompts, intents) if intent is None))
+        generated = dict(zip(pending, generate_sql_batch(pending))) if pending else {}
+
+        # Step 2: Execute SQL concurrently
+        def run(prompt: str, intent: Optional[Dict[str, Any]]) -> BatchItemResult:
+            current_prompt.set(prompt)
+            if intent:
+                sql, params, stage = intent["sql"], intent["params"], "intent"
+                sql_used = render_sql(sql, params)
+                intent = {"name": intent["name"], "params": params}
+            else:
+                sql, params, stage = generated.get(prompt), None, "analyze_batch"
+                sql_used = sql
+            if not sql:
+                return BatchItemResult.model_construct(
+                    prompt=prompt, markdown="### No Results\nNo SQL was generated for this prompt.",
+                    error="No SQL was generated for this prompt."
+                )
+            try:
+                con = get_db_connection()
+                try:
+                    if intent:
+                        df = execute_query(con, sql, stage=stage, params=params, max_rows=max_rows)
+                    else:
+                        # Local fixes only: an LLM repair per prompt would defeat the batch
+                        df, sql_used, _ = execute_with_repair(con, sql, stage=stage, allow_llm=False,
+                                                              max_rows=max_rows)
+                finally:
+                    con.close()
+            except Exception as e:
+                return BatchItemResult.model_construct(
+                    prompt=prompt, markdown="### Query Failed", sql_used=sql_used, intent=intent, error=str(e)
+                )
+            summary_md = f"### Analysis Results\nFound {len(df)} records based on your query."
+            if intent:
+                summary_md += f"\n\nAnswered locally by the `{intent['name']}` query template (no LLM call)."
+            truncation = df.attrs.get("truncated")
+            if truncation:
+                summary_md += f"\n\n_Note: truncated to the first {truncation['rows_returned']:,} rows._"
+            return BatchItemResult.model_construct(
+                prompt=prompt, markdown=summary_md, sql_used=sql_used,
+                data=dataframe_to_payload(df, result_format), intent=intent,
+                truncated=truncation is not None, truncation=truncation
+            )
+
+        workers = min(BATCH_QUERY_WORKERS, len(request.prompts))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analyze-batch") as pool:
+            # One context copy per task: keeps the endpoint label for metrics
+            futures = [pool.submit(contextvars.copy_context().run, run, prompt, intent)
+                       for prompt, intent in zip(request.prompts, intents)]
+            results = [future.result() for future in futures]
+
+        # Rows come straight from DuckDB: skip re-validation
+        return FastJSONResponse(BatchAnalysisResponse.model_construct(
+            results=results,
+            llm_calls=1 if pending else 0,
+            total_records=sum(len(r.data) if isinstance(r.data, list) else len((r.data or {}).get("rows", []))
+                              for r in results)
+        ))
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/analyze/refinements/{refine_id}")
+def get_refinement(refine_id: str):
+    """Exact answer behind an approximate /analyze call made with refine=true."""
+    with _refinements_lock:
+        entry = _refinements.get(refine_id)
+        entry = dict(entry) if entry else None
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Unknown refinement {refine_id} (it may have expired).")
+    return FastJSONResponse(entry)
+
+
 @app.post("/analyze-deep", response_model=DeepAnalysisResponse)
 def analyze_deep(request: DeepAnalysisRequest):
     """
@@ -669,6 +3453,10 @@ def analyze_deep(request: DeepAnalysisRequest):
     best converters vs worst? How does this correlate with team wins?
     Has this evolved over decades?"
     """
+    result_format = check_result_format(request.format)
+    current_prompt.set(request.prompt)
+    max_rows = result_row_limit(request.max_rows)
+
     try:
         schema = get_database_schema()
 
@@ -694,7 +3482,9 @@ def analyze_deep(request: DeepAnalysisRequest):
                 step.sql_query = sql_query
                 try:
                     con = get_db_connection()
-                    df = con.execute(sql_query).fetchdf()
+                    df, sql_query, _ = execute_with_repair(con, sql_query, stage="deep_step", max_rows=max_rows)
+                    step.sql_query = sql_query
+                    step.truncation = df.attrs.get("truncated")
                     results = df.to_dict(orient='records')
                     con.close()
 
@@ -724,8 +3514,18 @@ def analyze_deep(request: DeepAnalysisRequest):
 
         # Step 4: Generate chart recommendations
         charts = generate_chart_recommendations(analytical_steps)
-
-        return DeepAnalysisResponse(
+        attach_chart_series(charts, {
+            f"step_{step.step_number}": step.results
+            for step in analytical_steps if step.results
+        })
+
+        if result_format == "columns":
+            for step in analytical_steps:
+                if step.results is not None:
+                    step.results = records_to_columnar(step.results)
+
+        # Rows come straight from DuckDB: skip re-validation
+        return FastJSONResponse(DeepAnalysisResponse.model_construct(
             title=synthesis.get("title", "Cricket Analysis"),
             executive_summary=synthesis.get("executive_summary", ""),
             steps=analytical_steps,
@@ -735,8 +3535,10 @@ def analyze_deep(request: DeepAnalysisRequest):
             methodology=synthesis.get("methodology", ""),
             limitations=synthesis.get("limitations", ""),
             total_records_analyzed=total_records
-        )
+        ))
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -746,12 +3548,698 @@ def analyze_deep_status():
     """Check if the deep analysis endpoint is ready"""
     return {
         "status": "ready",
-        "gemini_configured": GEMINI_API_KEY is not None,
+        "gemini_configured": genai_client is not None,
         "max_steps": 6,
         "description": "Agentic multi-step analysis endpoint"
     }
 
 
+# --- Commentary Search ---
+# Full-text search over commentary.text through the inverted index built by
+# scripts/build_derived_tables.py (commentary_docs / commentary_terms /
+# commentary_postings and the commentary_search / commentary_phrase macros).
+MAX_SEARCH_RESULTS = 200
+
+
+class CommentarySearchRequest(BaseModel):
+    """Words to rank by BM25, or an exact phrase ("quoted" or phrase=True)"""
+    query: str
+    limit: int = 20
+    phrase: Optional[bool] = None  # None: phrase search if the query is quoted
+
+
+class CommentarySearchResponse(BaseModel):
+    query: str
+    mode: str  # "phrase" or "terms"
+    total_matches: int
+    results: List[dict]
+
+
+@app.post("/commentary/search", response_model=CommentarySearchResponse)
+def search_commentary(request: CommentarySearchRequest):
+    """
+    Ranked commentary search. Each hit carries the delivery it describes
+    (batter, bowler, runs, wicket), stored alongside the index entry.
+    """
+    if "commentary_postings" not in available_tables():
+        raise HTTPException(
+            status_code=503,
+            detail="Commentary index not built. Run scripts/build_derived_tables.py --tables commentary_postings"
+        )
+
+    query = request.query.strip()
+    phrase = request.phrase
+    if phrase is None:
+        phrase = len(query) > 1 and query.startswith('"') and query.endswith('"')
+    query = query.strip('"').strip()
+    if not re.search(r"[A-Za-z0-9]", query):
+        raise HTTPException(status_code=400, detail="Query has no searchable words")
+    limit = max(1, min(request.limit, MAX_SEARCH_RESULTS))
+
+    search_fn = "commentary_phrase" if phrase else "commentary_search"
+    literal = query.replace("'", "''")
+    # Rank and cut to the top hits before joining the wide tables
+    sql = f"""
+        WITH top_hits AS (
+            SELECT *, COUNT(*) OVER () AS total_matches
+            FROM {search_fn}('{literal}')
+            ORDER BY score DESC, doc_id
+            LIMIT {limit}
+        )
+        SELECT
+            ROUND(s.score, 4) AS score,
+            s.total_matches,
+            s.commentary_id, s.match_id, s.innings, s.over, s.ball,
+            d.text, d.date, d.batter, d.bowler, d.runs_off_bat, d.wicket_type
+        FROM top_hits s
+        JOIN commentary_docs d ON d.doc_id = s.doc_id
+        ORDER BY s.score DESC, s.doc_id
+    """
+
+    current_prompt.set(request.query)
+    try:
+        con = get_db_connection()
+        try:
+            df = execute_query(con, sql, stage="commentary_search")
+        finally:
+            con.close()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    total = int(df["total_matches"].iloc[0]) if len(df) else 0
+    return FastJSONResponse(CommentarySearchResponse.model_construct(
+        query=query,
+        mode="phrase" if phrase else "terms",
+        total_matches=total,
+        results=dataframe_to_payload(df.drop(columns=["total_matches"]), "records")
+    ))
+
+
+# --- Matchup Store ---
+# Batter-vs-bowler totals from the matchups table (scripts/build_derived_tables.py),
+# loaded into NumPy arrays at startup and on each new snapshot. GET /matchup
+# answers from memory instead of scanning balls for two VARCHAR columns.
+MATCHUP_STATS = ("balls_faced", "runs", "dismissals", "dots", "fours", "sixes")
+
+
+class MatchupStore:
+    """
+    Compressed-sparse-row matchup matrix. Players get integer ids (their
+    rank in name order); the rows for batter i are offsets[i]:offsets[i + 1],
+    sorted by bowler id and format, with MATCHUP_STATS as an int32 matrix. A
+    lookup is two dict hits plus a binary search within one batter's rows.
+    """
+
+    def __init__(self, names: List[str], formats: List[str], columns: Dict[str, np.ndarray]):
+        self.names = names
+        self.ids = {name: i for i, name in enumerate(names)}
+        self.formats = formats
+        self.offsets = np.searchsorted(columns["batter_id"], np.arange(len(names) + 1)).astype(np.int64)
+        self.bowler_ids = columns["bowler_id"].astype(np.int32)
+        self.format_codes = columns["format_code"].astype(np.int8)
+        self.stats = np.column_stack([columns[s] for s in MATCHUP_STATS]).astype(np.int32)
+
+    def __len__(self) -> int:
+        return len(self.bowler_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.bowler_ids.nbytes + self.format_codes.nbytes + self.stats.nbytes
+
+    def lookup(self, batter: str, bowler: str) -> List[Tuple[str, np.ndarray]]:
+        """(format, stats row) for every format the pair met in; [] if never."""
+        b, w = self.ids.get(batter), self.ids.get(bowler)
+        if b is None or w is None:
+            return []
+        start, end = self.offsets[b], self.offsets[b + 1]
+        bowlers = self.bowler_ids[start:end]
+        lo = start + np.searchsorted(bowlers, w, side="left")
+        hi = start + np.searchsorted(bowlers, w, side="right")
+        return [(self.formats[self.format_codes[i]], self.stats[i]) for i in range(lo, hi)]
+
+
+@lru_cache(maxsize=1)
+def matchup_store() -> Optional[MatchupStore]:
+    """The matchup arrays for the current snapshot (cached); None if matchups is not built."""
+    if "matchups" not in available_tables():
+        return None
+    start = time.perf_counter()
+    con = get_db_connection()
+    try:
+        names = [r[0] for r in con.execute(
+            "SELECT batter FROM matchups UNION SELECT bowler FROM matchups ORDER BY 1"
+        ).fetchall()]
+        formats = [r[0] for r in con.execute("SELECT DISTINCT format FROM matchups ORDER BY 1").fetchall()]
+        columns = con.execute(f"""
+            WITH player_ids AS (
+                SELECT name, (ROW_NUMBER() OVER (ORDER BY name) - 1)::INTEGER AS id
+                FROM (SELECT batter AS name FROM matchups UNION SELECT bowler FROM matchups)
+            ), format_codes AS (
+                SELECT format, (ROW_NUMBER() OVER (ORDER BY format) - 1)::TINYINT AS code
+                FROM (SELECT DISTINCT format FROM matchups)
+            )
+            SELECT bi.id AS batter_id, wi.id AS bowler_id, f.code AS format_code,
+                   {", ".join(f"mu.{s}" for s in MATCHUP_STATS)}
+            FROM matchups mu
+            JOIN player_ids bi ON bi.name = mu.batter
+            JOIN player_ids wi ON wi.name = mu.bowler
+            JOIN format_codes f ON f.format = mu.format
+            ORDER BY batter_id, bowler_id, format_code
+        """).fetchnumpy()
+    finally:
+        con.close()
+    store = MatchupStore(names, formats, columns)
+    print(f"[Matchups] Loaded {len(store):,} matchups for {len(names):,} players "
+          f"({store.nbytes / 1024 / 1024:.1f} MB) in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return store
+
+
+def matchup_row(fmt: str, stats: np.ndarray) -> Dict[str, Any]:
+    """One matchup line with the usual derived rates."""
+    row = {"format": fmt, **{name: int(v) for name, v in zip(MATCHUP_STATS, stats)}}
+    row["boundaries"] = row["fours"] + row["sixes"]
+    balls = row["balls_faced"]
+    row["strike_rate"] = round(row["runs"] * 100.0 / balls, 2) if balls else None
+    row["average"] = round(row["runs"] / row["dismissals"], 2) if row["dismissals"] else None
+    row["dot_pct"] = round(row["dots"] * 100.0 / balls, 1) if balls else None
+    return row
+
+
+def resolve_player(name: str, store: MatchupStore) -> Optional[str]:
+    """
+    Exact Cricsheet name, else a player alias ("Kohli", "virat kohli") from
+    the intent lists. A surname several players share is refused (400) with
+    the candidates, rather than guessed.
+    """
+    if name in store.ids:
+        return name
+    alias = " ".join(normalize_words(name))
+    candidates = intent_entities()["ambiguous"].get(alias)
+    if candidates:
+        raise HTTPException(
+            status_code=400,
+            detail=f"'{name}' could be any of: {', '.join(candidates[:10])}. Use the full name."
+        )
+    hit = intent_entities()["aliases"].get(alias)
+    if hit and hit[0] == "player" and hit[1] in store.ids:
+        return hit[1]
+    return None
+
+
+class MatchupResponse(BaseModel):
+    batter: str
+    bowler: str
+    formats: List[dict]  # one row per format, most balls first
+    total: Optional[dict] = None  # all formats combined (None if they never met)
+    lookup_ms: float
+
+
+@app.on_event("startup")
+def load_matchup_store():
+    try:
+        matchup_store()
+    except Exception as e:
+        print(f"[Matchups] Could not load the matchup store: {e}")
+
+
+@app.get("/matchup", response_model=MatchupResponse)
+def get_matchup(batter: str, bowler: str, format: Optional[str] = None):
+    """
+    Head-to-head record of a batter against a bowler, per format, from the
+    in-memory matchup store. Names may be Cricsheet names or aliases.
+    """
+    store = matchup_store()
+    if store is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Matchup store not built. Run scripts/build_derived_tables.py --tables matchups"
+        )
+    start = time.perf_counter()
+    resolved = {}
+    for role, name in (("batter", batter), ("bowler", bowler)):
+        resolved[role] = resolve_player(name, store)
+        if resolved[role] is None:
+            raise HTTPException(status_code=404, detail=f"Unknown {role}: {name}")
+
+    lines = [(fmt, stats) for fmt, stats in store.lookup(resolved["batter"], resolved["bowler"])
+             if format is None or fmt.lower() == format.lower()]
+    rows = sorted((matchup_row(fmt, stats) for fmt, stats in lines), key=lambda r: -r["balls_faced"])
+    total = matchup_row("all", np.sum([stats for _, stats in lines], axis=0)) if lines else None
+    return FastJSONResponse(MatchupResponse.model_construct(
+        batter=resolved["batter"],
+        bowler=resolved["bowler"],
+        formats=rows,
+        total=total,
+        lookup_ms=round((time.perf_counter() - start) * 1000, 3)
+    ))
+
+
+# --- Win Probability ---
+# Ball-by-ball win probability for limited-overs chases from the grids built
+# offline by scripts/build_win_probability.py (one per format: runs needed x
+# balls left x wickets). A match's curve is one query plus an array lookup.
+WIN_PROBABILITY_MODEL = os.environ.get("WIN_PROBABILITY_MODEL", "win_probability.npz")
+WIN_PROBABILITY_BALLS = {"T20": 120, "ODI": 300}  # balls per innings for each grid
+ILLEGAL_EXTRAS = ("wides", "wide", "noballs", "noball")
+
+
+@lru_cache(maxsize=1)
+def win_probability_grids() -> Dict[str, Tuple[np.ndarray, int]]:
+    """Cricsheet format -> (grid, balls per innings), from WIN_PROBABILITY_MODEL (cached; {} if absent)."""
+    if not os.path.exists(WIN_PROBABILITY_MODEL):
+        return {}
+    grids = {}
+    with np.load(WIN_PROBABILITY_MODEL) as model:
+        for name, max_balls in WIN_PROBABILITY_BALLS.items():
+            if f"{name}_grid" not in model:
+                continue
+            grid = model[f"{name}_grid"].astype(np.float32)
+            for fmt in model[f"{name}_formats"]:
+                grids[str(fmt)] = (grid, max_balls)
+    print(f"[WinProbability] Loaded grids for {', '.join(sorted(grids)) or 'no formats'} from {WIN_PROBABILITY_MODEL}")
+    return grids
+
+
+def chase_win_probability(grid: np.ndarray, max_balls: int, runs_needed: np.ndarray,
+                          balls_left: np.ndarray, wickets: np.ndarray) -> np.ndarray:
+    """Vectorized grid lookup; finished states are 1 (target reached) or 0 (out of balls or wickets)."""
+    max_runs = grid.shape[0] - 1
+    prob = grid[np.clip(runs_needed, 0, max_runs), np.clip(balls_left, 0, max_balls),
+                np.clip(wickets, 0, 9)].astype(np.float64)
+    prob = np.where((balls_left <= 0) | (wickets >= 10), 0.0, prob)
+    return np.where(runs_needed <= 0, 1.0, prob)
+
+
+class WinProbabilityResponse(BaseModel):
+    match_id: str
+    format: str
+    chasing_team: str
+    defending_team: str
+    target: int
+    winner: Optional[str] = None
+    series: Union[List[dict], Dict[str, Any]]  # the start of the chase, then one point per delivery
+
+
+@app.on_event("startup")
+def load_win_probability_model():
+    try:
+        win_probability_grids()
+    except Exception as e:
+        print(f"[WinProbability] Could not load {WIN_PROBABILITY_MODEL}: {e}")
+
+
+@app.get("/matches/{match_id}/win-probability", response_model=WinProbabilityResponse)
+def get_win_probability(match_id: str, format: Optional[str] = "records"):
+    """
+    The chasing side's win probability before the chase and after every
+    delivery of the second innings (limited-overs matches only).
+    """
+    result_format = check_result_format(format)
+    grids = win_probability_grids()
+    if not grids:
+        raise HTTPException(
+            status_code=503,
+            detail="Win-probability model not built. Run scripts/build_win_probability.py"
+        )
+
+    con = get_db_connection()
+    try:
+        match = execute_query(con, "SELECT format, winner FROM matches WHERE match_id = $match_id",
+                              stage="win_probability", params={"match_id": match_id})
+        if match.empty:
+            raise HTTPException(status_code=404, detail=f"Unknown match: {match_id}")
+        match_format, winner = match["format"].iloc[0], match["winner"].iloc[0]
+        if match_format not in grids:
+            raise HTTPException(status_code=400, detail=f"No win-probability model for {match_format} matches.")
+        balls = execute_query(con, """
+            SELECT b.over, b.ball, b.batting_team, b.bowling_team, b.runs_off_bat, b.extras, b.extra_type,
+                   b.cumulative_runs, b.wickets_fallen, b.wicket_type,
+                   (SELECT MAX(f.cumulative_runs) + 1 FROM balls f
+                    WHERE f.match_id = $match_id AND f.innings = 1) AS target
+            FROM balls b
+            WHERE b.match_id = $match_id AND b.innings = 2
+            ORDER BY b.over, b.ball
+        """, stage="win_probability", params={"match_id": match_id})
+    finally:
+        con.close()
+    if balls.empty or pd.isna(balls["target"].iloc[0]):
+        raise HTTPException(status_code=404, detail=f"Match {match_id} has no second-innings chase.")
+
+    grid, max_balls = grids[match_format]
+    target = int(balls["target"].iloc[0])
+    legal = ~balls["extra_type"].isin(ILLEGAL_EXTRAS).to_numpy()
+    runs_needed = np.concatenate([[target], target - balls["cumulative_runs"].to_numpy(dtype=np.int64)])
+    balls_left = np.concatenate([[max_balls], max_balls - np.cumsum(legal)])
+    wickets = np.concatenate([[0], balls["wickets_fallen"].to_numpy(dtype=np.int64)])
+    prob = chase_win_probability(grid, max_balls, runs_needed, balls_left, wickets)
+
+    series = pd.DataFrame({
+        "over": np.concatenate([[0], balls["over"].to_numpy()]),
+        "ball": np.concatenate([[0], balls["ball"].to_numpy()]),
+        "runs": np.concatenate([[0], (balls["runs_off_bat"] + balls["extras"]).to_numpy()]),
+        "wicket": np.concatenate([[False], balls["wicket_type"].notna().to_numpy()]),
+        "runs_needed": np.maximum(runs_needed, 0),
+        "balls_left": np.maximum(balls_left, 0),
+        "wickets": wickets,
+        "win_probability": np.round(prob, 3),
+    })
+    return FastJSONResponse(WinProbabilityResponse.model_construct(
+        match_id=match_id,
+        format=match_format,
+        chasing_team=balls["batting_team"].iloc[0],
+        defending_team=balls["bowling_team"].iloc[0],
+        target=target,
+        winner=None if pd.isna(winner) else winner,
+        series=dataframe_to_payload(series, result_format)
+    ))
+
+
+# --- Prompt & Result Caches ---
+# Repeated /analyze questions skip Gemini and DuckDB. The prompt cache maps a
+# normalized prompt to its SQL. The warmer saves it to PROMPT_CACHE_FILE and
+# every worker loads that file at startup, so warmed SQL survives restarts.
+# The result cache keeps recent results in memory, keyed by database
+# snapshot, SQL and row cap.
+PROMPT_CACHE_FILE = os.environ.get("PROMPT_CACHE_FILE", "prompt_cache.json")
+PROMPT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", "2000"))
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "128"))
+RESULT_CACHE_MAX_ROWS = int(os.environ.get("RESULT_CACHE_MAX_ROWS", "10000"))
+TRENDING_PROMPTS_SIZE = 500  # prompts whose /analyze counts are tracked for the warmer
+
+_prompt_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_result_cache: "OrderedDict[tuple, Tuple[pd.DataFrame, str, List[str]]]" = OrderedDict()
+_prompt_counts: "OrderedDict[str, List[Any]]" = OrderedDict()  # key -> [count, prompt]
+_cache_lock = threading.Lock()
+_prompt_cache_loaded = False
+
+
+def prompt_key(prompt: str) -> str:
+    return " ".join(normalize_words(prompt))
+
+
+def load_prompt_cache():
+    """Merges PROMPT_CACHE_FILE into the prompt cache (once per process)."""
+    global _prompt_cache_loaded
+    with _cache_lock:
+        if _prompt_cache_loaded:
+            return
+        _prompt_cache_loaded = True
+        try:
+            with open(PROMPT_CACHE_FILE, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, entry in saved.items():
+            _prompt_cache.setdefault(key, entry)
+
+
+def save_prompt_cache():
+    """Writes the prompt cache to PROMPT_CACHE_FILE atomically."""
+    with _cache_lock:
+        snapshot = dict(_prompt_cache)
+    directory = os.path.dirname(os.path.abspath(PROMPT_CACHE_FILE))
+    fd, tmp_path = tempfile.mkstemp(prefix=".prompt_cache.", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, PROMPT_CACHE_FILE)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def cached_sql(prompt: str) -> Optional[str]:
+    load_prompt_cache()
+    key = prompt_key(prompt)
+    with _cache_lock:
+        entry = _prompt_cache.get(key)
+        if entry:
+            _prompt_cache.move_to_end(key)
+    CACHE_REQUESTS.inc(cache="prompt_sql", result="hit" if entry else "miss")
+    return entry["sql"] if entry else None
+
+
+def remember_sql(prompt: str, sql: str, source: str = "live"):
+    with _cache_lock:
+        _prompt_cache[prompt_key(prompt)] = {
+            "prompt": prompt, "sql": sql, "source": source, "cached_at": datetime.now().isoformat()
+        }
+        _prompt_cache.move_to_end(prompt_key(prompt))
+        while len(_prompt_cache) > PROMPT_CACHE_SIZE:
+            _prompt_cache.popitem(last=False)
+
+
+def forget_sql(prompt: str):
+    with _cache_lock:
+        _prompt_cache.pop(prompt_key(prompt), None)
+
+
+def sql_for_prompt(prompt: str) -> Tuple[str, bool]:
+    """
+    SQL for a prompt from the prompt cache, else from Gemini. Returns (sql,
+    cached). Generated SQL is not cached here: the caller remembers the SQL
+    that actually ran (remember_sql) once it has succeeded.
+    """
+    sql = cached_sql(prompt)
+    if sql:
+        return sql, True
+    return generate_sql_from_prompt(prompt), False
+
+
+def note_prompt(prompt: str):
+    """Counts an /analyze prompt for the warmer's trending list."""
+    key = prompt_key(prompt)
+    with _cache_lock:
+        entry = _prompt_counts.pop(key, [0, prompt])
+        entry[0] += 1
+        _prompt_counts[key] = entry
+        while len(_prompt_counts) > TRENDING_PROMPTS_SIZE:
+            _prompt_counts.popitem(last=False)
+
+
+def trending_prompts(limit: int) -> List[str]:
+    with _cache_lock:
+        ranked = sorted(_prompt_counts.values(), key=lambda e: -e[0])
+    return [prompt for _, prompt in ranked[:limit]]
+
+
+def execute_cached(con, sql: str, stage: str, params: Optional[Dict[str, Any]] = None,
+                   max_rows: Optional[int] = None, allow_llm: bool = True
+                   ) -> Tuple[pd.DataFrame, str, List[str], bool]:
+    """
+    execute_with_repair() (or execute_query() with params) through the
+    result cache. Returns (df, sql, repairs, cached).
+    """
+    key = (current_db_file(), sql, json.dumps(params, sort_keys=True, default=str), max_rows)
+    with _cache_lock:
+        hit = _result_cache.get(key)
+        if hit:
+            _result_cache.move_to_end(key)
+    CACHE_REQUESTS.inc(cache="query_result", result="hit" if hit else "miss")
+    if hit:
+        return hit + (True,)
+    if params is not None:
+        df, final_sql, repairs = execute_query(con, sql, stage=stage, params=params, max_rows=max_rows), sql, []
+    else:
+        df, final_sql, repairs = execute_with_repair(con, sql, stage=stage, allow_llm=allow_llm, max_rows=max_rows)
+    if len(df) <= RESULT_CACHE_MAX_ROWS:
+        with _cache_lock:
+            _result_cache[key] = (df, final_sql, repairs)
+            while len(_result_cache) > RESULT_CACHE_SIZE:
+                _result_cache.popitem(last=False)
+    return df, final_sql, repairs, False
+
+
+# --- Off-Peak Cache Warmer ---
+# Spends spare daily Gemini quota in an off-peak window on prompts people are
+# likely to ask: the table titles of published projects, featured prompts
+# (README examples and WARM_PROMPTS_FILE) and the most frequent recent
+# /analyze prompts. Prompts without cached SQL share one generate_sql_batch
+# call per MAX_BATCH_PROMPTS. Every prompt is then executed into the result
+# cache; its SQL enters the prompt cache only once it has run. QUOTA_RESERVE
+# calls are left for live traffic. Enable with CACHE_WARMER=true on one
+# worker. The quota counter (rate_limit_state, like DAILY_LIMIT itself) is
+# per process, so the reserve only holds with a single uvicorn worker: with
+# several, the warmer cannot see the calls the other workers have made.
+CACHE_WARMER = os.environ.get("CACHE_WARMER", "false").lower() == "true"
+WARM_HOURS = os.environ.get("WARM_HOURS", "1-6")  # local hours, start inclusive, end exclusive
+WARM_INTERVAL = float(os.environ.get("WARM_INTERVAL", "900"))  # seconds between passes
+WARM_PROMPTS_PER_PASS = int(os.environ.get("WARM_PROMPTS_PER_PASS", "40"))
+QUOTA_RESERVE = int(os.environ.get("QUOTA_RESERVE", "300"))
+WARM_PROMPTS_FILE = os.environ.get("WARM_PROMPTS_FILE")  # extra featured prompts, one per line
+PUBLISHED_FOLDER = os.environ.get("PUBLISHED_FOLDER", "outputs")
+README_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "README.md")
+PLACEHOLDER_TITLE = re.compile(r"^Dataset \d+$")  # finalize's title for tables without a question
+README_EXAMPLE = re.compile(r'^\s*[-*]\s+"([^"]{8,300})"\s*$', re.MULTILINE)
+
+warmer_state: Dict[str, Any] = {"enabled": CACHE_WARMER, "last_pass": None}
+_warm_lock = threading.Lock()
+
+
+def in_warm_window(hour: Optional[int] = None) -> bool:
+    """True during WARM_HOURS ("1-6"; wraps past midnight, e.g. "22-5")."""
+    hour = datetime.now().hour if hour is None else hour
+    start, end = (int(h) for h in WARM_HOURS.split("-"))
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def spare_quota() -> int:
+    """Gemini calls left today beyond QUOTA_RESERVE, as counted by this process only."""
+    used = rate_limit_state["count"] if rate_limit_state["date"] == str(date.today()) else 0
+    return max(0, DAILY_LIMIT - used - QUOTA_RESERVE)
+
+
+def featured_prompts() -> List[str]:
+    """README example questions plus WARM_PROMPTS_FILE."""
+    prompts = []
+    for path, pattern in ((README_PATH, README_EXAMPLE), (WARM_PROMPTS_FILE, None)):
+        if not path or not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        prompts += pattern.findall(text) if pattern else [line.strip() for line in text.splitlines() if line.strip()]
+    return prompts
+
+
+def published_prompts() -> List[str]:
+    """
+    Titles of the data tables in published projects, as prompts. Their SQL
+    came from the client, so it is never replayed: the SQL is generated (or
+    found in the prompt cache) like any other prompt's.
+    """
+    prompts = []
+    for path in glob.glob(os.path.join(PUBLISHED_FOLDER, "*", "metadata.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                tables = json.load(f).get("data_tables", [])
+        except (OSError, ValueError):
+            continue
+        prompts += [t["title"] for t in tables if t.get("title") and not PLACEHOLDER_TITLE.match(t["title"])]
+    return prompts
+
+
+def warm_cache(max_prompts: int = WARM_PROMPTS_PER_PASS) -> Dict[str, Any]:
+    """One warming pass. Returns what it did."""
+    if not _warm_lock.acquire(blocking=False):
+        return {"skipped": "a warming pass is already running"}
+    token = current_endpoint.set("cache_warmer")
+    try:
+        # Candidates in priority order, each prompt once
+        candidates: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        for prompt in published_prompts():
+            candidates.setdefault(prompt_key(prompt), (prompt, "published"))
+        for prompt in featured_prompts():
+            candidates.setdefault(prompt_key(prompt), (prompt, "featured"))
+        for prompt in trending_prompts(max_prompts):
+            candidates.setdefault(prompt_key(prompt), (prompt, "trending"))
+
+        # SQL: an intent template, cached, or (quota permitting) Gemini.
+        # Work items: (prompt, sql, params, stage, source, sql_cached)
+        work, pending = [], []
+        for prompt, source in list(candidates.values())[:max_prompts]:
+            intent = classify_intent(prompt) if INTENT_TEMPLATES_ENABLED else None
+            if intent:
+                work.append((prompt, intent["sql"], intent["params"], "intent", source, False))
+                continue
+            sql = cached_sql(prompt)
+            if sql:
+                work.append((prompt, sql, None, "analyze", source, True))
+            else:
+                pending.append((prompt, source))
+
+        llm_calls = 0
+        # Each batch may retry up to 3 times; never dip into the reserve
+        while pending and spare_quota() > 3:
+            batch, pending = pending[:MAX_BATCH_PROMPTS], pending[MAX_BATCH_PROMPTS:]
+            generated = generate_sql_batch([prompt for prompt, _ in batch])
+            llm_calls += 1
+            for (prompt, source), sql in zip(batch, generated):
+                if sql:
+                    work.append((prompt, sql, None, "analyze", source, False))
+
+        executed, failed = 0, 0
+        for prompt, sql, params, stage, source, sql_cached in work:
+            current_prompt.set(prompt)
+            try:
+                con = get_db_connection()
+                try:
+                    _, final_sql, repairs, cached = execute_cached(
+                        con, sql, stage, params=params, max_rows=result_row_limit(None), allow_llm=False
+                    )
+                finally:
+                    con.close()
+                if params is None and (repairs or not sql_cached):
+                    remember_sql(prompt, final_sql, source)
+                executed += not cached
+            except Exception as e:
+                if sql_cached:
+                    forget_sql(prompt)
+                failed += 1
+                print(f"[Warmer] {prompt[:60]!r} failed: {e}")
+        if work or llm_calls:
+            save_prompt_cache()
+
+        summary = {
+            "finished_at": datetime.now().isoformat(),
+            "candidates": len(candidates),
+            "llm_calls": llm_calls,
+            "executed": executed,
+            "failed": failed,
+            "without_sql": len(pending),  # left for a later pass: no spare quota
+            "spare_quota": spare_quota(),
+        }
+        warmer_state["last_pass"] = summary
+        print(f"[Warmer] {summary}")
+        return summary
+    finally:
+        current_endpoint.reset(token)
+        _warm_lock.release()
+
+
+def warmer_loop():
+    while True:
+        time.sleep(WARM_INTERVAL)
+        if in_warm_window() and spare_quota() > 0:
+            try:
+                warm_cache()
+            except Exception as e:
+                print(f"[Warmer] Pass failed: {e}")
+
+
+@app.on_event("startup")
+def start_cache_warmer():
+    load_prompt_cache()
+    if CACHE_WARMER:
+        threading.Thread(target=warmer_loop, name="cache-warmer", daemon=True).start()
+
+
+@app.get("/cache/status")
+def cache_status():
+    """Prompt/result cache sizes and the warmer's schedule and last pass."""
+    with _cache_lock:
+        sizes = {"prompt_sql": len(_prompt_cache), "query_result": len(_result_cache)}
+    return {
+        "caches": sizes,
+        "warmer": {
+            **warmer_state,
+            "window": WARM_HOURS,
+            "in_window": in_warm_window(),
+            "quota_reserve": QUOTA_RESERVE,
+            "spare_quota": spare_quota(),
+        },
+    }
+
+
+@app.post("/cache/warm")
+def run_cache_warmer():
+    """Runs a warming pass now (outside the window too); the quota reserve still applies."""
+    require_debug_endpoints()
+    return warm_cache()
+
+
 # --- Finalize (Conversation to Publication) Models ---
 class ConversationMessage(BaseModel):
     """A single message in the conversation history"""
@@ -766,6 +4254,7 @@ class FinalizeRequest(BaseModel):
     project_title: str
     conversation: List[ConversationMessage]
     author: Optional[str] = "Vinay Bale"
+    session_id: Optional[str] = None  # compaction is reused per session (default: the project title)
 
 
 class ProjectOutput(BaseModel):
@@ -810,43 +4299,212 @@ def extract_data_from_conversation(conversation: List[ConversationMessage]) -> L
     return data_sets
 
 
+# --- Conversation Compaction ---
+# Keeps the /finalize prompt within FINALIZE_CONTEXT_TOKENS no matter how
+# long the chat was. Each message is compacted once per session (content and
+# SQL clipped, data reduced to its profile) and cached by fingerprint, so
+# finalizing a longer version of the same chat only processes the new
+# messages. Messages and data sets are ranked by relevance to the project
+# title and the latest questions, then added best-first until the budget is
+# spent. A running summary of every question asked covers whatever is left out.
+FINALIZE_CONTEXT_TOKENS = int(os.environ.get("FINALIZE_CONTEXT_TOKENS", "12000"))
+SUMMARY_SHARE = 0.2  # at most this share of the budget for the running summary
+COMPACT_CONTENT_CHARS = 600
+COMPACT_SQL_CHARS = 800
+SUMMARY_QUESTION_CHARS = 120
+COMPACTION_SESSIONS = 64
+MIN_PROFILE_TOKENS = 100  # below this much budget left, no further profile is built
+
+_compaction_sessions: "OrderedDict[str, Dict[str, Dict[str, Any]]]" = OrderedDict()
+_compaction_lock = threading.Lock()
+
+
+def clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def token_cost(text: str) -> int:
+    """estimate_tokens() rounded up, so the costs of parts never undercount their sum."""
+    return len(text) // 4 + 1
+
+
+def message_fingerprint(msg: ConversationMessage) -> str:
+    payload = orjson.dumps([msg.role, msg.content, msg.sql_query, msg.data], default=str)
+    return hashlib.sha1(payload).hexdigest()
+
+
+def compact_message(msg: ConversationMessage) -> Dict[str, Any]:
+    """
+    Prompt text for one message and the words used to rank it. The data
+    profile ("profile") is added later, only if the message gets that far.
+    """
+    text = f"\n**{msg.role.upper()}**: {clip(msg.content, COMPACT_CONTENT_CHARS)}\n"
+    if msg.sql_query:
+        text += f"SQL: {clip(msg.sql_query, COMPACT_SQL_CHARS)}\n"
+    terms = set(normalize_words(msg.content))
+    if msg.data:
+        text += f"Data: {len(msg.data)} rows (profiled under DATA COLLECTED)\n"
+        terms |= {w for column in msg.data[0] for w in normalize_words(column.replace("_", " "))}
+    return {
+        "text": text,
+        "terms": terms - FILLER_WORDS,
+        "question": clip(msg.content, SUMMARY_QUESTION_CHARS) if msg.role == "user" else None,
+    }
+
+
+def compacted_messages(session_key: str, conversation: List[ConversationMessage]) -> List[Dict[str, Any]]:
+    """Compacted form of every message, reusing the session's earlier work."""
+    with _compaction_lock:
+        cache = _compaction_sessions.get(session_key, {})
+    entries, current = [], {}
+    for msg in conversation:
+        fingerprint = message_fingerprint(msg)
+        entry = current.get(fingerprint) or cache.get(fingerprint)
+        CACHE_REQUESTS.inc(cache="conversation_compaction", result="hit" if entry else "miss")
+        if entry is None:
+            entry = compact_message(msg)
+        current[fingerprint] = entry
+        entries.append(entry)
+    # Only the latest conversation is kept: edited or removed messages drop out
+    with _compaction_lock:
+        _compaction_sessions.pop(session_key, None)
+        _compaction_sessions[session_key] = current
+        while len(_compaction_sessions) > COMPACTION_SESSIONS:
+            _compaction_sessions.popitem(last=False)
+    return entries
+
+
+def running_summary(entries: List[Dict[str, Any]], budget: int) -> str:
+    """Every question asked, in order; the middle ones are elided if they exceed budget."""
+    questions = [e["question"] for e in entries if e["question"]]
+    lines = [f"{i + 1}. {q}" for i, q in enumerate(questions)]
+    if sum(token_cost(line) for line in lines) <= budget:
+        return "\n".join(lines)
+    head, tail, used = lines[:3], [], sum(token_cost(line) for line in lines[:3]) + 10
+    for line in reversed(lines[3:]):
+        if used + token_cost(line) > budget:
+            break
+        tail.insert(0, line)
+        used += token_cost(line)
+    skipped = len(lines) - len(head) - len(tail)
+    return "\n".join(head + [f"... ({skipped} more questions) ..."] + tail)
+
+
+def compact_conversation(session_key: str, project_title: str, conversation: List[ConversationMessage],
+                         data_sets: List[Dict[str, Any]]) -> Tuple[str, str, str, Dict[str, Any]]:
+    """
+    Running-summary, conversation and data prompt sections within
+    FINALIZE_CONTEXT_TOKENS, plus counts of what made it in.
+    """
+    entries = compacted_messages(session_key, conversation)
+    summary = running_summary(entries, int(FINALIZE_CONTEXT_TOKENS * SUMMARY_SHARE))
+    budget = FINALIZE_CONTEXT_TOKENS - token_cost(summary)
+
+    # Relevance: shared words with the title and the last two questions, plus recency
+    questions = [m.content for m in conversation if m.role == "user"][-2:]
+    focus = set(normalize_words(" ".join([project_title] + questions))) - FILLER_WORDS
+    n = max(len(entries), 1)
+    scores = [len(e["terms"] & focus) / np.sqrt(len(e["terms"]) + 1) + i / n for i, e in enumerate(entries)]
+
+    # Message index -> its data set header (data sets are numbered in message order)
+    headers = {}
+    for i, msg in enumerate(conversation):
+        if msg.data:
+            ds = data_sets[len(headers)]
+            headers[i] = (f"\n\nDataset {len(headers) + 1}:\n"
+                          f"Context: {clip(ds['query_context'], SUMMARY_QUESTION_CHARS)}\nRecords: {ds['row_count']}\n")
+
+    # Candidates best-first; a data set ranks just above its message, and the
+    # latest question and answer always go first
+    candidates = [(scores[i], "message", i) for i in range(len(entries))]
+    candidates += [(scores[i] + 0.25, "data", i) for i in headers]
+    latest = set(range(len(entries))[-2:])
+    candidates.sort(key=lambda c: (c[2] not in latest, -c[0]))
+    omission = token_cost("\n[... 1000 less relevant messages omitted ...]\n")
+    included = {"message": set(), "data": set()}
+    used = 0
+    for _, kind, i in candidates:
+        if kind == "message":
+            # Each kept message may end a run of omitted ones: budget for its marker
+            cost = token_cost(entries[i]["text"]) + omission
+        else:
+            if budget - used < MIN_PROFILE_TOKENS:
+                continue
+            if "profile" not in entries[i]:
+                entries[i]["profile"] = format_profile(conversation[i].data)
+            cost = token_cost(f"{headers[i]}Profile: {entries[i]['profile']}\n")
+        if used + cost <= budget:
+            used += cost
+            included[kind].add(i)
+
+    conversation_context, omitted = "", 0
+    for i, entry in enumerate(entries):
+        if i not in included["message"]:
+            omitted += 1
+            continue
+        if omitted:
+            conversation_context += f"\n[... {omitted} less relevant messages omitted ...]\n"
+            omitted = 0
+        conversation_context += entry["text"]
+    if omitted:
+        conversation_context += f"\n[... {omitted} less relevant messages omitted ...]\n"
+
+    # Data sets left out are still listed (without a profile) while the budget lasts
+    data_summary, unlisted = "", 0
+    for i, header in headers.items():
+        if i in included["data"]:
+            data_summary += f"{header}Profile: {entries[i]['profile']}\n"
+            continue
+        listing = f"{header}Profile: omitted (less relevant)\n"
+        if used + token_cost(listing) + omission <= budget:
+            used += token_cost(listing)
+            data_summary += listing
+        else:
+            unlisted += 1
+    if unlisted:
+        data_summary += f"\n\n({unlisted} more data sets not shown)\n"
+
+    stats = {
+        "messages": len(entries),
+        "messages_included": len(included["message"]),
+        "data_sets": len(headers),
+        "data_sets_included": len(included["data"]),
+        "tokens": estimate_tokens(summary + conversation_context + data_summary),
+        "budget": FINALIZE_CONTEXT_TOKENS,
+    }
+    FINALIZE_CONTEXT_TOKENS_USED.observe(stats["tokens"])
+    return summary, conversation_context, data_summary, stats
+
+
 def synthesize_conversation_to_article(
     project_title: str,
     conversation: List[ConversationMessage],
-    data_sets: List[Dict[str, Any]]
+    data_sets: List[Dict[str, Any]],
+    session_key: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Synthesizes an entire conversation history into a publishable article.
     Uses the Utsav Mamoria narrative style from QUALITY_STANDARDS.md.
+    The conversation is compacted to FINALIZE_CONTEXT_TOKENS first.
     """
-    # Build conversation context
-    conversation_context = ""
-    for msg in conversation:
-        conversation_context += f"\n**{msg.role.upper()}**: {msg.content}\n"
-        if msg.sql_query:
-            conversation_context += f"SQL: {msg.sql_query}\n"
-        if msg.data:
-            sample = msg.data[:5] if len(msg.data) > 5 else msg.data
-            conversation_context += f"Data (sample): {json.dumps(sample)}\n"
-
-    # Build data summary
-    data_summary = ""
-    total_records = 0
-    for i, ds in enumerate(data_sets):
-        data_summary += f"\n\nDataset {i + 1}:\n"
-        data_summary += f"Context: {ds['query_context']}\n"
-        data_summary += f"Records: {ds['row_count']}\n"
-        if ds['data']:
-            sample = ds['data'][:3]
-            data_summary += f"Sample: {json.dumps(sample)}\n"
-        total_records += ds['row_count']
+    summary, conversation_context, data_summary, stats = compact_conversation(
+        session_key or project_title, project_title, conversation, data_sets
+    )
+    print(f"[Finalize] Context: {stats['messages_included']}/{stats['messages']} messages, "
+          f"{stats['data_sets_included']}/{stats['data_sets']} data profiles, "
+          f"~{stats['tokens']} of {stats['budget']} tokens")
+    total_records = sum(ds['row_count'] for ds in data_sets)
 
     synthesis_prompt = f"""
     You are a cricket analytics writer creating a publication-ready article.
 
     Project Title: "{project_title}"
 
-    CONVERSATION HISTORY:
+    QUESTIONS ASKED (in order):
+    {summary}
+
+    CONVERSATION HISTORY (most relevant messages):
     {conversation_context}
 
     DATA COLLECTED:
@@ -892,7 +4550,7 @@ def synthesize_conversation_to_article(
     Return ONLY valid JSON.
     """
 
-    response_text = call_gemini(synthesis_prompt)
+    response_text = call_gemini(synthesis_prompt, stage="synthesize")
     response_text = clean_json_response(response_text)
 
     try:
@@ -913,71 +4571,12 @@ def generate_charts_for_data(data_sets: List[Dict[str, Any]]) -> List[ChartRecom
     """
     Generates chart recommendations for all data sets from a conversation.
     """
-    if not GEMINI_API_KEY or not data_sets:
-        return []
-
-    # Build data structure info
-    data_info = []
+    charts: List[ChartRecommendation] = []
     for i, ds in enumerate(data_sets):
         if ds['data'] and len(ds['data']) > 0:
-            sample = ds['data'][0]
-            columns = list(sample.keys())
-            data_info.append({
-                "dataset_index": i,
-                "context": ds['query_context'][:100],
-                "columns": columns,
-                "row_count": ds['row_count'],
-                "sample": sample
-            })
-
-    if not data_info:
-        return []
-
-    chart_prompt = f"""
-    You are a data visualization expert creating charts for a cricket analytics publication.
-
-    Data available:
-    {json.dumps(data_info, indent=2)}
-
-    Create 4-8 chart recommendations that tell a visual story.
-
-    Available chart types:
-    - bar: Comparing categories
-    - horizontal-bar: Many categories or long labels
-    - line: Trends over time
-    - area: Cumulative trends
-    - pie: Part-to-whole (max 6 slices)
-    - scatter: Correlation between variables
-    - radar: Multi-dimensional comparison
-    - composed: Bar + line combined
-
-    Chart title rule: Title should state the INSIGHT, not describe the data.
-    Good: "Accelerators Convert 35% More Often"
-    Bad: "Conversion Rate by Acceleration Category"
-
-    Return a JSON array:
-    [
-        {{
-            "chart_type": "bar",
-            "title": "Insight-revealing title",
-            "data_key": "dataset_0",
-            "x_axis": "column_name",
-            "y_axis": "column_name",
-            "description": "What this chart shows"
-        }}
-    ]
-
-    Return ONLY valid JSON.
-    """
-
-    response_text = call_gemini(chart_prompt)
-    response_text = clean_json_response(response_text)
+            charts.extend(recommend_charts(ds['data'], f"dataset_{i}", ds['query_context'][:100]))
 
-    try:
-        recommendations = json.loads(response_text)
-        return [ChartRecommendation(**rec) for rec in recommendations]
-    except (json.JSONDecodeError, TypeError):
-        return []
+    return rewrite_chart_titles(charts[:8])
 
 
 @app.post("/finalize", response_model=ProjectOutput)
@@ -1013,11 +4612,15 @@ def finalize_project(request: FinalizeRequest):
         synthesis = synthesize_conversation_to_article(
             request.project_title,
             request.conversation,
-            data_sets
+            data_sets,
+            request.session_id
         )
 
         # Generate chart recommendations
         charts = generate_charts_for_data(data_sets)
+        attach_chart_series(charts, {
+            f"dataset_{i}": ds['data'] for i, ds in enumerate(data_sets) if ds['data']
+        })
 
         # Format data tables for output
         data_tables = []
@@ -1026,6 +4629,7 @@ def finalize_project(request: FinalizeRequest):
                 data_tables.append({
                     "table_id": f"table_{i}",
                     "title": ds['query_context'][:100] if ds['query_context'] else f"Dataset {i + 1}",
+                    "sql_query": ds['sql_query'],
                     "data": ds['data'],
                     "row_count": ds['row_count']
                 })
@@ -1046,7 +4650,8 @@ def finalize_project(request: FinalizeRequest):
                             })
                             break
 
-        return ProjectOutput(
+        # Data tables echo rows the client sent: already validated on input
+        return FastJSONResponse(ProjectOutput.model_construct(
             slug=slug,
             title=request.project_title,
             author=request.author or "Vinay Bale",
@@ -1060,8 +4665,10 @@ def finalize_project(request: FinalizeRequest):
             methodology=synthesis.get("methodology", ""),
             limitations=synthesis.get("limitations", ""),
             verification_notes=synthesis.get("verification_notes", "")
-        )
+        ))
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1071,7 +4678,7 @@ def finalize_status():
     """Check if the finalize endpoint is ready"""
     return {
         "status": "ready",
-        "gemini_configured": GEMINI_API_KEY is not None,
+        "gemini_configured": genai_client is not None,
         "description": "Synthesize conversation into publishable project"
     }
 
@@ -1162,7 +4769,7 @@ def extract_claims_from_article(article: str, key_stats: List[Dict]) -> List[Dic
     Return ONLY valid JSON.
     """
 
-    response_text = call_gemini(extraction_prompt)
+    response_text = call_gemini(extraction_prompt, stage="extract_claims")
     response_text = clean_json_response(response_text)
 
     try:
@@ -1175,7 +4782,7 @@ def verify_claim_with_database(claim: Dict[str, Any], schema: str) -> Dict[str,
     """
     Verifies a statistical claim by generating and running an independent SQL query.
     """
-    if not GEMINI_API_KEY:
+    if not genai_client:
         return {"verified": False, "error": "Gemini not configured"}
 
     # Generate verification SQL
@@ -1196,13 +4803,14 @@ def verify_claim_with_database(claim: Dict[str, Any], schema: str) -> Dict[str,
     Return ONLY the SQL query, no markdown, no explanation.
     """
 
-    response_text = call_gemini(sql_prompt)
+    response_text = call_gemini(sql_prompt, stage="verify_sql")
     sql_query = response_text.replace('```sql', '').replace('```', '').strip()
 
     # Execute the query
+    current_prompt.set(claim.get('claim_text', ''))
     try:
         con = get_db_connection()
-        df = con.execute(sql_query).fetchdf()
+        df, sql_query, _ = execute_with_repair(con, sql_query, stage="verify_claim", allow_llm=False)
         result = df.to_dict(orient='records')
         con.close()
 
@@ -1239,7 +4847,7 @@ def verify_claim_with_web_search(claim: Dict[str, Any]) -> Dict[str, Any]:
     Note: In production, this would use a real search API.
     For now, we use Gemini's knowledge as a proxy.
     """
-    if not GEMINI_API_KEY:
+    if not genai_client:
         return {"verified": False, "error": "Gemini not configured"}
 
     search_prompt = f"""
@@ -1266,7 +4874,7 @@ def verify_claim_with_web_search(claim: Dict[str, Any]) -> Dict[str, Any]:
     Return ONLY valid JSON.
     """
 
-    response_text = call_gemini(search_prompt)
+    response_text = call_gemini(search_prompt, stage="verify_web")
     response_text = clean_json_response(response_text)
 
     try:
@@ -1438,6 +5046,8 @@ def validate_project(request: ValidationRequest):
             recommendation=recommendation
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1448,6 +5058,8 @@ class PublishRequest(BaseModel):
     project: ProjectOutput
     validation: ValidationResponse
     output_folder: Optional[str] = None  # Defaults to outputs/
+    data_formats: Optional[List[str]] = ["csv"]  # csv and/or parquet
+    compression: Optional[str] = None  # gzip or zstd (None = uncompressed)
 
 
 class PublishResponse(BaseModel):
@@ -1459,6 +5071,102 @@ class PublishResponse(BaseModel):
     message: str
 
 
+# --- Data Table Export (DuckDB COPY) ---
+# Extensions per (format, compression). Parquet compresses internally, so
+# the file name does not change.
+PUBLISH_FORMATS = {
+    "csv": {None: ".csv", "gzip": ".csv.gz", "zstd": ".csv.zst"},
+    "parquet": {None: ".parquet", "gzip": ".parquet", "zstd": ".parquet"},
+}
+
+
+def copy_options(data_format: str, compression: Optional[str]) -> str:
+    """Build the option list for a DuckDB COPY ... TO statement."""
+    if data_format == "csv":
+        options = ["FORMAT CSV", "HEADER"]
+    else:
+        options = ["FORMAT PARQUET"]
+    if compression:
+        options.append(f"COMPRESSION {compression}")
+    return ", ".join(options)
+
+
+def safe_file_stem(name: Optional[str], default: str = "data") -> str:
+    """Restricts a client-supplied name to [A-Za-z0-9_-] so it stays inside its folder."""
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", name or "").strip("_") or default
+
+
+def export_data_table(
+    con,
+    writer,
+    table: Dict[str, Any],
+    data_folder: str,
+    data_formats: List[str],
+    compression: Optional[str]
+) -> Dict[str, Any]:
+    """
+    Writes one data table with DuckDB's native COPY ... TO.
+
+    The table's SQL is re-run so the published files match the database,
+    but only if it is a single SELECT, and only on `con`, a sandboxed
+    connection (get_sandboxed_connection). Its rows are handed as Arrow to
+    `writer`, an in-memory connection that runs nothing but the COPY.
+    Tables without usable SQL (e.g. several deep-analysis steps joined into
+    one message) fall back to the rows supplied by the client.
+    Returns the file names written and where the data came from.
+    """
+    table_id = safe_file_stem(table.get("table_id"))
+    sql_query = single_select(con, (table.get("sql_query") or "").strip())
+
+    with query_slot("publish"):
+        source = None
+        if sql_query:
+            try:
+                with SQL_EXECUTION_SECONDS.time(endpoint=current_endpoint.get(), stage="publish_query"):
+                    rows = con.execute(sql_query).arrow()
+                writer.register("publish_source", rows)
+                source = "database"
+            except Exception as e:
+                print(f"[Publish] {table_id}: SQL could not be re-run ({e}); using supplied rows")
+        if source is None:
+            writer.register("publish_source", pd.DataFrame(table["data"]))
+            source = "client"
+
+        files = []
+        for data_format in data_formats:
+            file_name = f"{table_id}{PUBLISH_FORMATS[data_format][compression]}"
+            path = os.path.join(data_folder, file_name).replace("'", "''")
+            with SQL_EXECUTION_SECONDS.time(endpoint=current_endpoint.get(), stage=f"publish_copy_{data_format}"):
+                writer.execute(f"COPY publish_source TO '{path}' ({copy_options(data_format, compression)})")
+            files.append(file_name)
+        writer.unregister("publish_source")
+
+    return {"table_id": table_id, "files": files, "source": source}
+
+
+def swap_directory(staging_folder: str, target_folder: str):
+    """
+    Replaces target_folder with staging_folder.
+    The old folder is renamed aside first and restored if the second rename
+    fails. Between the two renames target_folder briefly does not exist,
+    but readers never see a partly written project.
+    """
+    backup_folder = None
+    if os.path.exists(target_folder):
+        backup_folder = f"{target_folder}.old-{int(time.time() * 1000)}"
+        os.rename(target_folder, backup_folder)
+
+    try:
+        os.rename(staging_folder, target_folder)
+    except OSError:
+        if backup_folder:
+            os.rename(backup_folder, target_folder)
+        raise
+
+    if backup_folder:
+        shutil.rmtree(backup_folder, ignore_errors=True)
+
+
 @app.post("/publish", response_model=PublishResponse)
 def publish_project(request: PublishRequest):
     """
@@ -1466,13 +5174,12 @@ def publish_project(request: PublishRequest):
 
     This endpoint:
     1. Verifies the project passed validation (recommendation = READY_TO_PUBLISH)
-    2. Creates the project folder structure
-    3. Saves article markdown, data tables (CSV), metadata (JSON)
-    4. Returns paths to all created files
+    2. Builds the project in a staging folder
+    3. Saves article markdown, data tables (CSV/Parquet via DuckDB COPY), metadata (JSON)
+    4. Swaps the staging folder into place and returns paths to all created files
 
     Only call this after /validate returns READY_TO_PUBLISH.
     """
-    import csv
     from datetime import datetime
 
     # Check validation status
@@ -1483,21 +5190,50 @@ def publish_project(request: PublishRequest):
                    f"Score: {request.validation.verification_score}%. Fix issues and re-validate."
         )
 
+    data_formats = request.data_formats or ["csv"]
+    unknown_formats = [f for f in data_formats if f not in PUBLISH_FORMATS]
+    if unknown_formats:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported data format(s): {', '.join(unknown_formats)}. Use csv and/or parquet."
+        )
+    if request.compression not in PUBLISH_FORMATS["csv"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported compression: {request.compression}. Use gzip, zstd or none."
+        )
+
+    if safe_file_stem(request.project.slug, default="") != request.project.slug:
+        raise HTTPException(status_code=400, detail="Project slug may only contain letters, digits, '-' and '_'.")
+
+    # Distinct table_ids can map to one file name ("t 1" and "t/1" -> t_1); compared
+    # case-insensitively, as on macOS and Windows file systems
+    stems = [safe_file_stem(t.get("table_id")).lower() for t in request.project.data_tables if t.get("data")]
+    shared = sorted({stem for stem in stems if stems.count(stem) > 1})
+    if shared:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Data tables would overwrite each other's files: {', '.join(shared)}. "
+                   f"Give each table a distinct table_id of letters, digits, '-' and '_' (case is ignored)."
+        )
+
+    staging_folder = None
     try:
         # Determine output folder
-        base_folder = request.output_folder or "outputs"
+        base_folder = request.output_folder or PUBLISHED_FOLDER
         project_folder = os.path.join(base_folder, request.project.slug)
 
-        # Create folder structure
-        os.makedirs(project_folder, exist_ok=True)
-        os.makedirs(os.path.join(project_folder, "data"), exist_ok=True)
-        os.makedirs(os.path.join(project_folder, "charts"), exist_ok=True)
+        # Build everything in a staging folder next to the target so the
+        # final rename stays on one filesystem
+        os.makedirs(base_folder, exist_ok=True)
+        staging_folder = tempfile.mkdtemp(prefix=f".{request.project.slug}.staging-", dir=base_folder)
+        os.makedirs(os.path.join(staging_folder, "data"), exist_ok=True)
+        os.makedirs(os.path.join(staging_folder, "charts"), exist_ok=True)
 
         files_created = []
 
         # 1. Save article markdown
-        article_path = os.path.join(project_folder, "article.md")
-        with open(article_path, "w", encoding="utf-8") as f:
+        with open(os.path.join(staging_folder, "article.md"), "w", encoding="utf-8") as f:
             f.write(f"# {request.project.title}\n\n")
             f.write(f"**Author:** {request.project.author}\n")
             f.write(f"**Date:** {request.project.date}\n\n")
@@ -1509,26 +5245,29 @@ def publish_project(request: PublishRequest):
             f.write(f"## Methodology\n\n{request.project.methodology}\n\n")
             f.write(f"## Limitations\n\n{request.project.limitations}\n\n")
             f.write(f"## Verification\n\n{request.project.verification_notes}\n")
-        files_created.append(article_path)
+        files_created.append("article.md")
 
         # 2. Save tweet
-        tweet_path = os.path.join(project_folder, "tweet.txt")
-        with open(tweet_path, "w", encoding="utf-8") as f:
+        with open(os.path.join(staging_folder, "tweet.txt"), "w", encoding="utf-8") as f:
             f.write(request.project.tweet)
-        files_created.append(tweet_path)
-
-        # 3. Save data tables as CSV
-        for table in request.project.data_tables:
-            if table.get("data") and len(table["data"]) > 0:
-                table_id = table.get("table_id", "data")
-                csv_path = os.path.join(project_folder, "data", f"{table_id}.csv")
-
-                with open(csv_path, "w", newline="", encoding="utf-8") as f:
-                    writer = csv.DictWriter(f, fieldnames=table["data"][0].keys())
-                    writer.writeheader()
-                    writer.writerows(table["data"])
-
-                files_created.append(csv_path)
+        files_created.append("tweet.txt")
+
+        # 3. Save data tables straight from DuckDB
+        data_sources = {}
+        tables = [t for t in request.project.data_tables if t.get("data") and len(t["data"]) > 0]
+        if tables:
+            con, writer = get_sandboxed_connection(), duckdb.connect()
+            try:
+                for table in tables:
+                    exported = export_data_table(
+                        con, writer, table, os.path.join(staging_folder, "data"),
+                        data_formats, request.compression
+                    )
+                    data_sources[exported["table_id"]] = exported["source"]
+                    files_created.extend(os.path.join("data", name) for name in exported["files"])
+            finally:
+                writer.close()
+                con.close()
 
         # 4. Save project metadata
         metadata = {
@@ -1539,6 +5278,12 @@ def publish_project(request: PublishRequest):
             "executive_summary": request.project.executive_summary,
             "key_stats": request.project.key_stats,
             "charts": [c.dict() for c in request.project.charts],
+            "data_sources": data_sources,
+            # Questions behind the tables (the cache warmer asks these as prompts)
+            "data_tables": [
+                {"table_id": t.get("table_id"), "title": t.get("title")}
+                for t in request.project.data_tables
+            ],
             "validation": {
                 "status": request.validation.overall_status,
                 "score": request.validation.verification_score,
@@ -1548,16 +5293,20 @@ def publish_project(request: PublishRequest):
             "published_at": datetime.now().isoformat()
         }
 
-        metadata_path = os.path.join(project_folder, "metadata.json")
-        with open(metadata_path, "w", encoding="utf-8") as f:
+        with open(os.path.join(staging_folder, "metadata.json"), "w", encoding="utf-8") as f:
             json.dump(metadata, f, indent=2)
-        files_created.append(metadata_path)
+        files_created.append("metadata.json")
 
         # 5. Save validation report
-        validation_path = os.path.join(project_folder, "validation_report.json")
-        with open(validation_path, "w", encoding="utf-8") as f:
+        with open(os.path.join(staging_folder, "validation_report.json"), "w", encoding="utf-8") as f:
             json.dump(request.validation.dict(), f, indent=2, default=str)
-        files_created.append(validation_path)
+        files_created.append("validation_report.json")
+
+        # 6. Swap the finished project into place
+        swap_directory(staging_folder, project_folder)
+        staging_folder = None
+
+        files_created = [os.path.join(project_folder, name) for name in files_created]
 
         return PublishResponse(
             success=True,
@@ -1567,16 +5316,22 @@ def publish_project(request: PublishRequest):
             message=f"Project '{request.project.title}' published successfully with {len(files_created)} files."
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    finally:
+        if staging_folder:
+            shutil.rmtree(staging_folder, ignore_errors=True)
+
 
 @app.get("/validate/status")
 def validate_status():
     """Check validation agent status"""
     return {
         "status": "ready",
-        "gemini_configured": GEMINI_API_KEY is not None,
+        "gemini_configured": genai_client is not None,
         "description": "Validation agent for verifying article claims"
     }
 
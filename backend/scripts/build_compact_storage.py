@@ -0,0 +1,195 @@
+"""
+Rewrites cricket_analytics.duckdb with `balls` in integer-keyed storage.
+
+`balls` repeats player and team names on every delivery. This build moves
+them into two dimension tables, `players` (player_id, name) and `teams`
+(team_id, name), and stores the deliveries in `balls_keyed`: player and team
+columns become INTEGER keys (batter_id, ..., batting_team_id) and the
+counters use the narrowest unsigned type that fits. `balls` becomes a view
+with the original column names and types, so existing SQL keeps working;
+queries grouping or filtering by player get faster by using `balls_keyed`
+directly (the intent templates do so when it exists).
+
+The view looks names up by position in a list of each dimension (keys are
+dense, starting at 1) rather than joining it: DuckDB joins every dimension
+of a join view even when the query never reads the name.
+
+Keys are stable: the dimensions of an already compacted database are carried
+over and new names get the next free keys, so ingestion appends to
+`balls_keyed` without re-encoding it (scripts/ingest_cricsheet.py). The
+result always goes to a new file, since dropping a table does not shrink a
+DuckDB file. Run on its own, this writes a new snapshot of --db and swaps it
+in the same way ingestion does. The layout is opt-in: a database that was
+never compacted keeps `balls` as a plain table.
+
+Usage (from backend/):
+    python scripts/build_compact_storage.py --db cricket_analytics.duckdb
+    python scripts/build_compact_storage.py --db cricket_analytics.duckdb --dry-run
+"""
+import argparse
+import os
+import time
+
+import duckdb
+
+KEYED_TABLE = "balls_keyed"
+
+# Dimension table -> (key column, `balls` columns it keys); in balls_keyed
+# each of those columns is stored as <column>_id
+DIMENSIONS = {
+    "players": ("player_id", ("batter", "non_striker", "bowler", "dismissed_batter")),
+    "teams": ("team_id", ("batting_team", "bowling_team")),
+}
+# Storage types for the counters; the `balls` view casts back to the original types
+NARROW_TYPES = {
+    "innings": "UTINYINT", "over": "USMALLINT", "ball": "UTINYINT",
+    "runs_off_bat": "UTINYINT", "extras": "UTINYINT", "total_runs": "UTINYINT",
+    "cumulative_runs": "USMALLINT", "wickets_fallen": "UTINYINT",
+}
+
+
+def is_compact(con, catalog: str = None) -> bool:
+    """True if the database (default: the connection's own) stores `balls` keyed."""
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables "
+        "WHERE table_name = ? AND table_catalog = COALESCE(?, current_database())",
+        [KEYED_TABLE, catalog]
+    ).fetchone()[0] > 0
+
+
+def dimension_of(column: str):
+    """(dimension table, key column) keying a `balls` column, or None."""
+    return next(((table, key) for table, (key, columns) in DIMENSIONS.items() if column in columns), None)
+
+
+def extend_dimensions(con, source: str):
+    """Adds the names in `source` (plain `balls` rows) missing from the dimensions, with the next free keys."""
+    for table, (key, columns) in DIMENSIONS.items():
+        names = " UNION ".join(f"SELECT {column} AS name FROM {source}" for column in columns)
+        con.execute(f"""
+            INSERT INTO {table}
+            SELECT (SELECT COALESCE(MAX({key}), 0) FROM {table}) + ROW_NUMBER() OVER (ORDER BY name), name
+            FROM ({names}) new_names
+            WHERE name IS NOT NULL AND name NOT IN (SELECT name FROM {table})
+        """)
+
+
+def append_keyed(con, source: str):
+    """Appends `source` (rows shaped like plain `balls`) to balls_keyed, extending the dimensions first."""
+    extend_dimensions(con, source)
+    selected, joins = [], []
+    for name, _ in balls_columns(con):
+        dimension = dimension_of(name)
+        if dimension:
+            table, key = dimension
+            selected.append(f"{name}_k.{key}")
+            joins.append(f"LEFT JOIN {table} {name}_k ON {name}_k.name = b.{name}")
+        else:
+            selected.append(f'b."{name}"')
+    con.execute(f"""
+        INSERT INTO {KEYED_TABLE}
+        SELECT {", ".join(selected)}
+        FROM {source} b {" ".join(joins)}
+        ORDER BY b.match_id, b.innings, b."over", b.ball
+    """)
+
+
+def create_keyed_storage(con, columns: list):
+    """
+    Creates an empty balls_keyed for `balls` columns [(name, type)], the
+    dimensions if missing, and the `balls` view over them.
+    """
+    for table, (key, _) in DIMENSIONS.items():
+        con.execute(f"CREATE TABLE IF NOT EXISTS {table} ({key} INTEGER, name VARCHAR)")
+    stored, exposed = [], []
+    for name, data_type in columns:
+        dimension = dimension_of(name)
+        if dimension:
+            table, key = dimension
+            stored.append(f"{name}_id INTEGER")
+            exposed.append(f"(SELECT list(name ORDER BY {key}) FROM {table})[k.{name}_id] AS {name}")
+        elif name in NARROW_TYPES:
+            stored.append(f'"{name}" {NARROW_TYPES[name]}')
+            exposed.append(f'k."{name}"::{data_type} AS "{name}"')
+        else:
+            stored.append(f'"{name}" {data_type}')
+            exposed.append(f'k."{name}"')
+    con.execute(f"CREATE TABLE {KEYED_TABLE} ({', '.join(stored)})")
+    con.execute(f"CREATE VIEW balls AS SELECT {', '.join(exposed)} FROM {KEYED_TABLE} k")
+
+
+def balls_columns(con, catalog: str = None) -> list:
+    """[(name, type)] of `balls` (table or view) in `catalog` (default: the connection's own)."""
+    return con.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_catalog = COALESCE(?, current_database()) AND table_name = 'balls'
+        ORDER BY ordinal_position
+    """, [catalog]).fetchall()
+
+
+def copy_macros(con, catalog: str):
+    """Recreates the macros of an attached database (e.g. commentary_search) in this one."""
+    macros = con.execute("""
+        SELECT function_name, function_type, parameters, macro_definition FROM duckdb_functions()
+        WHERE database_name = ? AND NOT internal AND function_type IN ('macro', 'table_macro')
+    """, [catalog]).fetchall()
+    for name, function_type, parameters, definition in macros:
+        body = f"TABLE {definition}" if function_type == "table_macro" else definition
+        con.execute(f"CREATE MACRO {name}({', '.join(parameters)}) AS {body}")
+
+
+def compact_database(source_path: str, out_path: str) -> dict:
+    """Copies source_path into a new file out_path with `balls` in keyed storage."""
+    con = duckdb.connect(out_path)
+    try:
+        con.execute(f"ATTACH '{source_path}' AS src (READ_ONLY)")
+        tables = [row[0] for row in con.execute("""
+            SELECT table_name FROM information_schema.tables
+            WHERE table_catalog = 'src' AND table_type = 'BASE TABLE' ORDER BY table_name
+        """).fetchall()]
+        # Existing dimensions are copied first so their keys survive
+        for table in tables:
+            if table not in ("balls", KEYED_TABLE):
+                con.execute(f"CREATE TABLE {table} AS SELECT * FROM src.{table}")
+
+        create_keyed_storage(con, balls_columns(con, "src"))
+        append_keyed(con, "src.balls")
+        copy_macros(con, "src")
+
+        summary = {
+            "balls": con.execute(f"SELECT COUNT(*) FROM {KEYED_TABLE}").fetchone()[0],
+            **{table: con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in DIMENSIONS},
+        }
+        con.execute("DETACH src")
+        con.execute("CHECKPOINT")
+    except BaseException:
+        con.close()
+        os.remove(out_path)
+        raise
+    con.close()
+    summary["bytes_before"] = os.path.getsize(source_path)
+    summary["bytes_after"] = os.path.getsize(out_path)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="cricket_analytics.duckdb")
+    parser.add_argument("--dry-run", action="store_true", help="build the snapshot but do not swap it in")
+    parser.add_argument("--keep", type=int, default=2, help="snapshots to keep for rollback")
+    args = parser.parse_args()
+
+    from ingest_cricsheet import finish_snapshot, new_snapshot_path  # it imports this module
+
+    start = time.perf_counter()
+    snapshot_path = new_snapshot_path(args.db)
+    print(f"Compacting {args.db} into {os.path.basename(snapshot_path)}")
+    summary = compact_database(os.path.realpath(args.db), snapshot_path)
+    print(f"  {summary['balls']:,} balls, {summary['players']:,} players, {summary['teams']:,} teams; "
+          f"{summary['bytes_before'] / 1e6:,.1f} MB -> {summary['bytes_after'] / 1e6:,.1f} MB "
+          f"in {time.perf_counter() - start:.1f}s")
+    finish_snapshot(args.db, snapshot_path, not args.dry_run, max(1, args.keep))
+
+
+if __name__ == "__main__":
+    main()
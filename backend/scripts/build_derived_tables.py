@@ -0,0 +1,572 @@
+"""
+Builds derived tables inside cricket_analytics.duckdb.
+
+Derived tables precompute shapes the analysis queries keep rebuilding from
+the 5M-row `balls` table. Each builder can run in full (drop and recreate)
+or incrementally for a set of match_ids (delete and re-insert just those
+rows), which is what ingestion uses after appending new matches.
+
+The API opens the database read-only, so run this against a copy or while
+the service is stopped.
+
+Usage (from backend/):
+    python scripts/build_derived_tables.py --db cricket_analytics.duckdb
+    python scripts/build_derived_tables.py --db cricket_analytics.duckdb --tables batter_innings balls_enriched
+    python scripts/build_derived_tables.py --db cricket_analytics.duckdb --tables commentary_postings
+    python scripts/build_derived_tables.py --db cricket_analytics.duckdb --tables matchups
+"""
+import argparse
+import time
+
+import duckdb
+
+# Temp table holding the match_ids an incremental refresh is limited to
+REFRESH_TABLE = "refresh_match_ids"
+
+
+def match_filter(match_ids, column: str = "match_id") -> str:
+    """WHERE-clause fragment restricting a builder to the matches being refreshed."""
+    if match_ids is None:
+        return "TRUE"
+    return f"{column} IN (SELECT match_id FROM {REFRESH_TABLE})"
+
+
+def stage_match_ids(con, match_ids):
+    """Loads the match_ids of an incremental refresh into a temp table."""
+    con.execute(f"CREATE OR REPLACE TEMP TABLE {REFRESH_TABLE} (match_id VARCHAR)")
+    if match_ids:
+        con.executemany(f"INSERT INTO {REFRESH_TABLE} VALUES (?)", [[m] for m in match_ids])
+
+
+def replace_rows(con, table: str, select_sql: str, match_ids):
+    """Full build: CREATE OR REPLACE. Incremental: delete and re-insert the refreshed matches."""
+    if match_ids is None:
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS {select_sql}")
+    else:
+        con.execute(f"DELETE FROM {table} WHERE {match_filter(match_ids)}")
+        con.execute(f"INSERT INTO {table} {select_sql}")
+
+
+def build_batter_innings(con, match_ids=None):
+    """
+    One row per batter per innings: final runs, balls faced, boundaries,
+    dismissal, the ball index at which 50/90/100 was reached, and the
+    cumulative score after every ball faced as a SMALLINT[] array.
+    """
+    select_sql = f"""
+        WITH faced AS (
+            SELECT
+                match_id, innings, batter, batting_team, bowling_team, runs_off_bat,
+                ROW_NUMBER() OVER w AS ball_index,
+                SUM(runs_off_bat) OVER (w ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS score
+            FROM balls
+            WHERE {match_filter(match_ids)}
+              AND COALESCE(extra_type, '') NOT IN ('wides', 'wide')
+            WINDOW w AS (PARTITION BY match_id, innings, batter ORDER BY over, ball)
+        ),
+        innings_totals AS (
+            SELECT
+                match_id, innings, batter,
+                ANY_VALUE(batting_team) AS batting_team,
+                ANY_VALUE(bowling_team) AS bowling_team,
+                MAX(score)::INTEGER AS runs,
+                COUNT(*)::INTEGER AS balls,
+                COUNT(*) FILTER (WHERE runs_off_bat = 4)::INTEGER AS fours,
+                COUNT(*) FILTER (WHERE runs_off_bat = 6)::INTEGER AS sixes,
+                COUNT(*) FILTER (WHERE runs_off_bat = 0)::INTEGER AS dots,
+                MIN(ball_index) FILTER (WHERE score >= 50)::INTEGER AS ball_at_50,
+                MIN(ball_index) FILTER (WHERE score >= 90)::INTEGER AS ball_at_90,
+                MIN(ball_index) FILTER (WHERE score >= 100)::INTEGER AS ball_at_100,
+                LIST(score::SMALLINT ORDER BY ball_index) AS progression
+            FROM faced
+            GROUP BY match_id, innings, batter
+        ),
+        dismissals AS (
+            SELECT
+                match_id, innings, dismissed_batter AS batter,
+                ANY_VALUE(batting_team) AS batting_team,
+                ANY_VALUE(bowling_team) AS bowling_team,
+                ANY_VALUE(wicket_type) AS wicket_type,
+                ANY_VALUE(bowler) AS dismissed_by
+            FROM balls
+            WHERE {match_filter(match_ids)} AND dismissed_batter IS NOT NULL
+            GROUP BY match_id, innings, dismissed_batter
+        )
+        SELECT
+            COALESCE(t.match_id, d.match_id) AS match_id,
+            COALESCE(t.innings, d.innings) AS innings,
+            COALESCE(t.batter, d.batter) AS batter,
+            COALESCE(t.batting_team, d.batting_team) AS batting_team,
+            COALESCE(t.bowling_team, d.bowling_team) AS bowling_team,
+            m.format,
+            m.date,
+            COALESCE(t.runs, 0) AS runs,
+            COALESCE(t.balls, 0) AS balls,
+            COALESCE(t.fours, 0) AS fours,
+            COALESCE(t.sixes, 0) AS sixes,
+            COALESCE(t.dots, 0) AS dots,
+            ROUND(COALESCE(t.runs, 0) * 100.0 / NULLIF(t.balls, 0), 2) AS strike_rate,
+            d.batter IS NOT NULL AS is_out,
+            d.wicket_type,
+            d.dismissed_by,
+            t.ball_at_50,
+            t.ball_at_90,
+            t.ball_at_100,
+            COALESCE(t.progression, []::SMALLINT[]) AS progression
+        FROM innings_totals t
+        FULL OUTER JOIN dismissals d
+            ON t.match_id = d.match_id AND t.innings = d.innings AND t.batter = d.batter
+        LEFT JOIN matches m ON m.match_id = COALESCE(t.match_id, d.match_id)
+    """
+    replace_rows(con, "batter_innings", select_sql, match_ids)
+
+
+COMMENTARY_FLAGS = [
+    "length_short", "length_full", "length_good", "line_off", "line_middle", "line_leg",
+    "mention_yorker", "mention_bouncer", "mention_swing", "mention_spin", "mention_beaten",
+    "mention_edge", "mention_mistimed",
+]
+
+
+def build_balls_enriched(con, match_ids=None):
+    """
+    Denormalized commentary table: every ball of the matches that have
+    commentary (the IPL subset), with match attributes and the commentary
+    text, NLP flags and sentiment_score attached. Replaces the 4-column
+    commentary JOIN with a single-table scan. Balls without a commentary
+    entry keep NULL flags and has_commentary = FALSE so rates can use
+    either denominator.
+    """
+    flags = ",\n            ".join(f"c.{flag}" for flag in COMMENTARY_FLAGS)
+    select_sql = f"""
+        WITH commentary_balls AS (
+            SELECT *
+            FROM commentary
+            WHERE cricsheet_match_id IS NOT NULL AND {match_filter(match_ids, "cricsheet_match_id")}
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY cricsheet_match_id, innings, over, ball ORDER BY commentary_id
+            ) = 1
+        )
+        SELECT
+            b.*,
+            m.date,
+            YEAR(m.date) AS season,
+            m.venue,
+            m.city,
+            m.country,
+            m.format,
+            m.gender,
+            m.winner,
+            m.toss_winner,
+            m.toss_decision,
+            c.commentary_id IS NOT NULL AS has_commentary,
+            c.text AS commentary_text,
+            {flags},
+            c.sentiment_score
+        FROM balls b
+        JOIN matches m ON m.match_id = b.match_id
+        LEFT JOIN commentary_balls c
+            ON c.cricsheet_match_id = b.match_id AND c.innings = b.innings
+           AND c.over = b.over AND c.ball = b.ball
+        WHERE b.match_id IN (SELECT DISTINCT cricsheet_match_id FROM commentary_balls)
+    """
+    replace_rows(con, "balls_enriched", select_sql, match_ids)
+
+
+# Lowercase alphanumeric tokens, apostrophes dropped ("Patel's" -> patels).
+# The search macros tokenize queries with the same expression, so positions
+# in the index and in a query line up.
+TOKENIZE_SQL = "list_filter(regexp_split_to_array(replace(lower({}), '''', ''), '[^a-z0-9]+'), t -> t <> '')"
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def build_commentary_index(con, match_ids=None):
+    """
+    Inverted index over commentary.text with positional postings.
+
+    - commentary_docs: dense integer doc_id -> commentary entry, its text and
+      token count, and the ball it describes (with batter/bowler/result, so
+      search hits can be displayed without joining balls)
+    - commentary_terms: term dictionary (term_id, term, document frequency)
+    - commentary_postings: one row per token occurrence (term_id, doc_id, pos),
+      sorted by term_id so zone maps skip everything but the query terms. Flat
+      rows rather than a positions list per document keep phrase matching a
+      plain GROUP BY instead of an UNNEST.
+
+    Two table macros query it: commentary_search(q) ranks entries containing
+    any query term by BM25, and commentary_phrase(q) keeps only entries that
+    contain q as an exact phrase.
+    """
+    docs_sql = f"""
+        SELECT
+            {{first_id}} + ROW_NUMBER() OVER (ORDER BY c.commentary_id)::INTEGER AS doc_id,
+            c.commentary_id,
+            c.cricsheet_match_id AS match_id,
+            c.innings, c.over, c.ball,
+            len({TOKENIZE_SQL.format("c.text")})::INTEGER AS doc_len,
+            c.text,
+            m.date,
+            b.batter, b.bowler, b.runs_off_bat, b.wicket_type
+        FROM commentary c
+        LEFT JOIN matches m ON m.match_id = c.cricsheet_match_id
+        LEFT JOIN balls b ON b.match_id = c.cricsheet_match_id AND b.innings = c.innings
+                         AND b.over = c.over AND b.ball = c.ball
+        WHERE c.text IS NOT NULL AND {match_filter(match_ids, "c.cricsheet_match_id")}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY c.commentary_id) = 1
+    """
+    tokens_sql = f"""
+        SELECT doc_id, UNNEST(tokens) AS term, GENERATE_SUBSCRIPTS(tokens, 1)::SMALLINT AS pos
+        FROM (
+            SELECT d.doc_id, {TOKENIZE_SQL.format("c.text")} AS tokens
+            FROM commentary c JOIN commentary_docs d ON d.commentary_id = c.commentary_id
+            WHERE {match_filter(match_ids, "d.match_id")}
+        )
+    """
+    postings_sql = """
+        SELECT t.term_id, k.doc_id, k.pos
+        FROM index_tokens k JOIN commentary_terms t ON t.term = k.term
+        ORDER BY t.term_id, k.doc_id, k.pos
+    """
+
+    if match_ids is None:
+        con.execute(f"CREATE OR REPLACE TABLE commentary_docs AS {docs_sql.format(first_id=0)}")
+        con.execute(f"CREATE OR REPLACE TEMP TABLE index_tokens AS {tokens_sql}")
+        con.execute("""
+            CREATE OR REPLACE TABLE commentary_terms AS
+            SELECT ROW_NUMBER() OVER (ORDER BY term)::INTEGER AS term_id, term,
+                   COUNT(DISTINCT doc_id)::INTEGER AS df
+            FROM index_tokens
+            GROUP BY term
+        """)
+        con.execute(f"CREATE OR REPLACE TABLE commentary_postings AS {postings_sql}")
+    else:
+        # Drop the refreshed entries (remembering which terms lose a document),
+        # re-add them under new doc_ids and extend the dictionary with new terms
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE touched_terms AS
+            SELECT DISTINCT p.term_id
+            FROM commentary_postings p JOIN commentary_docs d ON d.doc_id = p.doc_id
+            WHERE {match_filter(match_ids, "d.match_id")}
+        """)
+        con.execute(f"""
+            DELETE FROM commentary_postings WHERE doc_id IN (
+                SELECT doc_id FROM commentary_docs WHERE {match_filter(match_ids)}
+            )
+        """)
+        con.execute(f"DELETE FROM commentary_docs WHERE {match_filter(match_ids)}")
+        first_id = "(SELECT COALESCE(MAX(doc_id), 0) FROM commentary_docs)"
+        con.execute(f"INSERT INTO commentary_docs {docs_sql.format(first_id=first_id)}")
+        con.execute(f"CREATE OR REPLACE TEMP TABLE index_tokens AS {tokens_sql}")
+        con.execute("""
+            INSERT INTO commentary_terms
+            SELECT (SELECT COALESCE(MAX(term_id), 0) FROM commentary_terms)
+                   + ROW_NUMBER() OVER (ORDER BY term)::INTEGER, term, 0
+            FROM (SELECT DISTINCT term FROM index_tokens)
+            WHERE term NOT IN (SELECT term FROM commentary_terms)
+        """)
+        con.execute(f"INSERT INTO commentary_postings {postings_sql}")
+        con.execute("""
+            INSERT INTO touched_terms
+            SELECT DISTINCT t.term_id FROM index_tokens k JOIN commentary_terms t ON t.term = k.term
+        """)
+        con.execute("""
+            UPDATE commentary_terms SET df = counts.df
+            FROM (
+                SELECT t.term_id, COUNT(DISTINCT p.doc_id)::INTEGER AS df
+                FROM (SELECT DISTINCT term_id FROM touched_terms) t
+                LEFT JOIN commentary_postings p ON p.term_id = t.term_id
+                GROUP BY t.term_id
+            ) counts
+            WHERE commentary_terms.term_id = counts.term_id
+        """)
+    con.execute("DROP TABLE IF EXISTS index_tokens")
+
+    query_tokens = TOKENIZE_SQL.format("q")
+    con.execute(f"""
+        CREATE OR REPLACE MACRO commentary_search(q) AS TABLE
+        WITH query_terms AS (
+            SELECT term_id, df FROM commentary_terms WHERE term IN (SELECT UNNEST({query_tokens}))
+        ),
+        stats AS (
+            SELECT COUNT(*) AS n_docs, AVG(doc_len) AS avg_len FROM commentary_docs
+        ),
+        matched AS (
+            SELECT p.term_id, p.doc_id, COUNT(*) AS tf
+            FROM commentary_postings p JOIN query_terms t ON p.term_id = t.term_id
+            GROUP BY p.term_id, p.doc_id
+        ),
+        scored AS (
+            SELECT
+                m.doc_id,
+                SUM(
+                    LN(1 + (s.n_docs - t.df + 0.5) / (t.df + 0.5))
+                    * m.tf * ({BM25_K1} + 1)
+                    / (m.tf + {BM25_K1} * (1 - {BM25_B} + {BM25_B} * d.doc_len / s.avg_len))
+                ) AS score,
+                COUNT(*) AS matched_terms
+            FROM matched m
+            JOIN query_terms t ON t.term_id = m.term_id
+            JOIN commentary_docs d ON d.doc_id = m.doc_id
+            CROSS JOIN stats s
+            GROUP BY m.doc_id
+        )
+        SELECT d.doc_id, d.commentary_id, d.match_id, d.innings, d.over, d.ball, s.score, s.matched_terms
+        FROM scored s JOIN commentary_docs d ON d.doc_id = s.doc_id
+    """)
+    # A phrase occurrence is a start offset at which every query token sits at
+    # its own position: group postings by (doc, pos - token index) and keep the
+    # groups covering all tokens.
+    con.execute(f"""
+        CREATE OR REPLACE MACRO commentary_phrase(q) AS TABLE
+        WITH query_terms AS (
+            SELECT t.term_id, q.qi
+            FROM (
+                SELECT UNNEST(tokens) AS term, GENERATE_SUBSCRIPTS(tokens, 1) AS qi
+                FROM (SELECT {query_tokens} AS tokens)
+            ) q
+            JOIN commentary_terms t ON t.term = q.term
+        ),
+        occurrences AS (
+            SELECT p.doc_id, p.pos - t.qi AS start
+            FROM commentary_postings p JOIN query_terms t ON p.term_id = t.term_id
+            GROUP BY p.doc_id, start
+            HAVING COUNT(DISTINCT t.qi) = len({query_tokens})
+        )
+        SELECT s.*, o.phrase_tf
+        FROM commentary_search(q) s
+        JOIN (SELECT doc_id, COUNT(*) AS phrase_tf FROM occurrences GROUP BY doc_id) o
+            ON o.doc_id = s.doc_id
+    """)
+
+
+# Share of each (format, season) stratum kept in balls_sample, and the number
+# of interleaved replicate groups used to estimate its sampling error
+SAMPLE_RATE = 0.05
+SAMPLE_REPLICATES = 10
+
+
+def build_balls_sample(con, match_ids=None):
+    """
+    Proportional stratified sample of `balls` for approximate answers: the
+    same SAMPLE_RATE of every (format, season) stratum, chosen by a hash of
+    the ball key so rebuilds are deterministic. Columns are exactly those of
+    `balls` (so queries can swap the table name) plus sample_replicate, which
+    splits each stratum into SAMPLE_REPLICATES equal random groups.
+    balls_sample_info records the rate for the API.
+
+    An incremental refresh re-samples only the strata of the refreshed matches.
+    """
+    strata_filter = "TRUE"
+    if match_ids is not None:
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE refresh_strata AS
+            SELECT DISTINCT format, YEAR(date) AS season FROM matches WHERE {match_filter(match_ids)}
+        """)
+        strata_filter = "(m.format, YEAR(m.date)) IN (SELECT (format, season) FROM refresh_strata)"
+
+    select_sql = f"""
+        SELECT * EXCLUDE (stratum_rank, stratum_size),
+               (stratum_rank % {SAMPLE_REPLICATES})::TINYINT AS sample_replicate
+        FROM (
+            SELECT
+                b.*,
+                ROW_NUMBER() OVER stratum AS stratum_rank,
+                COUNT(*) OVER (PARTITION BY m.format, YEAR(m.date)) AS stratum_size
+            FROM balls b
+            LEFT JOIN matches m ON m.match_id = b.match_id
+            WHERE {strata_filter}
+            WINDOW stratum AS (
+                PARTITION BY m.format, YEAR(m.date)
+                ORDER BY HASH(b.match_id, b.innings, b.over, b.ball), b.match_id, b.innings, b.over, b.ball
+            )
+        )
+        WHERE stratum_rank <= CEIL(stratum_size * {SAMPLE_RATE})
+    """
+    if match_ids is None:
+        con.execute(f"CREATE OR REPLACE TABLE balls_sample AS {select_sql}")
+    else:
+        con.execute(f"""
+            DELETE FROM balls_sample WHERE match_id IN (
+                SELECT m.match_id FROM matches m WHERE {strata_filter}
+            )
+        """)
+        con.execute(f"INSERT INTO balls_sample {select_sql}")
+
+    con.execute(f"""
+        CREATE OR REPLACE TABLE balls_sample_info AS
+        SELECT
+            {SAMPLE_RATE}::DOUBLE AS sample_rate,
+            {SAMPLE_REPLICATES}::INTEGER AS replicates,
+            (SELECT COUNT(*) FROM balls_sample) AS sample_rows,
+            (SELECT COUNT(*) FROM balls) AS population_rows
+    """)
+
+
+def build_matchups(con, match_ids=None):
+    """
+    Batter-vs-bowler matchup matrix: one row per (batter, bowler, format)
+    with balls faced (wides excluded), runs, dismissals credited to the
+    bowler, dots, fours and sixes. Rows are stored sorted by batter, bowler
+    and format; the API loads them into arrays for the /matchup endpoint.
+
+    An incremental refresh recomputes every pair that faced off in the
+    refreshed matches (their totals span all matches, not just the new ones).
+    """
+    select_sql = """
+        SELECT b.batter, b.bowler, m.format,
+               COUNT(*) FILTER (WHERE COALESCE(b.extra_type, '') NOT IN ('wides', 'wide'))::INTEGER AS balls_faced,
+               SUM(b.runs_off_bat)::INTEGER AS runs,
+               COUNT(*) FILTER (
+                   WHERE b.dismissed_batter = b.batter AND b.wicket_type NOT IN
+                       ('run out', 'retired hurt', 'retired out', 'retired not out', 'obstructing the field')
+               )::INTEGER AS dismissals,
+               COUNT(*) FILTER (WHERE b.total_runs = 0)::INTEGER AS dots,
+               COUNT(*) FILTER (WHERE b.runs_off_bat = 4)::INTEGER AS fours,
+               COUNT(*) FILTER (WHERE b.runs_off_bat = 6)::INTEGER AS sixes
+        FROM balls b JOIN matches m ON m.match_id = b.match_id
+        WHERE b.batter IS NOT NULL AND b.bowler IS NOT NULL AND m.format IS NOT NULL AND {pairs}
+        GROUP BY b.batter, b.bowler, m.format
+        ORDER BY b.batter, b.bowler, m.format
+    """
+    if match_ids is None:
+        con.execute(f"CREATE OR REPLACE TABLE matchups AS {select_sql.format(pairs='TRUE')}")
+        return
+
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE refresh_pairs AS
+        SELECT DISTINCT batter, bowler FROM balls WHERE {match_filter(match_ids)}
+    """)
+    pairs = "(b.batter, b.bowler) IN (SELECT (batter, bowler) FROM refresh_pairs)"
+    con.execute("DELETE FROM matchups WHERE (batter, bowler) IN (SELECT (batter, bowler) FROM refresh_pairs)")
+    con.execute(f"INSERT INTO matchups {select_sql.format(pairs=pairs)}")
+
+
+# match_cube dimensions, in the order grouped_by lists them
+CUBE_DIMENSIONS = ("venue", "country", "format", "gender", "season", "decade", "toss_decision")
+
+
+def cube_grouping_sets() -> list:
+    """
+    Every combination of at most one location (venue or country), at most
+    one period (season or decade), and optional format, gender and toss
+    decision: 72 grouping sets, the grand total included.
+    """
+    sets = []
+    for location in (None, "venue", "country"):
+        for period in (None, "season", "decade"):
+            for toss in (False, True):
+                for by_format in (False, True):
+                    for by_gender in (False, True):
+                        chosen = {location, period, "toss_decision" if toss else None,
+                                  "format" if by_format else None, "gender" if by_gender else None}
+                        sets.append([d for d in CUBE_DIMENSIONS if d in chosen])
+    return sets
+
+
+def build_match_cube(con, match_ids=None):
+    """
+    Match-level OLAP cube for venue, toss and result questions: one row per
+    cell of cube_grouping_sets() with matches, decided matches, wins for the
+    side batting first and for the side batting second ("chasing"), wins
+    for the toss winner, and average first/second-innings totals. grouped_by
+    names the dimensions of the row's grouping set ('' for the grand total),
+    so a question is a point lookup on grouped_by plus dimension values.
+
+    The cube has a few hundred thousand rows at most and rebuilds in
+    seconds, so an incremental refresh rebuilds it in full.
+    """
+    grouping_sets = ", ".join(f"({', '.join(dims)})" for dims in cube_grouping_sets())
+    grouped_by = ", ".join(f"CASE WHEN GROUPING({d}) = 0 THEN '{d}' END" for d in CUBE_DIMENSIONS)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE match_cube AS
+        WITH innings_totals AS (
+            SELECT match_id,
+                   MAX(cumulative_runs) FILTER (WHERE innings = 1) AS first_innings,
+                   MAX(cumulative_runs) FILTER (WHERE innings = 2) AS second_innings,
+                   ANY_VALUE(batting_team) FILTER (WHERE innings = 1) AS batting_first
+            FROM balls
+            GROUP BY match_id
+        ), per_match AS (
+            SELECT m.venue, m.country, m.format, m.gender,
+                   YEAR(m.date) AS season, (YEAR(m.date) // 10 * 10) AS decade, m.toss_decision,
+                   m.winner, m.toss_winner, t.batting_first, t.first_innings, t.second_innings
+            FROM matches m
+            LEFT JOIN innings_totals t ON t.match_id = m.match_id
+        )
+        SELECT {", ".join(CUBE_DIMENSIONS)},
+               CONCAT_WS(',', {grouped_by}) AS grouped_by,
+               COUNT(*)::INTEGER AS matches,
+               COUNT(winner)::INTEGER AS decided,
+               COUNT(*) FILTER (WHERE winner = batting_first)::INTEGER AS bat_first_wins,
+               COUNT(*) FILTER (WHERE winner <> batting_first)::INTEGER AS chasing_wins,
+               COUNT(*) FILTER (WHERE winner = toss_winner)::INTEGER AS toss_winner_wins,
+               ROUND(AVG(first_innings), 1) AS avg_first_innings,
+               ROUND(AVG(second_innings), 1) AS avg_second_innings
+        FROM per_match
+        GROUP BY GROUPING SETS ({grouping_sets})
+        ORDER BY grouped_by, {", ".join(CUBE_DIMENSIONS)}
+    """)
+
+
+# Name -> builder, in dependency order
+DERIVED_TABLES = {
+    "batter_innings": build_batter_innings,
+    "balls_enriched": build_balls_enriched,
+    "commentary_postings": build_commentary_index,
+    "balls_sample": build_balls_sample,
+    "matchups": build_matchups,
+    "match_cube": build_match_cube,
+}
+
+# Extra tables a builder creates besides the one it is registered under
+DERIVED_TABLE_PARTS = {
+    "commentary_postings": ["commentary_docs", "commentary_terms"],
+    "balls_sample": ["balls_sample_info"],
+}
+
+
+def derived_table_names() -> set:
+    """Every table the builders create."""
+    return set(DERIVED_TABLES).union(*DERIVED_TABLE_PARTS.values())
+
+
+def build(con, tables=None, match_ids=None, verbose: bool = True) -> dict:
+    """
+    Builds the given derived tables (all by default), in full or only for
+    match_ids. Returns seconds taken per table.
+    """
+    if match_ids is not None:
+        stage_match_ids(con, match_ids)
+
+    timings = {}
+    for name, builder in DERIVED_TABLES.items():
+        if tables and name not in tables:
+            continue
+        start = time.perf_counter()
+        builder(con, match_ids)
+        timings[name] = time.perf_counter() - start
+        if verbose:
+            rows = con.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+            print(f"  {name}: {rows:,} rows in {timings[name]:.1f}s")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="cricket_analytics.duckdb")
+    parser.add_argument("--tables", nargs="*", choices=list(DERIVED_TABLES), help="default: all")
+    args = parser.parse_args()
+
+    con = duckdb.connect(args.db)
+    try:
+        print(f"Building derived tables in {args.db}")
+        build(con, args.tables)
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
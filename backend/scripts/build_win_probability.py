@@ -0,0 +1,214 @@
+"""
+Builds the win-probability grid behind GET /matches/{match_id}/win-probability.
+
+Every decided limited-overs chase contributes its state after each delivery
+(runs still needed, legal balls left, wickets down) and whether the chasing
+side won. The counts go into one dense grid per format (runs needed x balls
+left x wickets), are smoothed over neighbouring run/ball cells and shrunk
+toward a wider-smoothed estimate where data is thin, then made monotone:
+needing more runs or having lost more wickets never raises the chance,
+having more balls left never lowers it. Monotonicity comes from weighted
+isotonic regression along each axis in turn, so a thinly observed cell that
+breaks the order is pooled with its well-observed neighbours rather than
+capping every cell behind it. A calibration table (predicted against
+observed win rate, by predicted bin) is printed for each grid. The grids
+are stored as float16 in a single .npz file, which the API loads at startup.
+
+Usage (from backend/):
+    python scripts/build_win_probability.py --db cricket_analytics.duckdb --out win_probability.npz
+"""
+import argparse
+import time
+
+import duckdb
+import numpy as np
+
+# Grid name -> (Cricsheet formats, balls per innings, most runs needed kept)
+GRID_FORMATS = {
+    "T20": (("T20", "IT20"), 120, 300),
+    "ODI": (("ODI", "ODM"), 300, 500),
+}
+WICKETS = 10
+RUN_RADIUS, BALL_RADIUS = 2, 3  # half-widths of the smoothing box, in runs and balls
+PRIOR_SCALE = 4                 # the prior is smoothed PRIOR_SCALE times wider
+PRIOR_STRENGTH = 5.0            # pseudo-observations the prior is worth in each cell
+ISOTONIC_PASSES = 10            # most rounds of per-axis isotonic regression
+ISOTONIC_TOLERANCE = 1e-4       # stop once a round moves no cell by more than this
+ANCHOR_WEIGHT = 1e9             # weight of the fixed won / lost cells
+CALIBRATION_BINS = 10
+
+ILLEGAL_EXTRAS = "('wides', 'wide', 'noballs', 'noball')"
+
+
+def chase_states(con, formats: tuple, max_balls: int) -> dict:
+    """State after every second-innings delivery of decided chases (plus each chase's start)."""
+    format_list = ", ".join(f"'{f}'" for f in formats)
+    return con.execute(f"""
+        WITH chases AS (
+            SELECT m.match_id, MAX(b.cumulative_runs) + 1 AS target, m.winner
+            FROM matches m JOIN balls b ON b.match_id = m.match_id AND b.innings = 1
+            WHERE m.format IN ({format_list}) AND m.winner IS NOT NULL
+            GROUP BY m.match_id, m.winner
+        )
+        SELECT c.target - b.cumulative_runs AS runs_needed,
+               {max_balls} - COUNT(*) FILTER (WHERE COALESCE(b.extra_type, '') NOT IN {ILLEGAL_EXTRAS}) OVER (
+                   PARTITION BY b.match_id ORDER BY b.over, b.ball ROWS UNBOUNDED PRECEDING
+               ) AS balls_left,
+               b.wickets_fallen AS wickets,
+               (b.batting_team = c.winner)::DOUBLE AS won
+        FROM balls b JOIN chases c ON c.match_id = b.match_id
+        WHERE b.innings = 2
+        UNION ALL
+        SELECT c.target, {max_balls}, 0, (ANY_VALUE(b.batting_team) = c.winner)::DOUBLE
+        FROM chases c JOIN balls b ON b.match_id = c.match_id AND b.innings = 2
+        GROUP BY c.match_id, c.target, c.winner
+    """).fetchnumpy()
+
+
+def box_sum(a: np.ndarray, radius: int, axis: int) -> np.ndarray:
+    """Sum over a window of +-radius cells along axis (zero beyond the edges)."""
+    if radius == 0:
+        return a
+    a = np.moveaxis(a, axis, 0)
+    padded = np.pad(a, [(radius + 1, radius)] + [(0, 0)] * (a.ndim - 1))
+    totals = np.cumsum(padded, axis=0)
+    return np.moveaxis(totals[2 * radius + 1:] - totals[:-2 * radius - 1], 0, axis)
+
+
+def smooth(a: np.ndarray, scale: int = 1) -> np.ndarray:
+    return box_sum(box_sum(a, RUN_RADIUS * scale, 0), BALL_RADIUS * scale, 1)
+
+
+def isotonic_lines(values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Weighted non-increasing fit of each row (pool adjacent violators): a run
+    of cells out of order is replaced by its weighted mean. Rows already in
+    order are left untouched.
+    """
+    out = values.copy()
+    for i in np.flatnonzero((np.diff(values, axis=1) > 0).any(axis=1)):
+        means, totals, sizes = [], [], []
+        for value, weight in zip(values[i].tolist(), weights[i].tolist()):
+            mean, total, size = value, weight, 1
+            while means and means[-1] < mean:
+                prev_mean, prev_total = means.pop(), totals.pop()
+                mean = (prev_mean * prev_total + mean * total) / (prev_total + total)
+                total += prev_total
+                size += sizes.pop()
+            means.append(mean)
+            totals.append(total)
+            sizes.append(size)
+        out[i] = np.repeat(means, sizes)
+    return out
+
+
+def isotonic_axis(prob: np.ndarray, weights: np.ndarray, axis: int, increasing: bool) -> np.ndarray:
+    """Weighted isotonic regression along one axis of the grid."""
+    def lines(a):
+        a = np.moveaxis(a, axis, -1)
+        return a[..., ::-1] if increasing else a
+    shape = lines(prob).shape
+    fitted = isotonic_lines(lines(prob).reshape(-1, shape[-1]), lines(weights).reshape(-1, shape[-1]))
+    fitted = fitted.reshape(shape)
+    return np.moveaxis(fitted[..., ::-1] if increasing else fitted, -1, axis)
+
+
+def make_monotone(prob: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Non-increasing in runs needed and wickets, non-decreasing in balls left.
+    Per-axis weighted isotonic fits alternate until they stop moving; the
+    closing cumulative min/max only removes what is left of the violations.
+    """
+    for _ in range(ISOTONIC_PASSES):
+        previous = prob
+        prob = isotonic_axis(prob, weights, 0, increasing=False)
+        prob = isotonic_axis(prob, weights, 1, increasing=True)
+        prob = isotonic_axis(prob, weights, 2, increasing=False)
+        if np.abs(prob - previous).max() < ISOTONIC_TOLERANCE:
+            break
+    # Cumulative min/max keep the orderings along the other axes intact
+    prob = np.minimum.accumulate(prob, axis=0)
+    prob = np.maximum.accumulate(prob, axis=1)
+    return np.minimum.accumulate(prob, axis=2)
+
+
+def live_states(states: dict, max_runs: int) -> tuple:
+    """(runs needed, balls left, wickets, won) for unfinished states; finished ones are fixed by the lookup."""
+    runs, balls, wickets = states["runs_needed"], states["balls_left"], states["wickets"]
+    live = (runs > 0) & (balls > 0) & (wickets < WICKETS)
+    return np.minimum(runs[live], max_runs), balls[live], wickets[live], states["won"][live]
+
+
+def fit_grid(states: dict, max_balls: int, max_runs: int) -> tuple:
+    """Win probability per (runs needed, balls left, wickets), and the raw counts."""
+    runs, balls, wickets, won = live_states(states, max_runs)
+
+    shape = (max_runs + 1, max_balls + 1, WICKETS)
+    index = np.ravel_multi_index((runs, balls, wickets), shape)
+    counts = np.bincount(index, minlength=np.prod(shape)).reshape(shape).astype(np.float64)
+    wins = np.bincount(index, weights=won, minlength=np.prod(shape)).reshape(shape)
+
+    prior = (smooth(wins, PRIOR_SCALE) + 0.5) / (smooth(counts, PRIOR_SCALE) + 1.0)
+    observed = smooth(counts)
+    prob = (smooth(wins) + PRIOR_STRENGTH * prior) / (observed + PRIOR_STRENGTH)
+    # Each cell counts in the isotonic fit by the observations behind it
+    weights = observed + PRIOR_STRENGTH
+
+    # Anchors: nothing needed is a win; out of balls, or beyond six a ball, is a loss
+    runs_axis = np.arange(max_runs + 1)[:, None, None]
+    balls_axis = np.arange(max_balls + 1)[None, :, None]
+    impossible = np.broadcast_to(runs_axis > 6 * balls_axis, prob.shape)
+    prob = np.where(impossible, 0.0, prob)
+    prob[0] = 1.0
+    weights = np.where(impossible, ANCHOR_WEIGHT, weights)
+    weights[0] = ANCHOR_WEIGHT
+
+    return make_monotone(prob, weights).astype(np.float16), counts
+
+
+def calibration(grid: np.ndarray, states: dict, max_runs: int) -> list:
+    """(mean predicted, observed win rate, states) per predicted-probability bin, over the live states."""
+    runs, balls, wickets, won = live_states(states, max_runs)
+    predicted = grid[runs, balls, wickets].astype(np.float64)
+    bins = np.minimum((predicted * CALIBRATION_BINS).astype(int), CALIBRATION_BINS - 1)
+    table = []
+    for b in range(CALIBRATION_BINS):
+        in_bin = bins == b
+        if in_bin.any():
+            table.append((predicted[in_bin].mean(), won[in_bin].mean(), int(in_bin.sum())))
+    return table
+
+
+def build(db_path: str, out_path: str):
+    con = duckdb.connect(db_path, read_only=True)
+    arrays = {}
+    try:
+        for name, (formats, max_balls, max_runs) in GRID_FORMATS.items():
+            start = time.perf_counter()
+            states = chase_states(con, formats, max_balls)
+            grid, counts = fit_grid(states, max_balls, max_runs)
+            arrays[f"{name}_grid"] = grid
+            arrays[f"{name}_formats"] = np.array(formats)
+            print(f"  {name}: {len(states['won']):,} states, {int((counts > 0).sum()):,} of {counts.size:,} "
+                  f"cells observed, {grid.nbytes / 1024:.0f} KB in {time.perf_counter() - start:.1f}s")
+            print(f"    {'predicted':>9}  {'observed':>8}  {'states':>9}")
+            for predicted, observed, n in calibration(grid, states, max_runs):
+                print(f"    {predicted:9.3f}  {observed:8.3f}  {n:9,}")
+    finally:
+        con.close()
+    np.savez_compressed(out_path, **arrays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="cricket_analytics.duckdb")
+    parser.add_argument("--out", default="win_probability.npz")
+    args = parser.parse_args()
+
+    print(f"Building win-probability grids from {args.db}")
+    build(args.db, args.out)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,499 @@
+"""
+Cricsheet ingestion with a zero-downtime snapshot swap.
+
+The API keeps cricket_analytics.duckdb open read-only, so the live file is
+never written to. Every run builds a new snapshot file next to it
+(cricket_analytics.<timestamp>.duckdb) and finally re-points --db at it
+atomically (a symlink replaced by rename; a plain file is converted on the
+first run). Queries already running keep reading the old snapshot, and the
+next connection the API opens resolves the link to the new one. The newest
+--keep snapshots are kept for rollback (re-point the link by hand). Needs
+POSIX rename/symlink semantics; on Windows stop the API first.
+
+Incremental (default): Cricsheet match files whose match_id is not in
+`matches` yet are appended to a copy of the live database (no copy is made
+when there are none), and derived tables
+(scripts/build_derived_tables.py) are refreshed only for the new match_ids.
+In a database in keyed storage (scripts/build_compact_storage.py) the new
+deliveries are appended to `balls_keyed`, new names getting the next keys.
+Files that fail to parse are recorded in a skip list next to --db
+(cricket_analytics.ingest_errors.json: path -> mtime and error) and are not
+counted as new again until the file changes. --dry-run parses the new files
+and reports what would be appended, without copying anything.
+
+Bulk (--bulk): `matches` and `balls` are rebuilt from every file in --data.
+Files are parsed on a process pool in batches; each batch becomes column
+arrays, phase / cumulative_runs / wickets_fallen are derived with NumPy, and
+the batch is appended through Arrow in one INSERT per table. Other tables
+(commentary) are copied from the live database, and the derived tables it
+had are rebuilt in full. A database in keyed storage is re-encoded at the
+end, keeping the keys of its players and teams.
+
+Usage (from backend/):
+    python scripts/ingest_cricsheet.py --db cricket_analytics.duckdb --data data/raw/cricsheet
+    python scripts/ingest_cricsheet.py --db cricket_analytics.duckdb --data new_matches/ --dry-run
+    python scripts/ingest_cricsheet.py --db cricket_analytics.duckdb --data data/raw/cricsheet --bulk --dry-run
+    python scripts/ingest_cricsheet.py --db cricket_analytics.duckdb --data data/raw/cricsheet --bulk --workers 8
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import duckdb
+import numpy as np
+import pyarrow as pa
+
+from build_compact_storage import KEYED_TABLE, append_keyed, compact_database, is_compact
+from build_derived_tables import DERIVED_TABLES, build, derived_table_names, match_filter, stage_match_ids
+
+# (powerplay end, middle end) in overs by Cricsheet match_type; others have no phases
+PHASE_OVERS = {"T20": (6, 15), "IT20": (6, 15), "ODI": (10, 40), "ODM": (10, 40)}
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS matches (
+    match_id VARCHAR, date DATE, venue VARCHAR, city VARCHAR, country VARCHAR,
+    format VARCHAR, gender VARCHAR, team1 VARCHAR, team2 VARCHAR, winner VARCHAR,
+    toss_winner VARCHAR, toss_decision VARCHAR, player_of_match VARCHAR
+);
+CREATE TABLE IF NOT EXISTS balls (
+    match_id VARCHAR, innings INTEGER, over INTEGER, ball INTEGER,
+    batter VARCHAR, non_striker VARCHAR, bowler VARCHAR,
+    batting_team VARCHAR, bowling_team VARCHAR,
+    runs_off_bat INTEGER, extras INTEGER, total_runs INTEGER,
+    extra_type VARCHAR, wicket_type VARCHAR, dismissed_batter VARCHAR,
+    phase VARCHAR, cumulative_runs INTEGER, wickets_fallen INTEGER
+);
+"""
+CRICSHEET_TABLES = {"matches", "balls"}
+
+MATCH_COLUMNS = [
+    "match_id", "date", "venue", "city", "country", "format", "gender", "team1", "team2",
+    "winner", "toss_winner", "toss_decision", "player_of_match",
+]
+# Per-delivery fields read from the JSON; the rest of `balls` is derived per batch
+DELIVERY_COLUMNS = [
+    "innings", "over", "ball", "batter", "non_striker", "bowler", "batting_team", "bowling_team",
+    "runs_off_bat", "extras", "total_runs", "extra_type", "wicket_type", "dismissed_batter", "wickets",
+]
+INT_COLUMNS = {"innings", "over", "ball", "runs_off_bat", "extras", "total_runs", "wickets"}
+
+BATCH_SIZE = 250  # files per process-pool task / INSERT
+
+
+def parse_match(path: str):
+    """
+    Parses one Cricsheet JSON file into a `matches` row and per-delivery
+    column lists. The match_id is the file name, as on cricsheet.org.
+    Super overs are skipped.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    info = data["info"]
+    teams = info["teams"]
+
+    match = {
+        "match_id": os.path.splitext(os.path.basename(path))[0],
+        "date": info["dates"][0],
+        "venue": info.get("venue"),
+        "city": info.get("city"),
+        "country": None,  # not in Cricsheet; filled from other matches at the venue
+        "format": info["match_type"],
+        "gender": info.get("gender"),
+        "team1": teams[0],
+        "team2": teams[1],
+        "winner": info.get("outcome", {}).get("winner"),
+        "toss_winner": info.get("toss", {}).get("winner"),
+        "toss_decision": info.get("toss", {}).get("decision"),
+        "player_of_match": (info.get("player_of_match") or [None])[0],
+    }
+
+    columns = {name: [] for name in DELIVERY_COLUMNS}
+    innings_number = 0
+    for innings in data["innings"]:
+        if innings.get("super_over"):
+            continue
+        innings_number += 1
+        batting_team = innings["team"]
+        bowling_team = next((t for t in teams if t != batting_team), None)
+        for over in innings.get("overs", []):
+            for ball_number, delivery in enumerate(over["deliveries"], start=1):
+                runs = delivery["runs"]
+                wickets = delivery.get("wickets", [])
+                columns["innings"].append(innings_number)
+                columns["over"].append(over["over"])
+                columns["ball"].append(ball_number)
+                columns["batter"].append(delivery["batter"])
+                columns["non_striker"].append(delivery["non_striker"])
+                columns["bowler"].append(delivery["bowler"])
+                columns["batting_team"].append(batting_team)
+                columns["bowling_team"].append(bowling_team)
+                columns["runs_off_bat"].append(runs["batter"])
+                columns["extras"].append(runs["extras"])
+                columns["total_runs"].append(runs["total"])
+                columns["extra_type"].append(next(iter(delivery.get("extras", {})), None))
+                columns["wicket_type"].append(wickets[0]["kind"] if wickets else None)
+                columns["dismissed_batter"].append(wickets[0]["player_out"] if wickets else None)
+                columns["wickets"].append(len(wickets))
+    return match, columns
+
+
+def derive_columns(balls: dict, match_index: np.ndarray, formats: list):
+    """
+    Adds the derived `balls` columns to a batch, in place: phase from the
+    format's over boundaries, and cumulative_runs / wickets_fallen as running
+    totals within each innings (including the current ball). Deliveries are
+    contiguous per (match, innings).
+    """
+    innings_key = match_index * 16 + balls["innings"]
+    new_innings = np.ones(len(innings_key), dtype=bool)
+    new_innings[1:] = innings_key[1:] != innings_key[:-1]
+    starts = np.flatnonzero(new_innings)
+    group = np.cumsum(new_innings) - 1
+
+    def running_total(values):
+        totals = np.cumsum(values)
+        return (totals - (totals[starts] - values[starts])[group]).astype(np.int32)
+
+    balls["cumulative_runs"] = running_total(balls["total_runs"])
+    balls["wickets_fallen"] = running_total(balls["wickets"])
+
+    bounds = np.array([PHASE_OVERS.get(f, (-1, -1)) for f in formats] or [(-1, -1)])[match_index]
+    over = balls["over"]
+    phase = np.where(over < bounds[:, 0], "powerplay", np.where(over < bounds[:, 1], "middle", "death"))
+    balls["phase"] = np.where(bounds[:, 0] < 0, None, phase.astype(object))
+
+
+def parse_batch(paths: list) -> dict:
+    """
+    Parses a batch of files into column arrays (runs in a worker process).
+    Returns {"matches": {col: list}, "balls": {col: array}, "errors": {match_id: message}}.
+    """
+    matches = {name: [] for name in MATCH_COLUMNS}
+    balls = {name: [] for name in DELIVERY_COLUMNS}
+    ball_match_index = []
+    errors = {}
+    for path in paths:
+        try:
+            match, columns = parse_match(path)
+        except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+            errors[os.path.splitext(os.path.basename(path))[0]] = f"{type(e).__name__}: {e}"
+            continue
+        for name in MATCH_COLUMNS:
+            matches[name].append(match[name])
+        for name in DELIVERY_COLUMNS:
+            balls[name].extend(columns[name])
+        ball_match_index.extend([len(matches["match_id"]) - 1] * len(columns["innings"]))
+
+    match_index = np.asarray(ball_match_index, dtype=np.int64)
+    for name in INT_COLUMNS:
+        balls[name] = np.asarray(balls[name], dtype=np.int32)
+    derive_columns(balls, match_index, matches["format"])
+    balls["match_id"] = np.asarray(matches["match_id"], dtype=object)[match_index]
+    del balls["wickets"]
+    return {"matches": matches, "balls": balls, "errors": errors}
+
+
+def load_batch(con, batch: dict):
+    """
+    Appends a parsed batch to `matches` and `balls`, one Arrow INSERT per
+    table (to balls_keyed in keyed storage).
+    """
+    if not batch["matches"]["match_id"]:
+        return
+    new_matches = pa.table(batch["matches"])
+    new_balls = pa.table({name: pa.array(values) for name, values in batch["balls"].items()})
+    con.register("new_matches", new_matches)
+    con.register("new_balls", new_balls)
+    con.execute("INSERT INTO matches BY NAME SELECT * REPLACE (date::DATE AS date) FROM new_matches")
+    if is_compact(con):
+        append_keyed(con, "new_balls")
+    else:
+        con.execute("INSERT INTO balls BY NAME SELECT * FROM new_balls")
+    con.unregister("new_matches")
+    con.unregister("new_balls")
+
+
+def error_log_path(db_path: str) -> str:
+    return f"{os.path.splitext(db_path)[0]}.ingest_errors.json"
+
+
+def read_error_log(db_path: str) -> dict:
+    """Skip list of files that failed to parse: absolute path -> {"mtime", "error"}."""
+    try:
+        with open(error_log_path(db_path), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def record_errors(db_path: str, errors: dict, paths: dict):
+    """
+    Adds this run's parse errors ({match_id: message}, with match_id -> path)
+    to the skip list, dropping entries for files that no longer exist.
+    """
+    log = {path: entry for path, entry in read_error_log(db_path).items() if os.path.exists(path)}
+    for match_id, message in errors.items():
+        path = os.path.abspath(paths[match_id])
+        log[path] = {"mtime": os.path.getmtime(path), "error": message}
+    tmp_path = error_log_path(db_path) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(log, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, error_log_path(db_path))
+
+
+def find_new_matches(con, data_dir: str, skip: dict = None) -> dict:
+    """
+    match_id -> path for the JSON files in data_dir not yet in `matches`,
+    leaving out files in the skip list that have not changed since they failed.
+    """
+    skip = skip or {}
+    paths = {
+        os.path.splitext(os.path.basename(p))[0]: p
+        for p in glob.glob(os.path.join(data_dir, "*.json"))
+    }
+    existing = {row[0] for row in con.execute("SELECT match_id FROM matches").fetchall()}
+    return {
+        match_id: path for match_id, path in sorted(paths.items())
+        if match_id not in existing
+        and skip.get(os.path.abspath(path), {}).get("mtime") != os.path.getmtime(path)
+    }
+
+
+def append_matches(con, paths: dict) -> dict:
+    """
+    Parses the given files and appends them to `matches` and `balls`.
+    Returns {"match_ids": [...], "balls": n, "errors": {match_id: message}}.
+    """
+    batch = parse_batch(list(paths.values()))
+    load_batch(con, batch)
+    return {
+        "match_ids": batch["matches"]["match_id"],
+        "balls": len(batch["balls"]["match_id"]),
+        "errors": batch["errors"],
+    }
+
+
+def fill_countries(con, match_ids=None, source: str = "matches"):
+    """Cricsheet has no country: copy it from matches at the same venue in `source`."""
+    if match_ids is not None:
+        stage_match_ids(con, match_ids)
+    con.execute(f"""
+        UPDATE matches SET country = v.country
+        FROM (
+            SELECT venue, ANY_VALUE(country) AS country
+            FROM {source} WHERE country IS NOT NULL GROUP BY venue
+        ) v
+        WHERE matches.venue = v.venue AND matches.country IS NULL
+          AND {match_filter(match_ids, "matches.match_id")}
+    """)
+
+
+def table_names(con, catalog: str = None) -> set:
+    sql = "SELECT table_name FROM information_schema.tables"
+    if catalog:
+        sql += f" WHERE table_catalog = '{catalog}'"
+    return {row[0] for row in con.execute(sql).fetchall()}
+
+
+def existing_derived_tables(con, catalog: str = None) -> list:
+    """Derived tables already built in this database (only those get refreshed)."""
+    tables = table_names(con, catalog)
+    return [name for name in DERIVED_TABLES if name in tables]
+
+
+def new_snapshot_path(db_path: str) -> str:
+    return f"{os.path.splitext(db_path)[0]}.{time.strftime('%Y%m%d%H%M%S')}.duckdb"
+
+
+def publish_snapshot(db_path: str, snapshot_path: str):
+    """Atomically points db_path at snapshot_path (a relative symlink in the same directory)."""
+    link = f"{db_path}.swap"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(snapshot_path), link)
+    os.replace(link, db_path)
+
+
+def prune_snapshots(db_path: str, keep: int):
+    """Deletes all but the newest `keep` snapshots (never the live one)."""
+    live = os.path.realpath(db_path)
+    base = os.path.splitext(db_path)[0]
+    snapshots = sorted(glob.glob(f"{glob.escape(base)}.*.duckdb"), reverse=True)
+    for path in snapshots[keep:]:
+        if os.path.realpath(path) != live:
+            os.remove(path)
+            print(f"  removed old snapshot {os.path.basename(path)}")
+
+
+def finish_snapshot(db_path: str, snapshot_path: str, swap: bool, keep: int):
+    """Swaps the snapshot in, or discards it."""
+    if swap:
+        publish_snapshot(db_path, snapshot_path)
+        print(f"{db_path} -> {os.path.basename(snapshot_path)}")
+        prune_snapshots(db_path, keep)
+    else:
+        os.remove(snapshot_path)
+        print("Nothing swapped")
+
+
+def recompact(snapshot_path: str):
+    """Re-encodes a snapshot into keyed storage (scripts/build_compact_storage.py) under the same path."""
+    plain_path = f"{snapshot_path}.plain"
+    os.replace(snapshot_path, plain_path)
+    try:
+        summary = compact_database(plain_path, snapshot_path)
+    finally:
+        os.remove(plain_path)
+    print(f"Re-encoded balls into keyed storage ({summary['bytes_after'] / 1e6:,.1f} MB)")
+
+
+def ingest(db_path: str, data_dir: str, dry_run: bool = False, keep: int = 2) -> dict:
+    """
+    Appends new matches from data_dir into a new snapshot of db_path,
+    refreshes derived tables for them and swaps the snapshot into place.
+    A dry run stops after parsing the new files.
+    """
+    start = time.perf_counter()
+    # Check the live database first: copying it is the expensive part
+    skip = read_error_log(db_path)
+    con = duckdb.connect(os.path.realpath(db_path), read_only=True)
+    try:
+        new = find_new_matches(con, data_dir, skip)
+    finally:
+        con.close()
+    print(f"{len(new)} new match file(s) in {data_dir}"
+          + (f" (unchanged files in the skip list {error_log_path(db_path)} left out)" if skip else ""))
+    if not new:
+        print("Nothing to ingest")
+        return {"match_ids": [], "balls": 0, "errors": {}, "seconds": time.perf_counter() - start}
+
+    if dry_run:
+        batch = parse_batch(list(new.values()))
+        for match_id, message in batch["errors"].items():
+            print(f"  would skip {match_id}: {message}")
+        print(f"Would append {len(batch['matches']['match_id'])} matches, "
+              f"{len(batch['balls']['match_id']):,} balls (dry run: nothing copied)")
+        return {"match_ids": batch["matches"]["match_id"], "balls": len(batch["balls"]["match_id"]),
+                "errors": batch["errors"], "seconds": time.perf_counter() - start}
+
+    snapshot_path = new_snapshot_path(db_path)
+    shutil.copyfile(os.path.realpath(db_path), snapshot_path)
+    con = duckdb.connect(snapshot_path)
+    try:
+        summary = append_matches(con, new)
+        for match_id, message in summary["errors"].items():
+            print(f"  skipped {match_id}: {message}")
+        if summary["errors"]:
+            record_errors(db_path, summary["errors"], new)
+
+        if summary["match_ids"]:
+            fill_countries(con, summary["match_ids"])
+            print(f"Appended {len(summary['match_ids'])} matches, {summary['balls']:,} balls")
+            tables = existing_derived_tables(con)
+            if tables:
+                print("Refreshing derived tables for the new matches")
+                build(con, tables, match_ids=summary["match_ids"])
+        con.execute("CHECKPOINT")
+    except BaseException:
+        con.close()
+        os.remove(snapshot_path)
+        raise
+    con.close()
+
+    finish_snapshot(db_path, snapshot_path, bool(summary["match_ids"]), keep)
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def bulk_load(db_path: str, data_dir: str, workers: int = None, batch_size: int = BATCH_SIZE,
+              dry_run: bool = False, keep: int = 2) -> dict:
+    """
+    Rebuilds matches/balls from every file in data_dir into a new snapshot,
+    carrying over the live database's other tables, and swaps it in.
+    """
+    start = time.perf_counter()
+    paths = sorted(glob.glob(os.path.join(data_dir, "*.json")))
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    snapshot_path = new_snapshot_path(db_path)
+    live_path = os.path.realpath(db_path) if os.path.exists(db_path) else None
+
+    con = duckdb.connect(snapshot_path)
+    summary = {"files": len(paths), "matches": 0, "balls": 0, "errors": {}}
+    try:
+        con.execute(SCHEMA_SQL)
+        print(f"Loading {len(paths):,} files in {len(batches)} batches on {workers or os.cpu_count()} workers")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            done = 0
+            for batch in pool.map(parse_batch, batches):
+                load_batch(con, batch)
+                done += len(batch["matches"]["match_id"]) + len(batch["errors"])
+                summary["matches"] += len(batch["matches"]["match_id"])
+                summary["balls"] += len(batch["balls"]["match_id"])
+                summary["errors"].update(batch["errors"])
+                elapsed = time.perf_counter() - start
+                print(f"\r  {done:,}/{len(paths):,} files  {summary['balls']:,} balls  "
+                      f"{summary['balls'] / elapsed:,.0f} balls/s  {len(summary['errors'])} errors",
+                      end="", flush=True)
+        print()
+        for match_id, message in sorted(summary["errors"].items()):
+            print(f"  skipped {match_id}: {message}")
+        if summary["errors"] and not dry_run:
+            record_errors(db_path, summary["errors"],
+                          {os.path.splitext(os.path.basename(p))[0]: p for p in paths})
+
+        derived, compact = [], False
+        if live_path:
+            con.execute(f"ATTACH '{live_path}' AS live (READ_ONLY)")
+            fill_countries(con, source="live.matches")
+            derived = existing_derived_tables(con, "live")
+            # Keyed storage is re-encoded at the end; its dimensions are copied to keep their keys
+            compact = is_compact(con, "live")
+            for table in sorted(table_names(con, "live") - CRICSHEET_TABLES - derived_table_names() - {KEYED_TABLE}):
+                print(f"Copying {table} from the live database")
+                con.execute(f"CREATE TABLE {table} AS SELECT * FROM live.{table}")
+            con.execute("DETACH live")
+        if derived:
+            print("Rebuilding derived tables")
+            build(con, derived)
+        con.execute("CHECKPOINT")
+    except BaseException:
+        con.close()
+        os.remove(snapshot_path)
+        raise
+    con.close()
+
+    if compact:
+        recompact(snapshot_path)
+    finish_snapshot(db_path, snapshot_path, summary["matches"] > 0 and not dry_run, keep)
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="cricket_analytics.duckdb")
+    parser.add_argument("--data", required=True, help="directory of Cricsheet match JSON files")
+    parser.add_argument("--bulk", action="store_true", help="rebuild matches/balls from every file")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes for --bulk (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="files per batch for --bulk")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="parse the new files and report them without copying the database "
+                             "(with --bulk: build the snapshot but do not swap it in)")
+    parser.add_argument("--keep", type=int, default=2, help="snapshots to keep for rollback")
+    args = parser.parse_args()
+
+    if args.bulk:
+        summary = bulk_load(args.db, args.data, args.workers, max(1, args.batch_size), args.dry_run, max(1, args.keep))
+        print(f"{summary['matches']:,} matches, {summary['balls']:,} balls in {summary['seconds']:.1f}s "
+              f"({summary['balls'] / max(summary['seconds'], 1e-9):,.0f} balls/s)")
+    else:
+        summary = ingest(args.db, args.data, args.dry_run, max(1, args.keep))
+        print(f"Done in {summary['seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
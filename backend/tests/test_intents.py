@@ -0,0 +1,118 @@
+"""
+Prompt -> (intent, params) cases for classify_intent, run against a small
+fixture database. A prompt the templates cannot answer exactly must return
+None so it goes to the LLM: a wrong template answer looks just as confident
+as a right one.
+"""
+import os
+import re
+from types import SimpleNamespace
+
+import duckdb
+import pytest
+from fastapi import HTTPException
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+import main  # noqa: E402
+
+# (batter, bowler, balls): AB Shaheen has more balls overall than J Shaheen,
+# the leading bowler of that surname
+DELIVERIES = [
+    ("V Kohli", "JJ Bumrah", 400),
+    ("JE Root", "J Shaheen", 300),
+    ("AB Shaheen", "JJ Bumrah", 900),
+    ("V Kohli", "J Shaheen", 200),
+]
+MATCHES = [
+    ("India", "Australia", "Wankhede Stadium, Mumbai", "T20"),
+    ("England", "India", "Lord's, London", "ODI"),
+    ("Australia", "England", "Wankhede Stadium, Mumbai", "T20"),
+]
+
+FILTERS = {"format": None, "gender": None, "phase": None, "from_year": None, "to_year": None,
+           "venue": None, "batting_team": None, "bowling_team": None}
+LEADERBOARD = {**FILTERS, "limit": main.INTENT_DEFAULT_LIMIT}
+
+CASES = [
+    ("Virat Kohli batting stats", "batting_career", {**FILTERS, "player": "V Kohli"}),
+    ("Kohli in T20s", "batting_career", {**FILTERS, "player": "V Kohli", "format": "T20"}),
+    ("Bumrah bowling since 2020", "bowling_career", {**FILTERS, "player": "JJ Bumrah", "from_year": 2020}),
+    ("Kohli powerplay against Australia", "batting_career",
+     {**FILTERS, "player": "V Kohli", "phase": "powerplay", "bowling_team": "Australia"}),
+    ("Kohli vs Bumrah", "batter_vs_bowler", {**FILTERS, "batter": "V Kohli", "bowler": "JJ Bumrah"}),
+    ("India vs Australia", "team_head_to_head",
+     {"format": None, "gender": None, "from_year": None, "to_year": None, "venue": None,
+      "team_a": "India", "team_b": "Australia"}),
+    ("top 5 run scorers", "batting_leaderboard_runs", {**LEADERBOARD, "limit": 5, "min_balls": 1}),
+    ("fastest scorers", "batting_leaderboard_strike_rate", {**LEADERBOARD, "min_balls": main.INTENT_MIN_BALLS}),
+    ("best economy in the death", "bowling_leaderboard_economy",
+     {**LEADERBOARD, "phase": "death", "min_balls": main.INTENT_MIN_BALLS}),
+    ("toss impact at Wankhede", "venue_toss",
+     {"format": None, "gender": None, "from_year": None, "to_year": None,
+      "venue": "Wankhede Stadium, Mumbai", "min_matches": 1, "limit": main.INTENT_MAX_LIMIT}),
+    # A surname several players share picks nobody, unless a first name does
+    ("Shaheen bowling", None, None),
+    ("J Shaheen bowling", "bowling_career", {**FILTERS, "player": "J Shaheen"}),
+    ("Jimmy Shaheen bowling", "bowling_career", {**FILTERS, "player": "J Shaheen"}),
+    # Single-innings questions are not career totals
+    ("Root best innings", None, None),
+    ("Root best bowling figures", None, None),
+    ("Root highest score", None, None),
+    ("best bowling figures", None, None),
+    # Filters the template has no parameter for
+    ("India vs Australia in the powerplay", None, None),
+    ("toss impact at Wankhede in death overs", None, None),
+    # Rankings the templates only sort the other way, or cannot measure
+    ("highest economy", None, None),
+    ("fastest bowlers", None, None),
+    ("what is the weather in Mumbai", None, None),
+]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def fixture_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("intents") / "cricket.duckdb")
+    con = duckdb.connect(path)
+    con.execute("CREATE TABLE balls (batter VARCHAR, bowler VARCHAR)")
+    for batter, bowler, balls in DELIVERIES:
+        con.execute("INSERT INTO balls SELECT ?, ? FROM range(?)", [batter, bowler, balls])
+    con.execute("CREATE TABLE matches (team1 VARCHAR, team2 VARCHAR, venue VARCHAR, format VARCHAR)")
+    con.executemany("INSERT INTO matches VALUES (?, ?, ?, ?)", MATCHES)
+    con.close()
+
+    original = main.db_path
+    main.db_path = path
+    main.intent_entities.cache_clear()
+    main.available_tables.cache_clear()
+    yield path
+    main.db_path = original
+    main.intent_entities.cache_clear()
+    main.available_tables.cache_clear()
+
+
+@pytest.mark.parametrize("prompt, intent, params", CASES, ids=[case[0] for case in CASES])
+def test_classify_intent(prompt, intent, params):
+    result = main.classify_intent(prompt)
+    if intent is None:
+        assert result is None, f"{prompt!r} matched {result and result['name']}"
+    else:
+        assert result is not None, f"{prompt!r} was not matched"
+        assert (result["name"], result["params"]) == (intent, params)
+
+
+def test_ambiguous_surname_is_refused_by_matchup_lookup():
+    store = SimpleNamespace(ids={"AB Shaheen": 0, "J Shaheen": 1, "V Kohli": 2})
+    assert main.resolve_player("kohli", store) == "V Kohli"
+    with pytest.raises(HTTPException) as refused:
+        main.resolve_player("Shaheen", store)
+    assert refused.value.status_code == 400
+    assert "AB Shaheen" in refused.value.detail and "J Shaheen" in refused.value.detail
+
+
+def test_keyed_templates_read_only_keys():
+    # In keyed storage a name column would go through the `balls` view's lookups
+    for name, sql in main.INTENT_TEMPLATES.items():
+        if name.endswith("_keyed"):
+            assert "FROM balls_keyed b" in sql and "FROM balls b" not in sql, name
+            assert not re.search(r"b\.(batter|non_striker|bowler|dismissed_batter|batting_team|bowling_team)\b",
+                                 sql), name
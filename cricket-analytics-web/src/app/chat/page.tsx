@@ -2,7 +2,7 @@
 
 import React, { useState, useRef, useEffect } from 'react';
 import MainLayout from '@/components/MainLayout';
-import RichChart from '@/components/RichChart';
+import RichChart, { ChartSeries, ChartType } from '@/components/RichChart';
 import DataTable from '@/components/DataTable';
 import {
   ArrowRight, User, Bot, Database, Code, Table2, BarChart3,
@@ -18,10 +18,19 @@ interface Message {
   timestamp: Date;
   sql?: string;
   data?: any[];
+  charts?: ChartRecommendation[];
   error?: string;
   isLoading?: boolean;
 }
 
+// Chart recommendation from /analyze-deep, with its server-built series
+interface ChartRecommendation {
+  chart_type: ChartType;
+  title: string;
+  description: string;
+  series?: ChartSeries | null;
+}
+
 // Validation claim type
 interface ClaimVerification {
   claim_id: number;
@@ -160,6 +169,7 @@ export default function ChatPage() {
                 content: data.executive_summary || `Deep analysis completed with ${data.steps.length} steps`,
                 sql: data.steps.map((s: any) => s.sql_query).filter(Boolean).join('\n\n-- Step ---\n\n'),
                 data: allData.slice(0, 100), // Limit for display
+                charts: (data.charts || []).filter((c: ChartRecommendation) => c.series),
               }
             : msg
         ));
@@ -314,7 +324,7 @@ export default function ChatPage() {
   };
 
   // Render data visualization
-  const renderDataVisualization = (data: any[], sql: string) => {
+  const renderDataVisualization = (data: any[], sql: string, charts?: ChartRecommendation[]) => {
     if (!data || data.length === 0) return null;
 
     const columns = Object.keys(data[0]);
@@ -342,7 +352,20 @@ export default function ChatPage() {
           highlightFirst={true}
         />
 
-        {numericColumns.length > 0 && data.length <= 20 && (
+        {charts && charts.length > 0 ? (
+          <div className="grid md:grid-cols-2 gap-6">
+            {charts.map((chart, index) => (
+              <RichChart
+                key={`${chart.title}-${index}`}
+                title={chart.title}
+                subtitle={chart.description}
+                series={chart.series}
+                type={chart.chart_type}
+                height={300}
+              />
+            ))}
+          </div>
+        ) : numericColumns.length > 0 && data.length <= 20 && (
           <RichChart
             title="Visual Summary"
             data={data.slice(0, 10)}
@@ -614,7 +637,7 @@ export default function ChatPage() {
                             </div>
                           )}
 
-                          {message.data && message.sql && renderDataVisualization(message.data, message.sql)}
+                          {message.data && message.sql && renderDataVisualization(message.data, message.sql, message.charts)}
                         </>
                       )}
                     </div>
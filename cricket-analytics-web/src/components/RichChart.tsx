@@ -7,13 +7,26 @@ import {
   PolarGrid, PolarAngleAxis, PolarRadiusAxis, ComposedChart, ScatterChart, Scatter
 } from 'recharts';
 
+export type ChartType = 'bar' | 'line' | 'pie' | 'area' | 'radar' | 'composed' | 'scatter' | 'horizontal-bar';
+
+// Chart-ready points built by the backend (already aggregated and downsampled)
+export interface ChartSeries {
+  x_key: string;
+  y_keys: string[];
+  points: any[];
+  aggregation: Record<string, string>;
+  source_rows: number;
+  downsampled: boolean;
+}
+
 interface ChartProps {
-  data: any[];
-  type: 'bar' | 'line' | 'pie' | 'area' | 'radar' | 'composed' | 'scatter' | 'horizontal-bar';
+  data?: any[];
+  series?: ChartSeries | null;
+  type: ChartType;
   title: string;
   subtitle?: string;
-  xKey: string;
-  yKeys: string[];
+  xKey?: string;
+  yKeys?: string[];
   colors?: string[];
   height?: number;
   showLegend?: boolean;
@@ -23,17 +36,25 @@ interface ChartProps {
 const CHART_COLORS = ['#8b5cf6', '#3b82f6', '#10b981', '#f59e0b', '#ef4444', '#ec4899', '#06b6d4'];
 
 const RichChart: React.FC<ChartProps> = ({
-  data,
+  data: rows = [],
+  series,
   type,
   title,
   subtitle,
-  xKey,
-  yKeys,
+  xKey: xKeyProp = '',
+  yKeys: yKeysProp = [],
   colors = CHART_COLORS,
   height = 400,
   showLegend = true,
   stacked = false
 }) => {
+  // Prefer the server-built series: it is capped, so large results never reach the renderer
+  const data = series ? series.points : rows;
+  const xKey = series ? series.x_key : xKeyProp;
+  const yKeys = series ? series.y_keys : yKeysProp;
+  const caption = subtitle
+    ?? (series?.downsampled ? `Summarised from ${series.source_rows.toLocaleString()} rows` : undefined);
+
   const renderChart = () => {
     switch (type) {
       case 'bar':
@@ -217,7 +238,7 @@ const RichChart: React.FC<ChartProps> = ({
     <div className="bg-white dark:bg-gray-800 p-6 rounded-xl border border-gray-200 dark:border-gray-700 shadow-sm hover:shadow-md transition-shadow">
       <div className="mb-6">
         <h3 className="text-lg font-bold text-gray-900 dark:text-white">{title}</h3>
-        {subtitle && <p className="text-sm text-gray-500 dark:text-gray-400 mt-1">{subtitle}</p>}
+        {caption && <p className="text-sm text-gray-500 dark:text-gray-400 mt-1">{caption}</p>}
       </div>
       <div style={{ height: height }} className="w-full">
         <ResponsiveContainer width="100%" height="100%">